@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+#
+# asyncrun.py
+#
+# Runs many independent external commands concurrently with asyncio.
+#
+# Commands are argument lists executed without a shell, so paths and patterns
+# need no quoting. At most `limit` run at the same time, each one is killed
+# after `timeout` seconds, and the exit code, output, error output and
+# duration of each one are returned in the order of the commands.
+import asyncio
+import time
+
+class CommandResult:
+  def __init__(self, args):
+    self.args=args
+    self.returncode=None
+    self.stdout=b''
+    self.stderr=b''
+    self.seconds=0.0
+    self.timed_out=False
+    self.error=None
+
+  def ok(self):
+    return self.returncode==0 and not self.timed_out and self.error is None
+
+  def describe(self):
+    # one line explaining a failure, for alerts and debugging output
+    if self.error is not None:
+      return "cannot run {}: {}".format(self.args[0],self.error)
+    if self.timed_out:
+      return "timed out after {:.1f}s".format(self.seconds)
+    message=self.stderr.decode('utf-8','replace').strip().splitlines()
+    return "exit code {}{}".format(self.returncode,": "+message[-1] if message else "")
+
+async def run_command(args, semaphore, timeout, cwd=None):
+  res=CommandResult(args)
+  async with semaphore:
+    start=time.time()
+    try:
+      proc=await asyncio.create_subprocess_exec(*args,cwd=cwd,stdin=asyncio.subprocess.DEVNULL,
+                                                stdout=asyncio.subprocess.PIPE,stderr=asyncio.subprocess.PIPE)
+    except OSError as e:
+      res.error=str(e)
+      res.seconds=time.time()-start
+      return res
+    try:
+      res.stdout,res.stderr=await asyncio.wait_for(proc.communicate(),timeout)
+    except asyncio.TimeoutError:
+      res.timed_out=True
+      proc.kill()
+      await proc.wait()
+    res.returncode=proc.returncode
+    res.seconds=time.time()-start
+  return res
+
+async def run_commands(commands, limit, timeout):
+  semaphore=asyncio.Semaphore(limit)
+  return await asyncio.gather(*[run_command(args,semaphore,timeout) for args in commands])
+
+def run_all(commands, limit=8, timeout=60):
+  # list of CommandResult, in the order of commands
+  if not commands:
+    return []
+  return asyncio.run(run_commands(commands,limit,timeout))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# benchmark.py
+#
+# This program times check_deployments.py and check_obsoleteness.py on synthetic deployments trees of increasing size built by make_test_tree.py.
+#
+# For each size, a tree is generated under a temporary folder and both inspectors are run on it with --timings; the
+# wall time and the scan, git and dependency phases they report are printed as one TSV row per tool and size.
+#
+# Arguments:
+# This python3 program takes six optional arguments:
+# -z | --sizes | comma-separated tree sizes as PIPELINESxVERSIONS (optional, default 10x3,40x4,160x5)
+# -G | --git-pipelines | number of pipelines with git repositories per tree, -1 for all (optional, default 20)
+# -j | --jobs | number of repositories checked at the same time by check_deployments.py (optional, default 8)
+# -n | --repeats | runs per tool and size, the fastest is reported (optional, default 1)
+# -k | --keep | keep the generated trees (optional)
+# -g | --git | the git executable (optional, default git)
+import argparse
+import os,sys
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+mydesc = """
+This program times check_deployments.py and check_obsoleteness.py on synthetic deployments trees of increasing size built by make_test_tree.py.
+"""
+
+HERE=os.path.dirname(os.path.abspath(__file__))
+TIMINGS=re.compile(r"^Timings: (.*)$",re.MULTILINE)
+PHASES=["scan","checks","git","deps","graph","space"]
+
+def parse_timings(output):
+  hit=TIMINGS.search(output)
+  phases={}
+  if hit:
+    for part in hit.group(1).split(", "):
+      name,seconds=part.rsplit(" ",1)
+      phases[name]=float(seconds.rstrip("s"))
+  return phases
+
+def run_tool(args):
+  start=time.time()
+  proc=subprocess.run([sys.executable]+args,stdout=subprocess.PIPE,stderr=subprocess.STDOUT,universal_newlines=True)
+  wall=time.time()-start
+  if proc.returncode!=0:
+    sys.exit("Failed: {}\n{}".format(" ".join(args),proc.stdout[-2000:]))
+  return wall,parse_timings(proc.stdout)
+
+def main():
+  parser = argparse.ArgumentParser(description=mydesc, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-z', '--sizes', type=str, default="10x3,40x4,160x5", help="comma-separated tree sizes as PIPELINESxVERSIONS (optional, default 10x3,40x4,160x5)")
+  parser.add_argument('-G', '--git-pipelines', type=int, default=20, help="number of pipelines with git repositories per tree, -1 for all (optional, default 20)")
+  parser.add_argument('-j', '--jobs', type=int, default=8, help="number of repositories checked at the same time by check_deployments.py (optional, default 8)")
+  parser.add_argument('-n', '--repeats', type=int, default=1, help="runs per tool and size, the fastest is reported (optional, default 1)")
+  parser.add_argument('-k', '--keep', action='store_true', help="keep the generated trees (optional)")
+  parser.add_argument('-g', '--git', type=str, default="git", help="the git executable (optional, default git)")
+  my_args = parser.parse_args()
+  print("\t".join(["size","tool","wall"]+PHASES+["total"]))
+  for size in my_args.sizes.split(","):
+    n_pipelines,n_versions=size.lower().split("x")
+    tree=tempfile.mkdtemp(prefix="dlmp_bench_")
+    try:
+      subprocess.run([sys.executable,os.path.join(HERE,"make_test_tree.py"),"-o",tree,"-n",n_pipelines,"-m",n_versions,
+                      "-G",str(my_args.git_pipelines),"-g",my_args.git],check=True,stdout=subprocess.DEVNULL)
+      tools=[("check_deployments",[os.path.join(HERE,"check_deployments.py"),"-a","-r",tree,"-j",str(my_args.jobs),"-t"]),
+             ("check_obsoleteness",[os.path.join(HERE,"check_obsoleteness.py"),"-r",tree,"-s","-t"])]
+      for name,args in tools:
+        best=None
+        for i in range(my_args.repeats):
+          wall,phases=run_tool(args)
+          if best is None or wall<best[0]:
+            best=(wall,phases)
+        wall,phases=best
+        row=[size,name,"{:.3f}".format(wall)]+["{:.3f}".format(phases[p]) if p in phases else "-" for p in PHASES+["total"]]
+        print("\t".join(row))
+        sys.stdout.flush()
+    finally:
+      if my_args.keep:
+        print("Tree kept in "+tree)
+      else:
+        shutil.rmtree(tree,ignore_errors=True)
+
+if __name__ == "__main__":
+  main()
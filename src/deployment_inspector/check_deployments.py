@@ -3,21 +3,40 @@
 # check_deployments.py
 #
 # Author: Yupeng Wang
-# 
+#
 # This program extracts deployment information for a pipeline to quickly identify deployment problems.
 # This program assesses all deployments of a pipeline under prod, sandbox, qa and dev.
-# 
+#
 # Arguments:
-# This python3 program takes one required and one optional arguments:
-# -p | --pname | the exact pipeline name
+# This python3 program takes one required and twelve optional arguments:
+# -p | --pname | the exact pipeline name (required unless --all is given)
+# -a | --all | audit every pipeline found under prod, sandbox, qa and dev (optional)
 # -d | --debug | in debugging mode (optional)
+# -r | --root | the root holding prod, sandbox, qa and dev (optional, default /dlmp)
+# -w | --workers | number of threads scanning the file system (optional, default 16)
+# -j | --jobs | number of repositories checked at the same time (optional, default 8)
+# -o | --json | write the structured report to this JSON file (optional)
+# -s | --status | also run git status to detect staged or untracked changes (optional)
+# -g | --git | the git executable used by --status (optional)
+# -T | --timeout | seconds after which a git status is abandoned (optional, default 60)
+# -i | --inventory | inventory snapshot reused and updated by this run (optional)
+# -c | --changes | print what changed since the previous snapshot (optional, requires -i)
+# -t | --timings | print the time spent in each phase (optional)
 ######################
 import argparse
+import json
 import os,sys
 import re
-import subprocess
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import scanner
+import git_meta
+import asyncrun
+import rules
+from phase_timer import PhaseTimer
+import inventory as snapshots
 
-git="/usr/local/biotools/git/2.8.0/bin/git"
 
 mydesc = """
 This program extracts deployment information for a pipeline to quickly identify deployment problems.
@@ -25,20 +44,33 @@ This program assesses all deployments of a pipeline under prod, sandbox, qa and
 """
 
 parser = argparse.ArgumentParser(description=mydesc, formatter_class=argparse.RawDescriptionHelpFormatter)
-parser.add_argument('-p', '--pname', type=str, required=True, help="the exact pipeline name")
+parser.add_argument('-p', '--pname', type=str, help="the exact pipeline name (required unless --all is given)")
+parser.add_argument('-a', '--all', action='store_true', help="audit every pipeline found under prod, sandbox, qa and dev (optional)")
 parser.add_argument('-d', '--debug', action='store_true', help="in debugging mode (optional)")
+parser.add_argument('-r', '--root', type=str, default=scanner.DEFAULT_ROOT, help="the root holding prod, sandbox, qa and dev (optional, default /dlmp)")
+parser.add_argument('-w', '--workers', type=int, default=16, help="number of threads scanning the file system (optional, default 16)")
+parser.add_argument('-j', '--jobs', type=int, default=8, help="number of repositories checked at the same time (optional, default 8)")
+parser.add_argument('-o', '--json', type=str, help="write the structured report to this JSON file (optional)")
+parser.add_argument('-s', '--status', action='store_true', help="also run `git status` to detect staged or untracked changes (optional, slower)")
+parser.add_argument('-g', '--git', type=str, default="/usr/local/biotools/git/2.8.0/bin/git", help="the git executable used by --status (optional)")
+parser.add_argument('-i', '--inventory', type=str, help="inventory snapshot reused and updated by this run (optional)")
+parser.add_argument('-c', '--changes', action='store_true', help="print what changed since the previous snapshot (optional, requires -i)")
+parser.add_argument('-T', '--timeout', type=float, default=60, help="seconds after which a git status is abandoned (optional, default 60)")
+parser.add_argument('-t', '--timings', action='store_true', help="print the time spent in each phase (optional)")
 my_args = parser.parse_args()
+if my_args.pname is None and not my_args.all:
+  parser.error("either -p/--pname or -a/--all is required")
+if my_args.changes and not my_args.inventory:
+  parser.error("-c/--changes requires -i/--inventory")
 debugging=my_args.debug
-pname=my_args.pname
-
-def runcmd(command):
-  process=subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-  output=process.communicate()[0]
-  exitCode=process.returncode
-  if exitCode==0:
-    return output
-  else:
-    return "NA"
+root=my_args.root
+check_status=my_args.status
+git=my_args.git
+branch_filter=re.compile("master|release",re.IGNORECASE)
+# compiled once and shared by every pipeline of every environment
+entry_rules=rules.pipeline_rules()
+repo_rules=rules.src_rules()
+snapshot=snapshots.Snapshot(my_args.inventory,root) if my_args.inventory else None
 
 def format_out(space,raw):
   line=raw.splitlines()
@@ -53,155 +85,289 @@ def format_out(space,raw):
         new_out=new_out+"\n"+space+rline[i]
   return new_out
 
-super_dir_names=["prod","sandbox","qa","dev"]
+super_dir_names=scanner.SUPER_DIR_NAMES
 check_dir_names=["prod","sandbox"]
 check_dir_names_2=["sandbox","qa"]
 
-for eachDirName in super_dir_names:
-  pipeline_path=os.path.join("/dlmp",eachDirName,"scripts/deployments",pname)
-  print("\nChecking in {}".format(eachDirName))
+# HEAD keyword, matching ref and master/release branches containing it; with
+# a snapshot, they are reused while the refs and HEAD of the clone are unchanged
+def read_git(src_path,history):
+  facts={"error":None,"head":None,"keyword":None,"detached":None,"ref":None,"branches":None,"branch_error":None}
+  try:
+    repo=git_meta.GitRepo(src_path,history)
+  except (git_meta.GitError,IOError,OSError,zlib.error) as e:
+    facts["error"]=str(e)
+    return facts
+  try:
+    stamp=repo.stamp() if snapshot is not None else None
+    cached=snapshot.git(src_path,stamp) if snapshot is not None else None
+    if cached is not None:
+      snapshot.put_git(src_path,cached)
+      return cached["facts"]
+    try:
+      facts["keyword"],facts["detached"]=repo.head_keyword()
+      facts["head"]=repo.head()[1]
+    except (git_meta.GitError,IOError,OSError,zlib.error) as e:
+      # a corrupt object read while peeling a tag makes the repository unreadable
+      facts["error"]=str(e)
+      return facts
+    ref=repo.find_ref(facts["keyword"])
+    if ref is not None:
+      facts["ref"]=list(ref)
+      try:
+        facts["branches"]=repo.branches_containing(ref[0],branch_filter)
+      except (git_meta.GitError,IOError,OSError,zlib.error) as e:
+        facts["branch_error"]=str(e)
+    if snapshot is not None:
+      snapshot.put_git(src_path,{"stamp":stamp,"head":facts["head"],"facts":facts})
+    return facts
+  finally:
+    repo.close()
+
+# Every check below records what it would print in "lines" and its alerts in
+# "alerts", so that repositories can be checked concurrently and their output
+# still printed in order.
+def check_repository(eachDirName,pname,ffname,eachItem,src_path,history,status=None):
+  res={"env":eachDirName,"pipeline":pname,"deployment":ffname,"repository":eachItem,"path":src_path,
+       "keyword":None,"detached":None,"ref":None,"branches":None,"git_seconds":0.0,"status_seconds":0.0,"passed":True,"alerts":[],"lines":[]}
+  lines=res["lines"]
+  def alert(msg):
+    res["alerts"].append(msg)
+    return "\n!!!Alert: "+msg
+  lines.append("        Assessing repository: "+eachItem)
   if debugging:
-    print("Pipeline directory: "+pipeline_path)
-  if not os.path.isdir(pipeline_path):
-    print("Pipeline name is incorrect or pipeline folder is missing")
-    continue
+    lines.append("Reading git metadata...")
+  git_check=1
+  git_error_msg=""
+  git_start=time.time()
+  facts=read_git(src_path,history)
+  res["git_seconds"]=time.time()-git_start
+  if facts["error"] is not None:
+    git_check=0
+    git_error_msg=alert("Cannot read git metadata")
+    if debugging:
+      lines.append("Cannot read git metadata: {}".format(facts["error"]))
   else:
+    keyword=facts["keyword"]
+    detached=facts["detached"]
+    if status is not None:
+      res["status_seconds"]=status.seconds
+      if not status.ok():
+        git_check=0
+        git_error_msg=alert("Cannot obtain git status")
+        if debugging:
+          lines.append("Cannot obtain git status: "+status.describe())
+      else:
+        git_status_out=status.stdout.decode('utf-8','replace')
+        if debugging:
+          lines.append("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
+          lines.append("Git status information:\n"+format_out("  ",git_status_out))
+          lines.append("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
+        if re.search("staged",git_status_out,re.IGNORECASE) or re.search("Untracked",git_status_out,re.IGNORECASE):
+          git_check=0
+          git_error_msg=git_error_msg+alert("Source files were modified after deployment!")
+          if debugging:
+            lines.append("            !!!Alert:Source files were modified after deployment!")
+    res["keyword"]=keyword
+    res["detached"]=detached
     if debugging:
-      print("Checking the pipeline directory...")
-    items=os.listdir(pipeline_path)
-    deploy_file_check=0
-    property_file_check=0
-    deployments=[]
-    for eachItem in items:
-      good_file_check=0
-      if re.search("deploy.sh",eachItem):
-        deploy_file_check=1
-        good_file_check=1
-      if re.search("properties",eachItem):
-        property_file_check=1
-        good_file_check=1
-      if re.search("[\d]+.[\d]+.[\d]+",eachItem):
-        if re.search("^[vV]?\d.\d\d.\d\d$",eachItem):
-          deployments.append(eachItem)
-          good_file_check=1
-        else:
-          print("    !!!Alert: "+eachItem+" looks like a deployment, but its naming is incorrect!")
-          good_file_check=-1
-      if good_file_check==0:
-        print("    !!!Alert: "+eachItem+" is a redundant file")
-    if deploy_file_check==0:
-        print("    !!!Alert: deploy.sh is missing")
-    if property_file_check==0:
-        print("    !!!Alert: .property file is missing")
-    if len(deployments)==0:
-      print("    !!!Alert: No version deployments were found!")
-    else:
-      deployments.sort()
-      if eachDirName=="prod":
-        prod_deployments=set(deployments)
-      if eachDirName in check_dir_names_2:
-        curr_deployments=set(deployments)
-        miss_deployments=prod_deployments.difference(curr_deployments)
-        if len(miss_deployments)>0:
-          print("    The following deployments are missing: "+", ".join(miss_deployments))
-      print("    "+str(len(deployments))+ " deployment(s) were found, including: "+', '.join(deployments))
-    for ffname in deployments:
-      print("    Assessing deployment: "+ffname)
-      src_dir=os.path.join(pipeline_path,ffname,"src")
-      if not os.path.isdir(src_dir):
-        print("    !!!Alert: There is NO src folder under this deployment!")
-        continue
-      src_items=os.listdir(src_dir)
-      for eachItem in src_items:
-        if re.search("LPEA_CAD",eachItem):
-          print("        Assessing repository: "+eachItem)
-          src_path=os.path.join(src_dir,eachItem)
+      lines.append("Keyword: {} ({})".format(keyword,"detached HEAD" if detached else "branch"))
+    if eachDirName in check_dir_names:
+      if re.search(pname,eachItem,re.IGNORECASE):
+        if not re.search(ffname,keyword):
+          git_check=0
+          git_error_msg=git_error_msg+alert("tag name "+keyword+" does not match version name "+ffname+" under Prod/Sandbox!")
           if debugging:
-            print("Checking git status...")
-          git_check=1
-          git_error_msg=""
-          os.chdir(src_path)
-          cmd=git+" status"
-          info=runcmd(cmd)
-          if info == "NA":
-            git_check=0
-            git_error_msg="!!!Alert: Cannot obtain git status"
-            if debugging:
-              print("Cannot obtain git status")
-          else:
-            git_status_out=info.decode('utf-8')
-            if debugging:
-              print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-              print("Git status information:\n"+format_out("  ",git_status_out))
-              print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-            if re.search("staged",git_status_out,re.IGNORECASE) or re.search("Untracked",git_status_out,re.IGNORECASE):
+            lines.append("            !!!Alert: Tag name {} does not match version name {} under Prod/Sandbox!".format(keyword,ffname))
+    ref=facts["ref"]
+    if ref is None:
+      git_check=0
+      git_error_msg=git_error_msg+alert("Could not get git ref information")
+      if debugging:
+        lines.append("            !!!Alert: Could not get git ref information")
+    else:
+      commit_code,ref_name=ref
+      res["ref"]={"sha":commit_code,"name":ref_name}
+      if debugging:
+        lines.append("Git ref information: {} {}".format(commit_code,ref_name))
+      branches=facts["branches"]
+      if branches is None:
+        git_check=0
+        git_error_msg=git_error_msg+alert("Could not obtain branch information")
+        if debugging:
+          lines.append("            !!!Alert: Could not obtain branch information: {}".format(facts["branch_error"]))
+      if branches is not None:
+        res["branches"]=branches
+        git_branch_out="\n".join(branches)
+        if debugging:
+          lines.append("Master/release branches containing the commit: {}".format(", ".join(branches) if branches else "none"))
+        if re.search(pname,eachItem,re.IGNORECASE):
+          if eachDirName in check_dir_names:
+            if re.search("master",git_branch_out,re.IGNORECASE) is None:
               git_check=0
-              git_error_msg=git_error_msg+"\n!!!Alert: Source files were modified after deployment!"
+              git_error_msg=git_error_msg+alert("Branch is NOT on master under Prod/Sandbox!")
               if debugging:
-                print("            !!!Alert:Source files were modified after deployment!")
-            keyword=''
-            p1=re.compile("HEAD detached [atfrom]+ (.*)")
-            hit1=p1.search(git_status_out)
-            if hit1:
-              keyword=hit1.group(1)
-            else:
-              p2=re.compile("On branch (.*)")
-              hit2=p2.search(git_status_out) 
-              if hit2:
-                keyword=hit2.group(1)
-            if debugging:
-              print("Keyword: {}".format(keyword))
-            if eachDirName in check_dir_names:
-              if re.search(pname,eachItem,re.IGNORECASE):
-                if not re.search(ffname,keyword):
-                  git_check=0
-                  git_error_msg=git_error_msg+"\n!!!Alert: tag name "+keyword+" does not match version name "+ffname+" under Prod/Sandbox!"
-                  if debugging:
-                    print("            !!!Alert: Tag name {} does not match version name {} under Prod/Sandbox!".format(keyword,ffname))
-            cmd=git+" show-ref | grep "+keyword
-            info=runcmd(cmd)
-            if info == "NA":
+                lines.append("            !!!Alert: Branch is NOT on master under Prod/Sandbox!")
+          if eachDirName == "qa":
+            if re.search("release",git_branch_out,re.IGNORECASE) is None:
               git_check=0
-              git_error_msg=git_error_msg+"\n!!!Alert: Could not get git ref information"
+              git_error_msg=git_error_msg+alert("Branch is NOT on release under QA")
               if debugging:
-                print("            !!!Alert: Could not get git ref information")
-            else:
-              git_ref_out=info.decode('utf-8')
-              if debugging:
-                print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-                print("Git ref information:\n"+format_out("  ",git_ref_out))
-                print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-              commit_code=git_ref_out.split('\n')[0].split(' ')[0]
-              cmd=git+" branch -a --contains "+commit_code
-              info=runcmd(cmd)
-              if info == "NA":
-                git_check=0
-                git_error_msg=git_error_msg+"\n!!!Alert: Could not obtain branch information"
-                if debugging:
-                  print("            !!!Alert: Could not obtain branch information")
-              else:
-                git_branch_out=info.decode('utf-8')
-                if debugging:
-                  print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-                  print("Git branch information:\n"+format_out("  ",git_branch_out))
-                  print("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-                if re.search(pname,eachItem,re.IGNORECASE):
-                  if eachDirName in check_dir_names:
-                    if re.search("master",git_branch_out,re.IGNORECASE) is None:
-                      git_check=0
-                      git_error_msg=git_error_msg+"\n!!!Alert: Branch is NOT on master under Prod/Sandbox!"
-                      if debugging:
-                        print("            !!!Alert: Branch is NOT on master under Prod/Sandbox!")
-                  if eachDirName == "qa":
-                    if re.search("release",git_branch_out,re.IGNORECASE) is None:
-                      git_check=0
-                      git_error_msg=git_error_msg+"\n!!!Alert: Branch is NOT on release under QA"
-                      if debugging:
-                        print("            !!!Alert: Branch is NOT on release under QA")
-          if git_check==0:
-            print("\n"+format_out("            ",git_error_msg)+"\n")
-            if debugging:
-              print("!!!Alert: Git check FAILED for {}, {}, {}.\n".format(eachItem,ffname,eachDirName))
-          else:
-            if debugging:
-              print("Git check PASSED for {}, {}, {}.\n".format(eachItem,ffname,eachDirName))                       
+                lines.append("            !!!Alert: Branch is NOT on release under QA")
+  if git_check==0:
+    res["passed"]=False
+    lines.append("\n"+format_out("            ",git_error_msg)+"\n")
+    if debugging:
+      lines.append("!!!Alert: Git check FAILED for {}, {}, {}.\n".format(eachItem,ffname,eachDirName))
+  else:
+    if debugging:
+      lines.append("Git check PASSED for {}, {}, {}.\n".format(eachItem,ffname,eachDirName))
+  return res
+
+# Checks the pipeline folder of one environment; the "repositories" of each
+# deployment list what check_repository is called with, then its results.
+def check_pipeline(eachDirName,pname,pipeline,prod_deployments):
+  pipeline_path=os.path.join(scanner.deployments_dir(root,eachDirName),pname)
+  res={"env":eachDirName,"pipeline":pname,"path":pipeline_path,"found":pipeline is not None,
+       "alerts":[],"deployments":[],"lines":["\nChecking in {}".format(eachDirName)]}
+  lines=res["lines"]
+  def alert(msg):
+    res["alerts"].append(msg)
+    lines.append("    !!!Alert: "+msg)
+  if debugging:
+    lines.append("Pipeline directory: "+pipeline_path)
+  if pipeline is None:
+    lines.append("Pipeline name is incorrect or pipeline folder is missing")
+    return res
+  if debugging:
+    lines.append("Checking the pipeline directory...")
+  scanned={d.name:d for d in pipeline.deployments}
+  items=pipeline.entries
+  deploy_file_check=0
+  property_file_check=0
+  deployments=[]
+  for eachItem in items:
+    tags=entry_rules.classify(eachItem)
+    if "deploy_script" in tags:
+      deploy_file_check=1
+    if "properties" in tags:
+      property_file_check=1
+    if "deployment" in tags:
+      deployments.append(eachItem)
+    for msg in entry_rules.alerts(eachItem):
+      alert(msg)
+  if deploy_file_check==0:
+    alert("deploy.sh is missing")
+  if property_file_check==0:
+    alert(".property file is missing")
+  if len(deployments)==0:
+    alert("No version deployments were found!")
+  else:
+    deployments.sort(key=rules.parse_version)
+    if eachDirName=="prod":
+      prod_deployments.update(deployments)
+    if eachDirName in check_dir_names_2:
+      miss_deployments=sorted(prod_deployments.difference(deployments))
+      res["missing"]=miss_deployments
+      if len(miss_deployments)>0:
+        lines.append("    The following deployments are missing: "+", ".join(miss_deployments))
+    lines.append("    "+str(len(deployments))+ " deployment(s) were found, including: "+', '.join(deployments))
+  for ffname in deployments:
+    dep={"name":ffname,"alerts":[],"repositories":[]}
+    res["deployments"].append(dep)
+    src_dir=os.path.join(pipeline_path,ffname,"src")
+    if ffname not in scanned or scanned[ffname].src_items is None:
+      dep["alerts"].append("There is NO src folder under this deployment!")
+      continue
+    for eachItem in scanned[ffname].src_items:
+      if "repository" in repo_rules.classify(eachItem):
+        dep["repositories"].append((eachDirName,pname,ffname,eachItem,os.path.join(src_dir,eachItem)))
+  return res
+
+def print_pipeline(res):
+  for line in res["lines"]:
+    print(line)
+  for dep in res["deployments"]:
+    print("    Assessing deployment: "+dep["name"])
+    for msg in dep["alerts"]:
+      print("    !!!Alert: "+msg)
+    for repo in dep["repositories"]:
+      for line in repo["lines"]:
+        print(line)
+
+timer=PhaseTimer()
+if my_args.all:
+  pnames=None
+else:
+  pnames=[my_args.pname]
+inventory=scanner.scan(root,super_dir_names,pipelines=pnames,profiles=False,workers=my_args.workers,snapshot=snapshot)
+if pnames is None:
+  pnames=sorted(set(name for env in super_dir_names if inventory[env] is not None for name in inventory[env]))
+timer.lap("scan")
+# clones of the same project share their commit ancestries
+history=git_meta.SharedHistory()
+report=[]
+for pname in pnames:
+  prod_deployments=set()
+  for eachDirName in super_dir_names:
+    envs=inventory[eachDirName]
+    pipeline=envs.get(pname) if envs is not None else None
+    report.append(check_pipeline(eachDirName,pname,pipeline,prod_deployments))
+deps=[dep for res in report for dep in res["deployments"]]
+statuses={}
+if check_status:
+  # git status is the only external command left, all of them run concurrently
+  paths=[spec[4] for dep in deps for spec in dep["repositories"]]
+  results=asyncrun.run_all([[git,"-C",path,"status"] for path in paths],limit=my_args.jobs,timeout=my_args.timeout)
+  statuses=dict(zip(paths,results))
+  timer.lap("status")
+with ThreadPoolExecutor(max_workers=my_args.jobs) as pool:
+  for dep in deps:
+    dep["repositories"]=[pool.submit(check_repository,*spec,history=history,status=statuses.get(spec[4])) for spec in dep["repositories"]]
+  # print each pipeline as soon as its own repositories are done
+  current=None
+  for res in report:
+    for dep in res["deployments"]:
+      dep["repositories"]=[job.result() for job in dep["repositories"]]
+    if my_args.all and res["pipeline"]!=current:
+      current=res["pipeline"]
+      print("\n==================== Pipeline: {} ====================".format(current))
+    print_pipeline(res)
+
+timer.lap("checks")
+repos=[repo for res in report for dep in res["deployments"] for repo in dep["repositories"]]
+status_seconds=sum(repo["status_seconds"] for repo in repos)
+# summed over the repositories, so larger than their share of the checks with -j above 1
+timer.add("git",sum(repo["git_seconds"] for repo in repos))
+if check_status:
+  timer.add("status-sum",status_seconds)
+  print("\nTime spent in git status checks: {:.2f}s".format(status_seconds))
+if snapshot is not None:
+  if my_args.changes:
+    print("\nChanges since the previous snapshot:")
+    for line in snapshot.changes():
+      print("    "+line)
+  if debugging:
+    print("Inventory snapshot: "+snapshot.format_counts())
+  snapshot.save()
+if my_args.json:
+  n_alerts=0
+  n_failed=0
+  for res in report:
+    n_alerts=n_alerts+len(res["alerts"])
+    del res["lines"]
+    for dep in res["deployments"]:
+      n_alerts=n_alerts+len(dep["alerts"])
+      for repo in dep["repositories"]:
+        n_alerts=n_alerts+len(repo["alerts"])
+        n_failed=n_failed+(not repo["passed"])
+        del repo["lines"]
+  summary={"root":root,"pipelines_checked":len(pnames),"alerts":n_alerts,"failed_repositories":n_failed,
+           "status_seconds":round(status_seconds,3),"elapsed_seconds":round(time.time()-timer.start,3)}
+  with open(my_args.json,'w') as of:
+    json.dump({"summary":summary,"pipelines":report},of,indent=1)
+if my_args.timings:
+  print(timer.format())
+  print("Rule statistics:")
+  for line in entry_rules.format_stats()+repo_rules.format_stats():
+    print("    "+line)
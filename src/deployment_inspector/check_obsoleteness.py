@@ -7,137 +7,117 @@
 # This program assesses all pipeline deployments under prod, sandbox, qa and dev, and identifies those which are not the most recent version and not dependencies of other pipelines' deployments.
 # 
 # Arguments:
-# This python3 program takes one optional argument:
+# This python3 program takes nine optional arguments:
 # -d | --debug | in debugging mode (optional)
+# -r | --root | the root holding prod, sandbox, qa and dev (optional, default /dlmp)
+# -w | --workers | number of threads scanning the file system (optional, default 16)
+# -i | --inventory | inventory snapshot reused and updated by this run (optional)
+# -c | --changes | print what changed since the previous snapshot (optional, requires -i)
+# -g | --graph | export the dependency graph to this file, Graphviz DOT for .dot/.gv and JSON otherwise (optional)
+# -s | --space | report the disk space and inodes freed by removing each obsolete deployment (optional)
+# -S | --sort | order of the obsolete deployments, name or size (optional, default name; size implies --space)
+# -t | --timings | print the time spent in each phase (optional)
 
 import argparse
 import os,sys
-import re
-import subprocess
+import scanner
+import inventory as snapshots
+import dependency_graph
+import disk_usage
+from phase_timer import PhaseTimer
 
 mydesc = """
 This program assesses all pipeline deployments under prod, sandbox, qa and dev, and identifies those which are not the most recent version and not dependencies of other pipelines' deployments.
 """
 parser = argparse.ArgumentParser(description=mydesc, formatter_class=argparse.RawDescriptionHelpFormatter)
 parser.add_argument('-d', '--debug', action='store_true', help="in debugging mode (optional)")
+parser.add_argument('-r', '--root', type=str, default=scanner.DEFAULT_ROOT, help="the root holding prod, sandbox, qa and dev (optional, default /dlmp)")
+parser.add_argument('-w', '--workers', type=int, default=16, help="number of threads scanning the file system (optional, default 16)")
+parser.add_argument('-i', '--inventory', type=str, help="inventory snapshot reused and updated by this run (optional)")
+parser.add_argument('-c', '--changes', action='store_true', help="print what changed since the previous snapshot (optional, requires -i)")
+parser.add_argument('-g', '--graph', type=str, help="export the dependency graph to this file, Graphviz DOT for .dot/.gv and JSON otherwise (optional)")
+parser.add_argument('-s', '--space', action='store_true', help="report the disk space and inodes freed by removing each obsolete deployment (optional)")
+parser.add_argument('-S', '--sort', choices=["name","size"], default="name", help="order of the obsolete deployments, name or size (optional, default name; size implies --space)")
+parser.add_argument('-t', '--timings', action='store_true', help="print the time spent in each phase (optional)")
 my_args = parser.parse_args()
+if my_args.changes and not my_args.inventory:
+  parser.error("-c/--changes requires -i/--inventory")
 debugging=my_args.debug
+root=my_args.root
+snapshot=snapshots.Snapshot(my_args.inventory,root) if my_args.inventory else None
+space=my_args.space or my_args.sort=="size"
+timer=PhaseTimer()
 
-def runcmd(command):
-  process=subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-  output=process.communicate()[0]
-  exitCode=process.returncode
-  if exitCode==0:
-    return output
-  else:
-    return "NA"
-
-def trim_out(raw):
-  lines=raw.splitlines()
-  nlines=""
-  if len(lines)>0:
-    for eachLine in lines:
-      if len(eachLine.strip())>0:
-        if nlines=="":
-          nlines=eachLine.strip()
-        else:
-          nlines=nlines+"\n"+eachLine.strip()
-  return nlines
-
-super_dir_names=["prod","sandbox","qa","dev"]
-for eachDirName in super_dir_names:
-  deploy_dir=os.path.join("/dlmp",eachDirName,"scripts/deployments")
-  pips=os.listdir(deploy_dir)
-  all_pipelines=[]
-  all_deployments=[]
-  all_paths=[]
-  all_isRecent=[]
-  all_times=[]
-  all_dpts=[]
-  all_profile_loc=[]
-  all_profile_pip=[]
-  all_profile_dep=[]
-  for eachPip in pips:
-    pip_dir=os.path.join(deploy_dir,eachPip)
-    if os.path.isdir(pip_dir):
-      items=os.listdir(pip_dir)
-      deployments=[]
-      versions=[]
-      for eachItem in items:
-        if re.search("^[vV]?\d.\d\d.\d\d$",eachItem):
-          deployments.append(eachItem)
-          ptn=re.compile("(\d.\d\d.\d\d)")
-          hit=ptn.search(eachItem)
-          if hit:
-            versions.append(hit.group(1))
-      n_deploy=len(deployments)
-      if n_deploy>0:
-        if n_deploy>1:
-          version_idx=sorted(range(len(versions)),key=versions.__getitem__)
-          i=0
-          for pos in version_idx:
-            all_pipelines.append(eachPip)
-            all_deployments.append(deployments[pos])
-            all_paths.append(os.path.join(pip_dir,deployments[pos]))
-            cmd="find "+os.path.join(pip_dir,deployments[pos])+" -name *.profile"
-            info=runcmd(cmd)
-            if info != "NA":
-              profile_file_output=trim_out(info.decode('utf-8'))
-              if profile_file_output!="":
-                profile_files=profile_file_output.split("\n")
-                for eachProfile in profile_files:
-                  all_profile_loc.append(eachProfile)
-                  all_profile_pip.append(eachPip)
-                  all_profile_dep.append(deployments[pos])
-            all_times.append(0)
-            if i==n_deploy-1:
-              all_isRecent.append(True)
-            else:
-              all_isRecent.append(False)
-            all_dpts.append("")
-            i=i+1
-        else:
-            all_pipelines.append(eachPip)
-            all_deployments.append(deployments[0])
-            all_paths.append(os.path.join(pip_dir,deployments[0]))
-            cmd="find "+os.path.join(pip_dir,deployments[0])+" -name *.profile"
-            info=runcmd(cmd)
-            if info != "NA":
-              profile_file_output=trim_out(info.decode('utf-8'))
-              if profile_file_output!="":
-                profile_files=profile_file_output.split("\n")
-                for eachProfile in profile_files:
-                  all_profile_loc.append(eachProfile)
-                  all_profile_pip.append(eachPip)
-                  all_profile_dep.append(deployments[0])
-            all_times.append(0)
-            all_dpts.append("")
-            all_isRecent.append(True)
-  for i in range(0,len(all_deployments)):
-    dpt_pips=""
-    for j in range(0,len(all_profile_loc)):
-      cmd="grep "+all_paths[i]+" "+all_profile_loc[j]
-      info=runcmd(cmd)
-      if info != "NA":
-        hit_output=trim_out(info.decode('utf-8'))  
-        if hit_output!="" and all_pipelines[i]!=all_profile_pip[j]:
-          if dpt_pips=="":
-            dpt_pips=all_profile_pip[j]+"-"+all_profile_dep[j]
-          else:
-            dpt_pips=dpt_pips+","+all_profile_pip[j]+"-"+all_profile_dep[j]
-          all_times[i]=all_times[i]+1
-          all_dpts[i]=dpt_pips
-    status="Nonobsolete"
-    if all_isRecent[i]==True:
-      status="recent"
-    else:
-      status="OBSOLETE"
-      if all_times[i]>0:
-        status="nonobsolete"
+inventory=scanner.scan(root,scanner.SUPER_DIR_NAMES,workers=my_args.workers,snapshot=snapshot)
+timer.lap("scan")
+all_patterns=[d.path for env in scanner.SUPER_DIR_NAMES if inventory[env] is not None for p in inventory[env].values() for d in p.deployments]
+all_profiles=[f for env in scanner.SUPER_DIR_NAMES if inventory[env] is not None for p in inventory[env].values() for d in p.deployments for f in d.profiles]
+# read every profile once (only the changed ones with a snapshot) and match all deployment paths at the same time
+profile_hits=snapshots.match_profiles(all_profiles,all_patterns,snapshot)
+timer.lap("deps")
+graph=dependency_graph.DependencyGraph()
+node_of={}
+for eachDirName in scanner.SUPER_DIR_NAMES:
+  for eachPip,pipeline in (inventory[eachDirName] or {}).items():
+    deployments=sorted(pipeline.deployments,key=lambda d:d.version)
+    for i,deployment in enumerate(deployments):
+      node_of[deployment.path]=graph.add_node((eachDirName,eachPip,deployment.name),path=deployment.path,recent=(i==len(deployments)-1))
+# a profile makes its deployment depend on the deployments of other pipelines
+# of the same environment whose paths it mentions
+for eachDirName in scanner.SUPER_DIR_NAMES:
+  for eachPip,pipeline in (inventory[eachDirName] or {}).items():
+    for deployment in pipeline.deployments:
+      src=node_of[deployment.path]
+      for eachProfile in deployment.profiles:
+        for k in sorted(profile_hits[eachProfile]):
+          dst=node_of[all_patterns[k]]
+          dst_env,dst_pip,dst_name=graph.keys[dst]
+          if dst_env==eachDirName and dst_pip!=eachPip:
+            graph.add_edge(src,dst)
+status=graph.statuses()
+timer.lap("graph")
+obsolete=[node for node in range(len(graph)) if status[node]=="OBSOLETE"]
+if space:
+  usage=disk_usage.usage_of([graph.attrs[node]["path"] for node in obsolete],my_args.workers,snapshot)
+  reclaim={node:usage[graph.attrs[node]["path"]].reclaimable() for node in obsolete}
+  timer.lap("space")
+def space_note(nbytes,inodes):
+  return "\t"+disk_usage.format_size(nbytes)+"\t"+str(inodes)+" inodes"
+for eachDirName in scanner.SUPER_DIR_NAMES:
+  if inventory[eachDirName] is None:
+    print("Deployment folder is missing: "+scanner.deployments_dir(root,eachDirName))
+    continue
+  env_nodes=[node for node in range(len(graph)) if graph.keys[node][0]==eachDirName]
+  if my_args.sort=="size" and not debugging:
+    env_nodes.sort(key=lambda node:-reclaim[node][0] if node in reclaim else 0)
+  for node in env_nodes:
+    env,eachPip,eachDep=graph.keys[node]
+    note=space_note(*reclaim[node]) if space and status[node]=="OBSOLETE" else ""
     if debugging:
-      print(eachDirName+"\t"+all_pipelines[i]+"\t"+all_deployments[i]+"\t"+status)
-      if all_times[i]>0:
-        print("\t\tcalled by: "+all_dpts[i])
+      print(eachDirName+"\t"+eachPip+"\t"+eachDep+"\t"+status[node]+note)
+      callers=graph.in_edges[node]
+      if callers:
+        print("\t\tcalled by: "+",".join(graph.keys[c][1]+"-"+graph.keys[c][2] for c in callers))
+        if status[node]=="OBSOLETE":
+          print("\t\tall callers are obsolete")
     else:
-      if status=="OBSOLETE":
-        print(eachDirName+"\t"+all_pipelines[i]+"\t"+all_deployments[i]+"\t"+status)
+      if status[node]=="OBSOLETE":
+        print(eachDirName+"\t"+eachPip+"\t"+eachDep+"\t"+status[node]+note)
+  if space:
+    # hard links shared between obsolete deployments are freed by removing all of them
+    total=disk_usage.Usage.combine(usage[graph.attrs[node]["path"]] for node in obsolete if graph.keys[node][0]==eachDirName)
+    print(eachDirName+"\tTOTAL\t-\tRECLAIMABLE"+space_note(*total.reclaimable()))
+if my_args.graph:
+  graph.export(my_args.graph,status)
+  if debugging:
+    print("Dependency graph with {} deployments and {} dependencies written to {}".format(len(graph),graph.n_edges(),my_args.graph))
+if snapshot is not None:
+  if my_args.changes:
+    print("\nChanges since the previous snapshot:")
+    for line in snapshot.changes():
+      print("    "+line)
+  if debugging:
+    print("Inventory snapshot: "+snapshot.format_counts())
+  snapshot.save()
+if my_args.timings:
+  print(timer.format())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# dependency_graph.py
+#
+# Dependency graph of deployments: an edge A -> B means that a profile of
+# deployment A mentions the path of deployment B, so B is needed while A is.
+#
+# The most recent deployment of each pipeline is a root. A deployment is live
+# when it can be reached from a root; every other deployment is obsolete,
+# including those referenced only by obsolete deployments. This is the fixpoint
+# of "a deployment is needed if it is recent or a needed deployment uses it",
+# computed with one breadth-first search, linear in nodes plus edges.
+import json
+from collections import deque
+
+class DependencyGraph:
+  def __init__(self):
+    self.keys=[]
+    self.attrs=[]
+    self.index={}
+    self.out_edges=[]
+    self.in_edges=[]
+    self.edge_set=set()
+
+  def add_node(self, key, **attrs):
+    node=self.index.get(key)
+    if node is None:
+      node=len(self.keys)
+      self.index[key]=node
+      self.keys.append(key)
+      self.attrs.append(attrs)
+      self.out_edges.append([])
+      self.in_edges.append([])
+    return node
+
+  def add_edge(self, src, dst):
+    # edges are kept once and in insertion order
+    if src==dst or (src,dst) in self.edge_set:
+      return
+    self.edge_set.add((src,dst))
+    self.out_edges[src].append(dst)
+    self.in_edges[dst].append(src)
+
+  def __len__(self):
+    return len(self.keys)
+
+  def n_edges(self):
+    return len(self.edge_set)
+
+  def reachable(self, roots):
+    seen=bytearray(len(self.keys))
+    queue=deque()
+    for node in roots:
+      if not seen[node]:
+        seen[node]=1
+        queue.append(node)
+    while queue:
+      node=queue.popleft()
+      for nxt in self.out_edges[node]:
+        if not seen[nxt]:
+          seen[nxt]=1
+          queue.append(nxt)
+    return seen
+
+  def statuses(self, root_attr="recent"):
+    # "recent" for roots, "nonobsolete" for deployments reached from them, "OBSOLETE" otherwise
+    roots=[node for node in range(len(self.keys)) if self.attrs[node].get(root_attr)]
+    live=self.reachable(roots)
+    status=[]
+    for node in range(len(self.keys)):
+      if self.attrs[node].get(root_attr):
+        status.append("recent")
+      elif live[node]:
+        status.append("nonobsolete")
+      else:
+        status.append("OBSOLETE")
+    return status
+
+  def to_json(self, fp, status=None):
+    nodes=[]
+    for node,key in enumerate(self.keys):
+      entry={"id":node,"key":list(key)}
+      entry.update(self.attrs[node])
+      if status is not None:
+        entry["status"]=status[node]
+      nodes.append(entry)
+    edges=[[src,dst] for src in range(len(self.keys)) for dst in self.out_edges[src]]
+    json.dump({"nodes":nodes,"edges":edges},fp,indent=1)
+
+  def to_dot(self, fp, status=None):
+    fp.write("digraph deployments {\n  rankdir=LR;\n  node [shape=box];\n")
+    for node,key in enumerate(self.keys):
+      label="/".join(key)
+      style=""
+      if status is not None:
+        label=label+"\\n"+status[node]
+        if status[node]=="OBSOLETE":
+          style=", style=dashed, color=red"
+        elif status[node]=="recent":
+          style=", style=bold"
+      fp.write("  n{} [label=\"{}\"{}];\n".format(node,label,style))
+    for src in range(len(self.keys)):
+      for dst in self.out_edges[src]:
+        fp.write("  n{} -> n{};\n".format(src,dst))
+    fp.write("}\n")
+
+  def export(self, path, status=None):
+    # the format follows the extension: .dot or .gv for Graphviz, JSON otherwise
+    with open(path,'w') as fp:
+      if path.endswith(".dot") or path.endswith(".gv"):
+        self.to_dot(fp,status)
+      else:
+        self.to_json(fp,status)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+#
+# disk_usage.py
+#
+# On-disk space and inodes that removing deployments would free.
+#
+# Each deployment tree is walked with os.scandir in a thread pool, without
+# following symbolic links, and sizes are taken from st_blocks (allocated
+# space, not apparent size). A file with several hard links is freed only when
+# all of its links are removed, so such files are tracked by (st_dev, st_ino)
+# with the number of links seen: they count for one deployment when all their
+# links are inside it, and for an environment when all their links are inside
+# the deployments removed there. Every inode is counted once.
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+class Usage:
+  def __init__(self, nbytes=0, inodes=0, linked=None):
+    # space and inodes of entries with a single link
+    self.bytes=nbytes
+    self.inodes=inodes
+    # (st_dev, st_ino) -> [bytes, links seen, st_nlink] of hard-linked files
+    self.linked=linked if linked is not None else {}
+
+  def reclaimable(self):
+    nbytes=self.bytes
+    inodes=self.inodes
+    for size,seen,nlink in self.linked.values():
+      if seen>=nlink:
+        nbytes=nbytes+size
+        inodes=inodes+1
+    return nbytes,inodes
+
+  @staticmethod
+  def combine(usages):
+    total=Usage()
+    for usage in usages:
+      total.bytes=total.bytes+usage.bytes
+      total.inodes=total.inodes+usage.inodes
+      for key,(size,seen,nlink) in usage.linked.items():
+        entry=total.linked.get(key)
+        if entry is None:
+          total.linked[key]=[size,seen,nlink]
+        else:
+          entry[1]=entry[1]+seen
+    return total
+
+  def to_record(self):
+    return {"bytes":self.bytes,"inodes":self.inodes,"linked":[[dev,ino]+list(v) for (dev,ino),v in sorted(self.linked.items())]}
+
+  @staticmethod
+  def from_record(record):
+    return Usage(record["bytes"],record["inodes"],{(e[0],e[1]):list(e[2:]) for e in record["linked"]})
+
+def walk_usage(path):
+  usage=Usage()
+  stack=[path]
+  while stack:
+    current=stack.pop()
+    try:
+      st=os.lstat(current)
+    except OSError:
+      continue
+    usage.bytes=usage.bytes+st.st_blocks*512
+    usage.inodes=usage.inodes+1
+    try:
+      it=os.scandir(current)
+    except OSError:
+      continue
+    with it:
+      for e in it:
+        try:
+          if e.is_dir(follow_symlinks=False):
+            stack.append(e.path)
+            continue
+          st=e.stat(follow_symlinks=False)
+        except OSError:
+          continue
+        if st.st_nlink>1:
+          key=(st.st_dev,st.st_ino)
+          entry=usage.linked.get(key)
+          if entry is None:
+            usage.linked[key]=[st.st_blocks*512,1,st.st_nlink]
+          else:
+            entry[1]=entry[1]+1
+        else:
+          usage.bytes=usage.bytes+st.st_blocks*512
+          usage.inodes=usage.inodes+1
+  return usage
+
+def tree_stamp(path, snapshot):
+  # digest of the mtimes of every directory of the tree, read through the
+  # snapshot so that unchanged directories are not listed again; files
+  # rewritten in place are not noticed, deployments are not edited in place
+  digest=hashlib.blake2b(digest_size=16)
+  stack=[path]
+  while stack:
+    current=stack.pop()
+    try:
+      st=os.lstat(current)
+    except OSError:
+      continue
+    digest.update("{}\0{}\0".format(current,st.st_mtime_ns).encode('utf-8','surrogateescape'))
+    for name,is_dir,is_tree in snapshot.read_dir(current):
+      if is_tree:
+        stack.append(os.path.join(current,name))
+  return digest.hexdigest()
+
+def usage_of(paths, workers=16, snapshot=None):
+  # {path: Usage}; with a snapshot, unchanged trees reuse the recorded usage
+  def measure(path):
+    if snapshot is None:
+      return walk_usage(path)
+    stamp=tree_stamp(path,snapshot)
+    record=snapshot.usage(path,stamp)
+    if record is None:
+      usage=walk_usage(path)
+      record=usage.to_record()
+      record["stamp"]=stamp
+    else:
+      usage=Usage.from_record(record)
+    snapshot.put_usage(path,record)
+    return usage
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    return dict(zip(paths,pool.map(measure,paths)))
+
+def format_size(nbytes):
+  size=float(nbytes)
+  for unit in ["B","KiB","MiB","GiB","TiB"]:
+    if size<1024 or unit=="TiB":
+      break
+    size=size/1024
+  return "{:.1f} {}".format(size,unit) if unit!="B" else "{} B".format(nbytes)
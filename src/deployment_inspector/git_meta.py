@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+#
+# git_meta.py
+#
+# Reads the git metadata needed by the deployment checks directly from the
+# repository files, without running git:
+#   - HEAD (branch or detached commit) and the reflog entry naming what was
+#     checked out, as shown by `git status`;
+#   - loose refs and packed-refs, with tags peeled to their commits;
+#   - commit objects, loose or packed (pack index v1/v2, including deltas),
+#     also from the object stores listed in objects/info/alternates, to answer
+#     which branches contain a commit.
+#
+# Commit ancestries are cached per repository and per branch tip, so asking
+# about several commits of the same repository walks its history only once.
+# A SharedHistory passed to several repositories extends that cache to all
+# clones of the same project, since a commit sha always names the same history;
+# walks cut short by a missing object stay private to their repository.
+import os
+import re
+import struct
+import zlib
+
+OBJ_TYPES={1:"commit",2:"tree",3:"blob",4:"tag"}
+OFS_DELTA=6
+REF_DELTA=7
+CHECKOUT_MSG=re.compile(r"checkout: moving from .* to (\S+)\s*$")
+
+class GitError(Exception):
+  pass
+
+def find_git_dir(path):
+  current=os.path.abspath(path)
+  while True:
+    candidate=os.path.join(current,".git")
+    if os.path.isdir(candidate):
+      return candidate
+    if os.path.isfile(candidate):
+      with open(candidate,'r') as fl:
+        content=fl.read().strip()
+      if content.startswith("gitdir:"):
+        gitdir=content[len("gitdir:"):].strip()
+        return os.path.normpath(os.path.join(current,gitdir))
+    parent=os.path.dirname(current)
+    if parent==current:
+      raise GitError("Not a git repository: "+path)
+    current=parent
+
+def apply_delta(base, delta):
+  def varint(pos):
+    value=0
+    shift=0
+    while True:
+      c=delta[pos]
+      pos=pos+1
+      value|=(c&0x7f)<<shift
+      shift=shift+7
+      if not c&0x80:
+        return value,pos
+  src_size,pos=varint(0)
+  dst_size,pos=varint(pos)
+  if src_size!=len(base):
+    raise GitError("Corrupt delta: base size mismatch")
+  out=bytearray()
+  while pos<len(delta):
+    op=delta[pos]
+    pos=pos+1
+    if op&0x80:
+      offset=0
+      size=0
+      for i in range(4):
+        if op&(1<<i):
+          offset|=delta[pos]<<(8*i)
+          pos=pos+1
+      for i in range(3):
+        if op&(0x10<<i):
+          size|=delta[pos]<<(8*i)
+          pos=pos+1
+      if size==0:
+        size=0x10000
+      out+=base[offset:offset+size]
+    elif op:
+      out+=delta[pos:pos+op]
+      pos=pos+op
+    else:
+      raise GitError("Corrupt delta: unknown opcode")
+  if len(out)!=dst_size:
+    raise GitError("Corrupt delta: result size mismatch")
+  return bytes(out)
+
+class PackIndex:
+  def __init__(self, idx_path):
+    self.idx_path=idx_path
+    self.pack_path=idx_path[:-4]+".pack"
+    with open(idx_path,'rb') as fl:
+      self.data=fl.read()
+    if self.data[:4]==b'\377tOc':
+      if struct.unpack_from('>I',self.data,4)[0]!=2:
+        raise GitError("Unsupported pack index version: "+idx_path)
+      self.version=2
+      self.fanout=struct.unpack_from('>256I',self.data,8)
+      self.count=self.fanout[255]
+      self.sha_offset=8+1024
+      self.offset_offset=self.sha_offset+24*self.count
+      self.large_offset=self.offset_offset+4*self.count
+    else:
+      self.version=1
+      self.fanout=struct.unpack_from('>256I',self.data,0)
+      self.count=self.fanout[255]
+      self.sha_offset=1024
+
+  def sha_at(self, i):
+    if self.version==2:
+      start=self.sha_offset+20*i
+    else:
+      start=self.sha_offset+24*i+4
+    return self.data[start:start+20]
+
+  def find(self, sha_bin):
+    first=sha_bin[0]
+    lo=self.fanout[first-1] if first>0 else 0
+    hi=self.fanout[first]
+    while lo<hi:
+      mid=(lo+hi)//2
+      value=self.sha_at(mid)
+      if value<sha_bin:
+        lo=mid+1
+      elif value>sha_bin:
+        hi=mid
+      else:
+        return self.offset_at(mid)
+    return None
+
+  def offset_at(self, i):
+    if self.version==1:
+      return struct.unpack_from('>I',self.data,self.sha_offset+24*i)[0]
+    offset=struct.unpack_from('>I',self.data,self.offset_offset+4*i)[0]
+    if offset&0x80000000:
+      offset=struct.unpack_from('>Q',self.data,self.large_offset+8*(offset&0x7fffffff))[0]
+    return offset
+
+class SharedHistory:
+  # commit parents and ancestor sets keyed by sha, shared between repositories;
+  # stored sets are never modified, so threads may share one instance
+  def __init__(self):
+    self.parents={}
+    self.ancestors={}
+
+class GitRepo:
+  # Not thread-safe: a repository is meant to be read by one worker at a time.
+  def __init__(self, path, history=None):
+    self.path=path
+    self.git_dir=find_git_dir(path)
+    self.common_dir=self.git_dir
+    commondir=os.path.join(self.git_dir,"commondir")
+    if os.path.isfile(commondir):
+      with open(commondir,'r') as fl:
+        self.common_dir=os.path.normpath(os.path.join(self.git_dir,fl.read().strip()))
+    self.objects_dir=os.path.join(self.common_dir,"objects")
+    self._refs=None
+    self._symrefs={}
+    self._packs=None
+    self._object_dirs=None
+    self._pack_files={}
+    self._parents={}
+    self._ancestors={}
+    self._partial={}
+    # the history of a shallow clone is truncated, it must not be shared
+    if history is not None and not os.path.isfile(os.path.join(self.common_dir,"shallow")):
+      self._parents=history.parents
+      self._ancestors=history.ancestors
+
+  def close(self):
+    for fl in self._pack_files.values():
+      fl.close()
+    self._pack_files={}
+
+  def stamp(self):
+    # stats of every file HEAD, the refs and the reflog are read from; results
+    # derived from them stay valid while the stamp is unchanged
+    paths=[os.path.join(self.git_dir,"HEAD"),os.path.join(self.git_dir,"logs","HEAD"),
+           os.path.join(self.common_dir,"packed-refs")]
+    for dirpath,dirnames,filenames in os.walk(os.path.join(self.common_dir,"refs")):
+      dirnames.sort()
+      paths.extend(os.path.join(dirpath,fname) for fname in sorted(filenames))
+    stamp=[]
+    for path in paths:
+      try:
+        st=os.stat(path)
+        stamp.append([os.path.relpath(path,self.common_dir),st.st_size,st.st_mtime_ns])
+      except OSError:
+        continue
+    return stamp
+
+  ###### refs ######
+  def refs(self):
+    if self._refs is None:
+      refs={}
+      packed=os.path.join(self.common_dir,"packed-refs")
+      if os.path.isfile(packed):
+        with open(packed,'r') as fl:
+          for line in fl:
+            line=line.strip()
+            if not line or line[0] in "#^":
+              continue
+            sha,name=line.split(" ",1)
+            refs[name]=sha
+      loose={}
+      refs_dir=os.path.join(self.common_dir,"refs")
+      for dirpath,dirnames,filenames in os.walk(refs_dir):
+        for fname in filenames:
+          full=os.path.join(dirpath,fname)
+          name=os.path.relpath(full,self.common_dir).replace(os.sep,"/")
+          try:
+            with open(full,'r') as fl:
+              loose[name]=fl.read().strip()
+          except (IOError,OSError):
+            continue
+      for name,value in loose.items():
+        if value.startswith("ref:"):
+          self._symrefs[name]=value[4:].strip()
+        else:
+          refs[name]=value
+      for name,target in self._symrefs.items():
+        if target in refs:
+          refs[name]=refs[target]
+      self._refs=refs
+    return self._refs
+
+  def head(self):
+    # returns (branch name or None when detached, commit sha or None when unborn)
+    try:
+      with open(os.path.join(self.git_dir,"HEAD"),'r') as fl:
+        content=fl.read().strip()
+    except (IOError,OSError):
+      raise GitError("Cannot read HEAD of "+self.path)
+    if content.startswith("ref:"):
+      target=content[4:].strip()
+      branch=target[len("refs/heads/"):] if target.startswith("refs/heads/") else target
+      return branch,self.refs().get(target)
+    return None,content
+
+  def checked_out_name(self):
+    # what the last checkout moved to, as `git status` reports a detached HEAD
+    try:
+      with open(os.path.join(self.git_dir,"logs","HEAD"),'r',errors='replace') as fl:
+        lines=fl.readlines()
+    except (IOError,OSError):
+      return None
+    for line in reversed(lines):
+      hit=CHECKOUT_MSG.search(line)
+      if hit:
+        return hit.group(1)
+    return None
+
+  def head_keyword(self):
+    # mimics the keyword parsed from `git status`: the branch name, or for a
+    # detached HEAD what was checked out (falling back to a tag of the commit)
+    branch,sha=self.head()
+    if branch is not None:
+      return branch,False
+    name=self.checked_out_name()
+    if name is not None:
+      return name,True
+    for refname,value in sorted(self.refs().items()):
+      if refname.startswith("refs/tags/") and self.peel(value)==sha:
+        return refname[len("refs/tags/"):],True
+    return sha[:7],True
+
+  def show_ref(self):
+    return ["{} {}".format(sha,name) for name,sha in sorted(self.refs().items()) if name!="HEAD"]
+
+  def find_ref(self, keyword):
+    # first line of `git show-ref | grep keyword`, returned as (sha, refname)
+    for line in self.show_ref():
+      if keyword in line:
+        sha,name=line.split(" ",1)
+        return sha,name
+    return None
+
+  ###### objects ######
+  def object_dirs(self):
+    # the object store and, for clones made with --shared or --reference,
+    # the stores listed in objects/info/alternates
+    if self._object_dirs is None:
+      dirs=[]
+      todo=[self.objects_dir]
+      while todo:
+        current=os.path.normpath(todo.pop(0))
+        if current in dirs:
+          continue
+        dirs.append(current)
+        try:
+          with open(os.path.join(current,"info","alternates"),'r') as fl:
+            for line in fl:
+              line=line.strip()
+              if line and not line.startswith("#"):
+                todo.append(os.path.join(current,line))
+        except (IOError,OSError):
+          continue
+      self._object_dirs=dirs
+    return self._object_dirs
+
+  def packs(self):
+    if self._packs is None:
+      self._packs=[]
+      for objects_dir in self.object_dirs():
+        pack_dir=os.path.join(objects_dir,"pack")
+        if os.path.isdir(pack_dir):
+          for fname in sorted(os.listdir(pack_dir)):
+            if fname.endswith(".idx"):
+              self._packs.append(PackIndex(os.path.join(pack_dir,fname)))
+    return self._packs
+
+  def read_object(self, sha):
+    for objects_dir in self.object_dirs():
+      loose=os.path.join(objects_dir,sha[:2],sha[2:])
+      if os.path.isfile(loose):
+        with open(loose,'rb') as fl:
+          raw=zlib.decompress(fl.read())
+        header,_,data=raw.partition(b'\0')
+        return header.split(b' ')[0].decode(),data
+    sha_bin=bytes.fromhex(sha)
+    for pack in self.packs():
+      offset=pack.find(sha_bin)
+      if offset is not None:
+        return self.read_packed(pack,offset)
+    raise GitError("Object not found: "+sha)
+
+  def read_packed(self, pack, offset):
+    fl=self._pack_files.get(pack.pack_path)
+    if fl is None:
+      fl=open(pack.pack_path,'rb')
+      self._pack_files[pack.pack_path]=fl
+    fl.seek(offset)
+    c=fl.read(1)[0]
+    obj_type=(c>>4)&7
+    while c&0x80:
+      c=fl.read(1)[0]
+    if obj_type==OFS_DELTA:
+      c=fl.read(1)[0]
+      base_offset=c&0x7f
+      while c&0x80:
+        c=fl.read(1)[0]
+        base_offset=((base_offset+1)<<7)|(c&0x7f)
+      delta=self.inflate(fl)
+      base_type,base=self.read_packed(pack,offset-base_offset)
+      return base_type,apply_delta(base,delta)
+    if obj_type==REF_DELTA:
+      base_sha=fl.read(20).hex()
+      delta=self.inflate(fl)
+      base_type,base=self.read_object(base_sha)
+      return base_type,apply_delta(base,delta)
+    if obj_type not in OBJ_TYPES:
+      raise GitError("Unknown packed object type {} in {}".format(obj_type,pack.pack_path))
+    return OBJ_TYPES[obj_type],self.inflate(fl)
+
+  @staticmethod
+  def inflate(fl):
+    d=zlib.decompressobj()
+    out=[]
+    while not d.eof:
+      chunk=fl.read(8192)
+      if not chunk:
+        raise GitError("Truncated pack data")
+      out.append(d.decompress(chunk))
+    return b''.join(out)
+
+  def peel(self, sha):
+    # follows annotated tags down to the object they point to
+    for i in range(16):
+      try:
+        obj_type,data=self.read_object(sha)
+      except GitError:
+        return sha
+      if obj_type!="tag":
+        return sha
+      sha=data.split(b'\n',1)[0].split(b' ')[1].decode()
+    return sha
+
+  def parents(self, sha):
+    if sha not in self._parents:
+      obj_type,data=self.read_object(sha)
+      parents=[]
+      for line in data.split(b'\n'):
+        if not line:
+          break
+        if line.startswith(b'parent '):
+          parents.append(line[7:].decode())
+      self._parents[sha]=parents
+    return self._parents[sha]
+
+  ###### ancestry ######
+  def ancestors(self, tip):
+    # all commits reachable from tip, computed once per tip and reused by later tips
+    if tip in self._ancestors:
+      return self._ancestors[tip]
+    if tip in self._partial:
+      return self._partial[tip]
+    complete=True
+    seen=set()
+    stack=[tip]
+    while stack:
+      sha=stack.pop()
+      if sha in seen:
+        continue
+      if sha!=tip and sha in self._ancestors:
+        seen|=self._ancestors[sha]
+        continue
+      seen.add(sha)
+      try:
+        stack.extend(self.parents(sha))
+      except GitError:
+        # shallow clone or missing object: the history stops here
+        complete=False
+        continue
+    if complete:
+      self._ancestors[tip]=seen
+    else:
+      # a truncated history is only reused by this repository, never by
+      # other clones sharing the cache, nor by later walks through this tip
+      self._partial[tip]=seen
+    return seen
+
+  def branch_refs(self):
+    # local and remote branches, named as `git branch -a` names them
+    branches=[]
+    for name,sha in sorted(self.refs().items()):
+      if name.startswith("refs/heads/"):
+        label=name[len("refs/heads/"):]
+      elif name.startswith("refs/remotes/"):
+        label="remotes/"+name[len("refs/remotes/"):]
+        if name in self._symrefs:
+          target=self._symrefs[name]
+          label=label+" -> "+target[len("refs/remotes/"):] if target.startswith("refs/remotes/") else label
+      else:
+        continue
+      branches.append((label,sha))
+    return branches
+
+  def branches_containing(self, commit, name_filter=None):
+    # `git branch -a --contains commit`, optionally only for branch names
+    # matching name_filter so that unrelated branch histories are never walked
+    commit=self.peel(commit)
+    found=[]
+    for label,sha in self.branch_refs():
+      if name_filter is not None and not name_filter.search(label):
+        continue
+      if commit in self.ancestors(self.peel(sha)):
+        found.append(label)
+    return found
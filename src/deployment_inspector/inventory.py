@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# inventory.py
+#
+# Persistent snapshot of the deployment inventory, so that a run only rescans
+# what changed since the previous one. The snapshot is one JSON file holding
+#   - the listing of every directory visited, keyed by path and valid while
+#     the directory mtime is unchanged (entries are added, removed or renamed
+#     only by changing the mtime of their directory);
+#   - the size, mtime, digest and matched deployment paths of every profile,
+#     so that only modified profiles are read again;
+#   - the HEAD/ref state of the git repositories with the results derived
+#     from it;
+#   - the disk usage of deployment trees, valid while their directories are;
+#   - the pipelines and deployments found, to report what changed.
+# A directory or file modified within RACY_SECONDS of the previous scan may
+# have changed again without a new mtime, and is always read again.
+import hashlib
+import json
+import os
+import threading
+import time
+import scanner
+from path_matcher import PathMatcher
+
+SNAPSHOT_VERSION=1
+RACY_SECONDS=2.0
+
+class Snapshot:
+  def __init__(self, path, root):
+    self.path=path
+    self.root=root
+    self.old={}
+    if path and os.path.isfile(path):
+      try:
+        with open(path,'r') as fl:
+          self.old=json.load(fl)
+      except ValueError:
+        print("Inventory snapshot {} is not readable and will be rebuilt.".format(path))
+    if self.old.get("version")!=SNAPSHOT_VERSION or self.old.get("root")!=root:
+      self.old={}
+    self.start=time.time()
+    self.new={"version":SNAPSHOT_VERSION,"root":root,"time":self.start,
+              "dirs":{},"profiles":{},"git":{},"usage":{},"deployments":{}}
+    self.full_scan=False
+    self.profile_scan=False
+    self.counts={"dirs_listed":0,"dirs_reused":0,"profiles_read":0,"profiles_reused":0,"git_read":0,"git_reused":0,"trees_walked":0,"trees_reused":0}
+    # the scanner's worker threads update the counts concurrently
+    self.lock=threading.Lock()
+
+  def count(self, name):
+    with self.lock:
+      self.counts[name]+=1
+
+  def trusted(self, old_entry, st):
+    # cached data is used only when the stat matches and is older than the previous scan
+    return (old_entry is not None and old_entry["mtime"]==st.st_mtime_ns
+            and old_entry.get("size",st.st_size)==st.st_size
+            and st.st_mtime<self.old["time"]-RACY_SECONDS)
+
+  ###### directories ######
+  def read_dir(self, path):
+    try:
+      st=os.stat(path)
+    except OSError:
+      return []
+    old=self.old.get("dirs",{}).get(path)
+    if self.trusted(old,st):
+      self.count("dirs_reused")
+      entries=[tuple(e) for e in old["entries"]]
+    else:
+      self.count("dirs_listed")
+      entries=scanner.read_dir(path)
+    self.new["dirs"][path]={"mtime":st.st_mtime_ns,"entries":entries}
+    return entries
+
+  ###### profiles ######
+  def profile(self, path):
+    # returns (record, content or None when the cached record is still valid)
+    try:
+      st=os.stat(path)
+    except OSError:
+      return None,None
+    old=self.old.get("profiles",{}).get(path)
+    if self.trusted(old,st):
+      self.count("profiles_reused")
+      return dict(old),None
+    try:
+      with open(path,'rb') as fl:
+        data=fl.read()
+    except (IOError,OSError):
+      return None,None
+    self.count("profiles_read")
+    record={"mtime":st.st_mtime_ns,"size":st.st_size,"digest":hashlib.blake2b(data,digest_size=16).hexdigest()}
+    if old is not None and old.get("digest")==record["digest"]:
+      record["matches"]=old.get("matches")
+    return record,data
+
+  ###### git ######
+  def git(self, path, stamp):
+    old=self.old.get("git",{}).get(path)
+    if old is not None and old.get("stamp")==stamp:
+      self.count("git_reused")
+      return old
+    self.count("git_read")
+    return None
+
+  def put_git(self, path, record):
+    self.new["git"][path]=record
+
+  ###### disk usage ######
+  def usage(self, path, stamp):
+    old=self.old.get("usage",{}).get(path)
+    if old is not None and old.get("stamp")==stamp:
+      self.count("trees_reused")
+      return old
+    self.count("trees_walked")
+    return None
+
+  def put_usage(self, path, record):
+    self.new["usage"][path]=record
+
+  ###### inventory ######
+  def record_inventory(self, inventory, full, profiles):
+    # full: every pipeline was scanned; profiles: deployment trees were walked
+    for env,pipelines in inventory.items():
+      for pname,pipeline in (pipelines or {}).items():
+        self.new["deployments"][env+"/"+pname]=sorted(d.name for d in pipeline.deployments)
+    self.full_scan=full
+    self.profile_scan=full and profiles
+
+  def merged(self):
+    # sections not rebuilt by this run keep the entries of the previous one
+    data=dict(self.new)
+    old=self.old
+    if not old:
+      return data
+    for section in ("dirs","deployments","git","usage"):
+      if (section=="dirs" and self.profile_scan) or (section=="deployments" and self.full_scan):
+        continue
+      kept=dict(old.get(section,{}))
+      kept.update(self.new[section])
+      data[section]=kept
+    if "patterns" not in self.new:
+      data["profiles"]=old.get("profiles",{})
+      data["patterns"]=old.get("patterns",[])
+    return data
+
+  def save(self):
+    if not self.path:
+      return
+    tmp=self.path+".tmp{}".format(os.getpid())
+    with open(tmp,'w') as of:
+      json.dump(self.merged(),of,sort_keys=True)
+    os.replace(tmp,self.path)
+
+  def changes(self):
+    # what differs from the previous snapshot, as lines of "+", "-" or "~"
+    if not self.old:
+      return ["No previous snapshot to compare with."]
+    lines=[]
+    old_deps=self.old.get("deployments",{})
+    new_deps=self.new["deployments"]
+    for key in sorted(set(old_deps)|set(new_deps)):
+      if key not in new_deps:
+        if self.full_scan:
+          lines.append("- pipeline "+key)
+      elif key not in old_deps:
+        lines.append("+ pipeline "+key)
+      else:
+        for name in sorted(set(old_deps[key])-set(new_deps[key])):
+          lines.append("- deployment "+key+"/"+name)
+        for name in sorted(set(new_deps[key])-set(old_deps[key])):
+          lines.append("+ deployment "+key+"/"+name)
+    if "patterns" in self.new:
+      old_prof=self.old.get("profiles",{})
+      new_prof=self.new["profiles"]
+      for path in sorted(set(old_prof)|set(new_prof)):
+        if path not in new_prof:
+          lines.append("- profile "+path)
+        elif path not in old_prof:
+          lines.append("+ profile "+path)
+        elif old_prof[path].get("digest")!=new_prof[path].get("digest"):
+          lines.append("~ profile "+path)
+    old_git=self.old.get("git",{})
+    for path,record in sorted(self.new["git"].items()):
+      if path in old_git and old_git[path].get("head")!=record.get("head"):
+        lines.append("~ git HEAD {}: {} -> {}".format(path,old_git[path].get("head"),record.get("head")))
+    if not lines:
+      lines.append("No changes since the previous snapshot.")
+    return lines
+
+  def format_counts(self):
+    return ", ".join("{} {}".format(v,k.replace("_"," ")) for k,v in self.counts.items())
+
+def read_file(path):
+  try:
+    with open(path,'rb') as fl:
+      return fl.read()
+  except (IOError,OSError):
+    return b''
+
+# Maps each profile to the indices of the patterns it contains. With a
+# snapshot, unchanged profiles keep their previous matches and are searched
+# only for the patterns that were not known at the previous scan.
+def match_profiles(profile_paths, patterns, snapshot=None):
+  matcher=PathMatcher(patterns)
+  if snapshot is None:
+    return {path:matcher.search_file(path) for path in profile_paths}
+  index={p:i for i,p in enumerate(patterns)}
+  old_patterns=set(snapshot.old.get("patterns",[]))
+  added=[p for p in patterns if p not in old_patterns]
+  added_matcher=PathMatcher(added) if added else None
+  result={}
+  for path in profile_paths:
+    record,data=snapshot.profile(path)
+    if record is None:
+      result[path]=set()
+      continue
+    if record.get("matches") is None:
+      hits=matcher.search(data if data is not None else read_file(path))
+    else:
+      hits=set(index[p] for p in record["matches"] if p in index)
+      if added_matcher is not None:
+        found=added_matcher.search(data if data is not None else read_file(path))
+        hits.update(index[added[i]] for i in found)
+    record["matches"]=sorted(patterns[i] for i in hits)
+    snapshot.new["profiles"][path]=record
+    result[path]=hits
+  snapshot.new["patterns"]=list(patterns)
+  return result
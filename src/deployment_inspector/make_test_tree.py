@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+#
+# make_test_tree.py
+#
+# This program builds a synthetic deployments tree, laid out like /dlmp, to test and benchmark check_deployments.py and check_obsoleteness.py away from production.
+#
+# Every pipeline gets deploy.sh, a .properties file and M version folders in each environment, each with a bin folder,
+# a config/<pipeline>.profile referencing deployments of other pipelines, and optionally src/<pipeline>_LPEA_CAD, a
+# clone of a local origin repository with one tagged commit per version on master and a release branch.
+# A fraction of the pipelines also get misnamed version folders, redundant files, untracked changes or wrong tags.
+#
+# Arguments:
+# This python3 program takes one required and seven optional arguments:
+# -o | --out | the folder to create the tree in, used as --root of the inspectors
+# -n | --pipelines | number of pipelines (optional, default 20)
+# -m | --versions | number of versions per pipeline (optional, default 4)
+# -x | --xrefs | number of deployments of other pipelines referenced by each profile (optional, default 2)
+# -f | --faults | fraction of pipelines with layout or git problems (optional, default 0.1)
+# -G | --git-pipelines | number of pipelines with git repositories, -1 for all (optional, default -1)
+# -g | --git | the git executable (optional, default git)
+# -s | --seed | random seed (optional, default 1)
+import argparse
+import os,sys
+import random
+import subprocess
+import scanner
+
+mydesc = """
+This program builds a synthetic deployments tree, laid out like /dlmp, to test and benchmark check_deployments.py and check_obsoleteness.py away from production.
+"""
+
+GIT_ENV={"GIT_AUTHOR_NAME":"builder","GIT_AUTHOR_EMAIL":"builder@example.org","GIT_AUTHOR_DATE":"2020-01-01T00:00:00",
+         "GIT_COMMITTER_NAME":"builder","GIT_COMMITTER_EMAIL":"builder@example.org","GIT_COMMITTER_DATE":"2020-01-01T00:00:00"}
+
+def version_name(i):
+  return "1.{:02d}.{:02d}".format(i//10,i%10)
+
+def pipeline_name(i):
+  return "P{:04d}".format(i)
+
+def write_file(path, content):
+  with open(path,'w') as of:
+    of.write(content)
+
+class Builder:
+  def __init__(self, out, git):
+    self.out=out
+    self.git=git
+    self.env=dict(os.environ)
+    self.env.update(GIT_ENV)
+
+  def run_git(self, *args):
+    subprocess.run([self.git]+list(args),check=True,env=self.env,stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+
+  def make_origin(self, pname, n_versions):
+    origin=os.path.join(self.out,"origins",pname+"_LPEA_CAD")
+    os.makedirs(origin)
+    self.run_git("init","-q","-b","master",origin)
+    for i in range(n_versions):
+      write_file(os.path.join(origin,"VERSION"),version_name(i)+"\n")
+      self.run_git("-C",origin,"add","VERSION")
+      self.run_git("-C",origin,"commit","-q","-m","Release "+version_name(i))
+      self.run_git("-C",origin,"tag","-a",version_name(i),"-m",version_name(i))
+    self.run_git("-C",origin,"branch","release")
+    return origin
+
+  def clone(self, origin, dest, tag):
+    self.run_git("clone","-q","--shared",origin,dest)
+    self.run_git("-C",dest,"checkout","-q",tag)
+
+def main():
+  parser = argparse.ArgumentParser(description=mydesc, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument('-o', '--out', type=str, required=True, help="the folder to create the tree in, used as --root of the inspectors")
+  parser.add_argument('-n', '--pipelines', type=int, default=20, help="number of pipelines (optional, default 20)")
+  parser.add_argument('-m', '--versions', type=int, default=4, help="number of versions per pipeline (optional, default 4)")
+  parser.add_argument('-x', '--xrefs', type=int, default=2, help="number of deployments of other pipelines referenced by each profile (optional, default 2)")
+  parser.add_argument('-f', '--faults', type=float, default=0.1, help="fraction of pipelines with layout or git problems (optional, default 0.1)")
+  parser.add_argument('-G', '--git-pipelines', type=int, default=-1, help="number of pipelines with git repositories, -1 for all (optional, default -1)")
+  parser.add_argument('-g', '--git', type=str, default="git", help="the git executable (optional, default git)")
+  parser.add_argument('-s', '--seed', type=int, default=1, help="random seed (optional, default 1)")
+  my_args = parser.parse_args()
+  if os.path.exists(my_args.out) and os.listdir(my_args.out):
+    sys.exit("Output folder {} is not empty".format(my_args.out))
+  rng=random.Random(my_args.seed)
+  builder=Builder(my_args.out,my_args.git)
+  n_git=my_args.pipelines if my_args.git_pipelines<0 else min(my_args.git_pipelines,my_args.pipelines)
+  pnames=[pipeline_name(i) for i in range(my_args.pipelines)]
+  versions=[version_name(i) for i in range(my_args.versions)]
+  faulty=set(rng.sample(pnames,int(round(my_args.faults*len(pnames)))))
+  origins={}
+  for pname in pnames[:n_git]:
+    origins[pname]=builder.make_origin(pname,my_args.versions)
+  n_deployments=0
+  for env in scanner.SUPER_DIR_NAMES:
+    deploy_dir=scanner.deployments_dir(my_args.out,env)
+    for pname in pnames:
+      pipeline_path=os.path.join(deploy_dir,pname)
+      os.makedirs(pipeline_path)
+      write_file(os.path.join(pipeline_path,"deploy.sh"),"#!/bin/bash\n")
+      write_file(os.path.join(pipeline_path,pname+".properties"),"pipeline="+pname+"\n")
+      if pname in faulty:
+        os.makedirs(os.path.join(pipeline_path,"1.0.{}".format(rng.randint(0,9))),exist_ok=True)
+        write_file(os.path.join(pipeline_path,"notes.txt"),"redundant\n")
+      for i,version in enumerate(versions):
+        # the last version of some pipelines without repositories carries a v prefix, as in production
+        dname=("v" if i==len(versions)-1 and pname not in origins and rng.random()<0.2 else "")+version
+        dpath=os.path.join(pipeline_path,dname)
+        os.makedirs(os.path.join(dpath,"bin"))
+        os.makedirs(os.path.join(dpath,"config"))
+        write_file(os.path.join(dpath,"bin","run.sh"),"#!/bin/bash\necho "+pname+" "+version+"\n")
+        lines=["export PIPELINE_HOME="+dpath]
+        others=[p for p in pnames if p!=pname]
+        for q in rng.sample(others,min(my_args.xrefs,len(others))):
+          lines.append("export {}_HOME={}".format(q,os.path.join(deploy_dir,q,rng.choice(versions[:-1] or versions))))
+        write_file(os.path.join(dpath,"config",pname+".profile"),"\n".join(lines)+"\n")
+        if pname in origins:
+          src_repo=os.path.join(dpath,"src",pname+"_LPEA_CAD")
+          os.makedirs(os.path.dirname(src_repo))
+          tag=version
+          if pname in faulty and rng.random()<0.5:
+            tag=rng.choice(versions)
+          builder.clone(origins[pname],src_repo,tag)
+          if pname in faulty and rng.random()<0.5:
+            write_file(os.path.join(src_repo,"untracked.txt"),"local change\n")
+        n_deployments=n_deployments+1
+  print("{} pipelines, {} deployments, {} git repositories written to {}".format(len(pnames),n_deployments,
+        sum(1 for p in pnames if p in origins)*len(versions)*len(scanner.SUPER_DIR_NAMES),my_args.out))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+#
+# path_matcher.py
+#
+# Aho-Corasick multi-pattern matcher used to find, in a single pass over a
+# file, every deployment path that the file mentions.
+#
+# The automaton is built once from all patterns; scanning a text then costs one
+# transition per byte whatever the number of patterns, instead of one grep per
+# (pattern, file) pair.
+import os
+
+class PathMatcher:
+  def __init__(self, patterns):
+    self.patterns=list(patterns)
+    self.goto=[{}]
+    self.fail=[0]
+    self.out=[[]]
+    for idx,pattern in enumerate(self.patterns):
+      state=0
+      for byte in pattern.encode('utf-8'):
+        nxt=self.goto[state].get(byte)
+        if nxt is None:
+          nxt=len(self.goto)
+          self.goto[state][byte]=nxt
+          self.goto.append({})
+          self.fail.append(0)
+          self.out.append([])
+        state=nxt
+      self.out[state].append(idx)
+    # breadth-first construction of the failure links
+    queue=list(self.goto[0].values())
+    head=0
+    while head<len(queue):
+      state=queue[head]
+      head=head+1
+      for byte,nxt in self.goto[state].items():
+        queue.append(nxt)
+        f=self.fail[state]
+        while f and byte not in self.goto[f]:
+          f=self.fail[f]
+        self.fail[nxt]=self.goto[f].get(byte,0)
+        self.out[nxt]=self.out[nxt]+self.out[self.fail[nxt]]
+    # every pattern must contain this prefix, texts without it are skipped
+    self.prefix=os.path.commonprefix(self.patterns).encode('utf-8') if self.patterns else b''
+
+  def search(self, data):
+    hits=set()
+    if not self.patterns or (self.prefix and data.find(self.prefix)<0):
+      return hits
+    goto=self.goto
+    fail=self.fail
+    out=self.out
+    state=0
+    for byte in data:
+      while state and byte not in goto[state]:
+        state=fail[state]
+      state=goto[state].get(byte,0)
+      if out[state]:
+        hits.update(out[state])
+    return hits
+
+  def search_file(self, path):
+    try:
+      with open(path,'rb') as fl:
+        return self.search(fl.read())
+    except (IOError,OSError):
+      return set()
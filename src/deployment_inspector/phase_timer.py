@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+#
+# phase_timer.py
+#
+# Wall-clock timings of the phases of an inspector run, printed on one line
+# that the benchmark harness parses:
+#   Timings: scan 0.012s, git 0.345s, total 0.400s
+import time
+
+class PhaseTimer:
+  def __init__(self):
+    self.start=time.time()
+    self.last=self.start
+    self.phases=[]
+
+  def lap(self, name):
+    # closes the phase that started at the previous lap
+    now=time.time()
+    self.phases.append((name,now-self.last))
+    self.last=now
+
+  def add(self, name, seconds):
+    # a phase measured elsewhere, e.g. summed over worker threads
+    self.phases.append((name,seconds))
+
+  def format(self):
+    parts=["{} {:.3f}s".format(name,seconds) for name,seconds in self.phases]
+    parts.append("total {:.3f}s".format(time.time()-self.start))
+    return "Timings: "+", ".join(parts)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# rules.py
+#
+# Declarative naming and layout rules of the deployments tree.
+#
+# A rule has a name, an optional regular expression searched in an entry name,
+# and optional conditions on the rules evaluated before it (`when`: all must
+# have matched, `unless`: none may have matched). The names of the matched
+# rules tag the entry; a matched rule with an alert adds that message. Rules
+# are compiled once when the RuleSet is built, and each distinct entry name is
+# classified once: deploy.sh or version names repeat across environments.
+# Every RuleSet counts evaluations and matches and times each rule, so that a
+# new rule that slows down the all-pipelines audit shows up in the timings.
+import re
+import time
+
+class Rule:
+  def __init__(self, name, pattern=None, when=(), unless=(), alert=None, flags=0):
+    self.name=name
+    self.pattern=pattern
+    self.regex=re.compile(pattern,flags) if pattern is not None else None
+    self.when=tuple(when)
+    self.unless=tuple(unless)
+    self.alert=alert
+    self.evaluated=0
+    self.matched=0
+    self.seconds=0.0
+
+class RuleSet:
+  def __init__(self, rules):
+    self.rules=list(rules)
+    names=set()
+    for rule in self.rules:
+      for dep in rule.when+rule.unless:
+        if dep not in names:
+          raise ValueError("Rule {} refers to {}, which is not defined before it".format(rule.name,dep))
+      names.add(rule.name)
+    self.cache={}
+    self.lookups=0
+
+  def classify(self, entry):
+    # the set of rule names matched by entry
+    self.lookups=self.lookups+1
+    tags=self.cache.get(entry)
+    if tags is not None:
+      return tags
+    found=set()
+    for rule in self.rules:
+      if any(dep not in found for dep in rule.when) or any(dep in found for dep in rule.unless):
+        continue
+      start=time.perf_counter()
+      hit=rule.regex is None or rule.regex.search(entry) is not None
+      rule.seconds=rule.seconds+time.perf_counter()-start
+      rule.evaluated=rule.evaluated+1
+      if hit:
+        rule.matched=rule.matched+1
+        found.add(rule.name)
+    tags=frozenset(found)
+    self.cache[entry]=tags
+    return tags
+
+  def alerts(self, entry):
+    tags=self.classify(entry)
+    return [rule.alert.format(entry) for rule in self.rules if rule.alert is not None and rule.name in tags]
+
+  def format_stats(self):
+    lines=["{:<16}{:>10}{:>10}{:>12}".format("rule","evaluated","matched","seconds")]
+    for rule in self.rules:
+      lines.append("{:<16}{:>10}{:>10}{:>12.6f}".format(rule.name,rule.evaluated,rule.matched,rule.seconds))
+    lines.append("{} lookups, {} distinct entries".format(self.lookups,len(self.cache)))
+    return lines
+
+# "v1.01.00" and "1.01.00" are deployments; other names with three numbers
+# look like deployments and are reported as misnamed
+VERSION_DIR=re.compile(r"^[vV]?(\d)\.(\d\d)\.(\d\d)$")
+
+def parse_version(name):
+  # numeric tuple to order deployments, names that are not versions sort first
+  hit=VERSION_DIR.search(name)
+  if hit is None:
+    return ((),name)
+  return (tuple(int(x) for x in hit.groups()),name)
+
+def pipeline_rules():
+  # entries of a pipeline folder
+  return RuleSet([
+    Rule("deploy_script",r"deploy\.sh"),
+    Rule("properties",r"properties"),
+    Rule("version_like",r"\d+.\d+.\d+"),
+    Rule("deployment",VERSION_DIR.pattern,when=["version_like"]),
+    Rule("misnamed",when=["version_like"],unless=["deployment"],alert="{} looks like a deployment, but its naming is incorrect!"),
+    Rule("redundant",unless=["deploy_script","properties","version_like"],alert="{} is a redundant file"),
+  ])
+
+def src_rules():
+  # entries of the src folder of a deployment
+  return RuleSet([
+    Rule("repository",r"LPEA_CAD"),
+  ])
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# scanner.py
+#
+# Builds the deployment inventory shared by check_deployments.py and
+# check_obsoleteness.py in one in-process pass over
+#   <root>/{prod,sandbox,qa,dev}/scripts/deployments/<pipeline>/<version>
+#
+# Directories are listed with os.scandir, and the listings of pipelines and
+# the recursive .profile searches of deployments run in a thread pool, so that
+# all environments are scanned at the same time without any find subprocess.
+# Given an inventory.Snapshot, directories whose mtime did not change since
+# the previous run are not listed again.
+import os
+from concurrent.futures import ThreadPoolExecutor
+import rules
+
+DEFAULT_ROOT="/dlmp"
+SUPER_DIR_NAMES=["prod","sandbox","qa","dev"]
+DEPLOYMENTS_SUBDIR="scripts/deployments"
+VERSION_DIR=rules.VERSION_DIR
+
+class Deployment:
+  def __init__(self, env, pipeline, name, path):
+    self.env=env
+    self.pipeline=pipeline
+    self.name=name
+    self.path=path
+    # numeric version tuple, so that deployments sort as versions and not as strings
+    self.version=rules.parse_version(name)
+    self.profiles=[]
+    # entries of the src folder, None when the deployment has no src folder
+    self.src_items=None
+
+class Pipeline:
+  def __init__(self, env, name, path):
+    self.env=env
+    self.name=name
+    self.path=path
+    self.entries=[]
+    self.deployments=[]
+
+def deployments_dir(root, env):
+  return os.path.join(root,env,DEPLOYMENTS_SUBDIR)
+
+def read_dir(path):
+  # (name, is a directory, is a directory and not a symbolic link) per entry
+  try:
+    with os.scandir(path) as it:
+      return [(e.name,e.is_dir(),e.is_dir(follow_symlinks=False)) for e in it]
+  except OSError:
+    return []
+
+def list_dir(path, snapshot=None):
+  entries=snapshot.read_dir(path) if snapshot is not None else read_dir(path)
+  return [(name,is_dir) for name,is_dir,is_tree in entries]
+
+def find_profiles(path, snapshot=None):
+  # equivalent of `find <path> -name '*.profile'`, symbolic links are not followed
+  reader=snapshot.read_dir if snapshot is not None else read_dir
+  found=[]
+  stack=[path]
+  while stack:
+    current=stack.pop()
+    for name,is_dir,is_tree in reader(current):
+      if name.endswith(".profile"):
+        found.append(os.path.join(current,name))
+      if is_tree:
+        stack.append(os.path.join(current,name))
+  return sorted(found)
+
+def scan_deployment(deployment, profiles, snapshot=None):
+  src_dir=os.path.join(deployment.path,"src")
+  if os.path.isdir(src_dir):
+    deployment.src_items=[name for name,is_dir in list_dir(src_dir,snapshot)]
+  if profiles:
+    deployment.profiles=find_profiles(deployment.path,snapshot)
+  return deployment
+
+def scan_pipeline(pipeline, snapshot=None):
+  for name,is_dir in list_dir(pipeline.path,snapshot):
+    pipeline.entries.append(name)
+    if is_dir and VERSION_DIR.search(name):
+      pipeline.deployments.append(Deployment(pipeline.env,pipeline.name,name,os.path.join(pipeline.path,name)))
+  # in version order, whatever the order of the directory entries
+  pipeline.deployments.sort(key=lambda deployment: deployment.version)
+  return pipeline
+
+# Returns {env: {pipeline name: Pipeline}}; an environment whose deployments
+# folder does not exist maps to None. With `pipelines`, only those pipelines
+# are scanned; with profiles=False, the .profile search is skipped.
+def scan(root=DEFAULT_ROOT, envs=SUPER_DIR_NAMES, pipelines=None, profiles=True, workers=16, snapshot=None):
+  inventory={}
+  with ThreadPoolExecutor(max_workers=workers) as pool:
+    jobs=[]
+    for env in envs:
+      deploy_dir=deployments_dir(root,env)
+      if not os.path.isdir(deploy_dir):
+        inventory[env]=None
+        continue
+      inventory[env]={}
+      if pipelines is None:
+        names=sorted(name for name,is_dir in list_dir(deploy_dir,snapshot) if is_dir)
+      else:
+        names=[name for name in pipelines if os.path.isdir(os.path.join(deploy_dir,name))]
+      for name in names:
+        pipeline=Pipeline(env,name,os.path.join(deploy_dir,name))
+        inventory[env][name]=pipeline
+        jobs.append(pool.submit(scan_pipeline,pipeline,snapshot))
+    deployment_jobs=[]
+    for job in jobs:
+      for deployment in job.result().deployments:
+        deployment_jobs.append(pool.submit(scan_deployment,deployment,profiles,snapshot))
+    for job in deployment_jobs:
+      job.result()
+  if snapshot is not None:
+    snapshot.record_inventory(inventory,pipelines is None,profiles)
+  return inventory
@@ -1,14 +1,28 @@
 import os,sys
 from optparse import OptionParser
+import shutil
 import subprocess
+import tempfile
+from detailed_diff import detailed_diff,is_identical,format_summary,write_report
+import tabular_diff
+from sketch import file_sketch,compare_sketches,format_estimate
 
 def GetArgs():
-    usage = "python cmp_single_file.py -t tested_run -f tested_file(relative) -r saved_output_folder -o output_dir"
+    usage = "python cmp_single_file.py -t tested_run -f tested_file(relative) -r saved_output_folder -o output_dir [-d -m max_mem_MB -n examples] [-T -k keys --absTol x --relTol y] [-q]"
     parser = OptionParser()
     parser.add_option("-t", "--testedRun", dest="tstRun", help="the path to the tested run")
     parser.add_option("-f", "--testedFile", dest="tstFile", help="the relative path to the tested file")
     parser.add_option("-r", "--reference", dest="refPath", help = "the saved output folder")
     parser.add_option("-o", "--outputDir", dest="outDir", help = "the output directory")
+    parser.add_option("-d", "--detailed", dest="detailed", action="store_true", default=False, help = "report line-level differences (optional)")
+    parser.add_option("-m", "--maxMem", dest="maxMem", type="int", default=512, help = "memory budget in MB for the detailed report (default 512)")
+    parser.add_option("-n", "--examples", dest="nExamples", type="int", default=10, help = "number of example lines per difference type in the detailed report (default 10)")
+    parser.add_option("-q", "--quick", dest="quick", action="store_true", default=False, help = "estimate the similarity from compact sketches instead of comparing contents, read from sampled blocks for outputs over 16 MB (optional)")
+    parser.add_option("-T", "--tabular", dest="tabular", action="store_true", default=False, help = "compare tables cell by cell with numeric tolerances (optional)")
+    parser.add_option("-k", "--keys", dest="keys", default="", help = "comma-separated key column names or 1-based indices used to align table rows")
+    parser.add_option("--absTol", dest="absTol", type="float", default=1e-9, help = "absolute tolerance for numeric table cells (default 1e-9)")
+    parser.add_option("--relTol", dest="relTol", type="float", default=1e-6, help = "relative tolerance for numeric table cells (default 1e-6)")
+    parser.add_option("--tableExt", dest="tableExt", default=".tsv,.csv", help = "comma-separated extensions compared as tables (default .tsv,.csv)")
     (options, args) = parser.parse_args()
     tstRun = options.tstRun
     if not tstRun:
@@ -40,9 +54,9 @@ def GetArgs():
             print("Cannot make the output dir!")
             sys.exit(1)
 
-    return (tstRun,tstFile,refPath,outDir)
+    return (tstRun,tstFile,refPath,outDir,options)
 
-def comp_file(refFile,testFile,outFolder):
+def comp_file(refFile,testFile,outFolder,detail=None,table=None,quick=False):
     outcome="\t"
     code=0
     if os.path.isfile(testFile):
@@ -62,14 +76,48 @@ def comp_file(refFile,testFile,outFolder):
         else:
             outcome=outcome+"\n\t!!!File size decreases by {:.2%}.".format(-x)
         code=1
+    if quick:
+        # an estimate cannot prove equality, so the code only reflects sizes
+        outcome=outcome+format_estimate(compare_sketches(file_sketch(refFile),file_sketch(testFile)))
+        return outcome,code
+    if table and os.path.splitext(refFile)[1] in table["exts"]:
+        # numeric noise may change the file size, so only the table verdict counts
+        try:
+            res=tabular_diff.tabular_diff(refFile,testFile,table["keys"],table["absTol"],table["relTol"])
+        except ValueError as e:
+            res=None
+            outcome=outcome+"\n\t!!!Cannot compare as a table: "+str(e)
+        if res is not None:
+            if tabular_diff.is_identical(res):
+                outcome=outcome+"\n\tTable contents match the reference within tolerance."
+                code=0
+            else:
+                outcome=outcome+"\n\t!!!Table contents differ from the reference."
+                code=1
+            outcome=outcome+tabular_diff.format_summary(res)
+            return outcome,code
     if os.path.splitext(refFile)[1] not in ['.zip','.gz','.tar','.bam','.bai']:
-        tmpf1=os.path.join(outFolder,"temp1")
-        tmpf2=os.path.join(outFolder,"temp2")
+        if detail:
+            res=detailed_diff(refFile,testFile,outFolder,detail["maxMem"],detail["nExamples"])
+            write_report(res,detail["reportFile"],refFile,testFile)
+            if is_identical(res):
+                outcome=outcome+"\n\tContents are the same as the reference."
+            else:
+                outcome=outcome+"\n\t!!!Contents differ from the reference."
+                code=1
+            outcome=outcome+format_summary(res)+"\n\tDetailed report: "+detail["reportFile"]
+            return outcome,code
+        # a private scratch folder, so that concurrent comparisons sharing
+        # the output directory do not overwrite each other's sorted files
+        scratchDir=tempfile.mkdtemp(prefix="cmp",dir=outFolder)
+        tmpf1=os.path.join(scratchDir,"temp1")
+        tmpf2=os.path.join(scratchDir,"temp2")
         os.system("sort "+refFile+" >"+tmpf1)
         os.system("sort "+testFile+" >"+tmpf2)
         cmd="diff "+tmpf1+" "+tmpf2
         P=subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
         out,err=P.communicate()
+        shutil.rmtree(scratchDir,ignore_errors=True)
         if len(out)>0:
             outcome=outcome+"\n\t!!!Contents differ from the reference."
             code=1
@@ -78,7 +126,15 @@ def comp_file(refFile,testFile,outFolder):
     return outcome,code
 
 if __name__=="__main__":
-    tstRun,tstFile,refPath,outDir=GetArgs()
+    tstRun,tstFile,refPath,outDir,options=GetArgs()
+    detail=None
+    if options.detailed:
+        detail={"maxMem":options.maxMem,"nExamples":options.nExamples,
+                "reportFile":os.path.join(outDir,os.path.basename(tstFile)+".diff")}
+    table=None
+    if options.tabular:
+        table={"keys":[k for k in options.keys.split(",") if k],"absTol":options.absTol,
+               "relTol":options.relTol,"exts":options.tableExt.split(",")}
     resFile=os.path.join(outDir,"regr.outcome")
     with open(resFile,'w') as of:
         saved_path=os.path.join(refPath,tstFile)
@@ -88,7 +144,7 @@ if __name__=="__main__":
             print(code)
             print("The tested file does not have a corresponding reference!")
         else:
-            outcome,code=comp_file(saved_path,test_path,outDir)
+            outcome,code=comp_file(saved_path,test_path,outDir,detail,table,options.quick)
             print(code)
             print("Tested file: "+test_path)
             print("Reference file: "+saved_path)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+#
+# detailed_diff.py
+#
+# Reports line-level differences between a reference file and a tested file,
+# disregarding line order, within a bounded amount of memory.
+#
+# Each file is cut into chunks of at most half the memory budget, counting
+# the per-line object overhead and not only the bytes of the lines; every chunk
+# is sorted and, unless the whole file fits in one chunk, spilled to a run file
+# under a private scratch folder. The runs are merged back into a single sorted
+# stream per file and both streams are walked together, so identical lines are
+# counted without ever holding either file in memory.
+import heapq
+import itertools
+import os
+import shutil
+import sys
+import tempfile
+
+# memory of a line held in a chunk beyond its bytes: the bytes object header
+# and its slot in the list
+LINE_OVERHEAD=sys.getsizeof(b'')+8
+READ_HINT=1<<20
+
+def read_chunk(fl,maxBytes):
+    # lines whose memory, overhead included, stays within maxBytes: each read
+    # asks for the raw bytes left in the budget at the ratio of raw bytes to
+    # memory seen so far, starting with a small read
+    lines=[]
+    used=0
+    raw=0
+    hint=max(1,maxBytes//64)
+    while used<maxBytes:
+        block=fl.readlines(min(READ_HINT,hint))
+        if not block:
+            break
+        n=sum(map(len,block))
+        raw+=n
+        used+=n+LINE_OVERHEAD*len(block)
+        lines.extend(block)
+        hint=max(1,(maxBytes-used)*raw//used)
+    return lines
+
+def sorted_lines(path,scratchDir,maxBytes):
+    runs=[]
+    with open(path,'rb') as fl:
+        while True:
+            lines=read_chunk(fl,maxBytes)
+            if not lines:
+                break
+            if not lines[-1].endswith(b'\n'):
+                lines[-1]=lines[-1]+b'\n'
+            lines.sort()
+            if not runs and not fl.peek(1):
+                # the whole file fits in one chunk, no need to spill
+                return iter(lines),[]
+            fd,runPath=tempfile.mkstemp(prefix="run",dir=scratchDir)
+            with os.fdopen(fd,'wb') as of:
+                of.writelines(lines)
+            runs.append(runPath)
+            del lines
+    handles=[open(p,'rb',buffering=1<<16) for p in runs]
+    return heapq.merge(*handles),handles
+
+def count_lines(stream):
+    for line,group in itertools.groupby(stream):
+        yield line,sum(1 for _ in group)
+
+def compare_streams(refStream,tstStream,nExamples):
+    res={"ref_only":0,"tst_only":0,"multiplicity":0,"same":0,
+         "ref_only_examples":[],"tst_only_examples":[],"multiplicity_examples":[]}
+    refIter=count_lines(refStream)
+    tstIter=count_lines(tstStream)
+    ref=next(refIter,None)
+    tst=next(tstIter,None)
+    while ref is not None or tst is not None:
+        if tst is None or (ref is not None and ref[0]<tst[0]):
+            # counts are in lines, multiplicity changes are in distinct lines
+            res["ref_only"]+=ref[1]
+            if len(res["ref_only_examples"])<nExamples:
+                res["ref_only_examples"].append(ref)
+            ref=next(refIter,None)
+        elif ref is None or tst[0]<ref[0]:
+            res["tst_only"]+=tst[1]
+            if len(res["tst_only_examples"])<nExamples:
+                res["tst_only_examples"].append(tst)
+            tst=next(tstIter,None)
+        else:
+            if ref[1]!=tst[1]:
+                res["multiplicity"]+=1
+                if len(res["multiplicity_examples"])<nExamples:
+                    res["multiplicity_examples"].append((ref[0],ref[1],tst[1]))
+            else:
+                res["same"]+=ref[1]
+            ref=next(refIter,None)
+            tst=next(tstIter,None)
+    return res
+
+def detailed_diff(refFile,testFile,outFolder,maxMem=512,nExamples=10):
+    # maxMem is given in MB and shared by both files
+    maxBytes=max(1,maxMem*(1<<20)//2)
+    scratchDir=tempfile.mkdtemp(prefix="ddiff",dir=outFolder)
+    handles=[]
+    try:
+        refStream,h1=sorted_lines(refFile,scratchDir,maxBytes)
+        handles.extend(h1)
+        tstStream,h2=sorted_lines(testFile,scratchDir,maxBytes)
+        handles.extend(h2)
+        return compare_streams(refStream,tstStream,nExamples)
+    finally:
+        for h in handles:
+            h.close()
+        shutil.rmtree(scratchDir,ignore_errors=True)
+
+def is_identical(res):
+    return res["ref_only"]==0 and res["tst_only"]==0 and res["multiplicity"]==0
+
+def format_summary(res):
+    outcome="\n\tLines only in the reference: {}".format(res["ref_only"])
+    outcome=outcome+"\n\tLines only in the tested file: {}".format(res["tst_only"])
+    outcome=outcome+"\n\tLines with changed multiplicity: {}".format(res["multiplicity"])
+    outcome=outcome+"\n\tLines matching the reference: {}".format(res["same"])
+    return outcome
+
+def write_report(res,path,refFile,testFile):
+    def show(line):
+        return line.rstrip(b'\n').decode('utf-8','replace')
+    with open(path,'w') as of:
+        of.write("Reference file: {}\nTested file: {}\n".format(refFile,testFile))
+        of.write(format_summary(res).replace("\n\t","\n").lstrip("\n")+"\n")
+        of.write("\n# First lines only in the reference (count, line)\n")
+        for line,n in res["ref_only_examples"]:
+            of.write("<\t{}\t{}\n".format(n,show(line)))
+        of.write("\n# First lines only in the tested file (count, line)\n")
+        for line,n in res["tst_only_examples"]:
+            of.write(">\t{}\t{}\n".format(n,show(line)))
+        of.write("\n# First lines with changed multiplicity (reference count, tested count, line)\n")
+        for line,n1,n2 in res["multiplicity_examples"]:
+            of.write("~\t{}\t{}\t{}\n".format(n1,n2,show(line)))
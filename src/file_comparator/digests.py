@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# digests.py
+#
+# Single-pass file digests used to compare one saved output against many
+# tested runs without sorting anything.
+#
+# Text outputs are compared disregarding line order (as sort+diff does), so
+# their digest is a multiset hash: the number of lines plus the sum, modulo
+# 2^64, of a 64-bit hash of every line. Binary outputs (.gz, .bam, ...) are
+# compared by size only, as comp_file does: their bytes change from run to run
+# (e.g. the @PG header lines of BAMs). A plain SHA-256 of their bytes is
+# available separately for a byte-level check.
+#
+# The golden manifest caches the digests of saved outputs, keyed by their path
+# relative to the saved output folder and invalidated when size or mtime change;
+# it records that folder and is reset when used with another one.
+import hashlib
+import json
+import os
+
+BINARY_EXTS=['.zip','.gz','.tar','.bam','.bai']
+BLOCK_SIZE=1<<24
+
+def is_binary(path):
+    return os.path.splitext(path)[1] in BINARY_EXTS
+
+def read_lines(path):
+    with open(path,'rb') as fl:
+        rest=b''
+        while True:
+            block=fl.read(BLOCK_SIZE)
+            if not block:
+                break
+            lines=(rest+block).split(b'\n')
+            rest=lines.pop()
+            yield lines
+        if rest:
+            yield [rest]
+
+def text_digest(path):
+    blake2b=hashlib.blake2b
+    from_bytes=int.from_bytes
+    nlines=0
+    total=0
+    for lines in read_lines(path):
+        nlines+=len(lines)
+        total+=sum(from_bytes(blake2b(l,digest_size=8).digest(),'little') for l in lines)
+    return "{}:{:016x}".format(nlines,total%(1<<64))
+
+def binary_digest(path):
+    h=hashlib.sha256()
+    with open(path,'rb') as fl:
+        while True:
+            block=fl.read(BLOCK_SIZE)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def size_digest(path):
+    return "size:{}".format(os.path.getsize(path))
+
+def file_digest(path):
+    if is_binary(path):
+        return size_digest(path)
+    return text_digest(path)
+
+class GoldenManifest:
+    # the digests are only valid for one saved output folder: a manifest
+    # written for another one (e.g. a copy with preserved mtimes) is reset
+    def __init__(self,path,root=None):
+        self.path=path
+        self.root=os.path.abspath(root) if root else None
+        self.entries={}
+        self.changed=False
+        if path and os.path.isfile(path):
+            try:
+                with open(path,'r') as fl:
+                    content=json.load(fl)
+            except ValueError:
+                print("Golden manifest {} is not readable and will be rebuilt.".format(path))
+                content={}
+            if isinstance(content,dict) and content.get("root")==self.root and isinstance(content.get("entries"),dict):
+                self.entries=content["entries"]
+            elif content:
+                print("Golden manifest {} was written for another saved output folder and will be rebuilt.".format(path))
+                self.changed=True
+
+    def lookup(self,relative_path,abs_path):
+        st=os.stat(abs_path)
+        entry=self.entries.get(relative_path)
+        if entry is None or entry.get("size")!=st.st_size or entry.get("mtime")!=st.st_mtime:
+            entry={"size":st.st_size,"mtime":st.st_mtime}
+            self.entries[relative_path]=entry
+            self.changed=True
+        return entry
+
+    def get(self,relative_path,abs_path,key):
+        return self.lookup(relative_path,abs_path).get(key)
+
+    def put(self,relative_path,abs_path,key,value):
+        self.lookup(relative_path,abs_path)[key]=value
+        self.changed=True
+
+    def save(self):
+        if self.path and self.changed:
+            tmp=self.path+".tmp{}".format(os.getpid())
+            with open(tmp,'w') as of:
+                json.dump({"root":self.root,"entries":self.entries},of,indent=1,sort_keys=True)
+            os.replace(tmp,self.path)
+            self.changed=False
@@ -1,9 +1,14 @@
 import os,sys
 from optparse import OptionParser
+import shutil
 import subprocess
+import tempfile
+import time
+from detailed_diff import detailed_diff,is_identical,format_summary,write_report
+import tabular_diff
 
 def GetArgs():
-    usage = "python report.py -c checkpoint_file -g goldendata_running_folder -r saved_output_folder -o out_directory -s start_point -e end_point"
+    usage = "python report.py -c checkpoint_file -g goldendata_running_folder -r saved_output_folder -o out_directory -s start_point -e end_point [-d -m max_mem_MB -n examples] [-T -k keys --absTol x --relTol y] [-w --interval sec --timeout sec]\n  -w stops when every step is resolved, when the end step is and the files of earlier steps are still missing, or after --timeout seconds (default 86400)"
     parser = OptionParser()
     parser.add_option("-c", "--checkpointFile", dest="chkFile", help = "the checkpoint file")
     parser.add_option("-g", "--goldenrun", dest="gldPath", help="the sample folder of goldendata after running with debug mode")
@@ -11,6 +16,17 @@ def GetArgs():
     parser.add_option("-o", "--outputDir", dest="outDir", help = "the output directory")
     parser.add_option("-s", "--startPoint", dest="staPoint", help = "the start step in the checkpoint file")
     parser.add_option("-e", "--endPoint", dest="endPoint", help = "the end step in the checkpoint file")
+    parser.add_option("-d", "--detailed", dest="detailed", action="store_true", default=False, help = "report line-level differences for each step (optional)")
+    parser.add_option("-m", "--maxMem", dest="maxMem", type="int", default=512, help = "memory budget in MB for the detailed report (default 512)")
+    parser.add_option("-n", "--examples", dest="nExamples", type="int", default=10, help = "number of example lines per difference type in the detailed report (default 10)")
+    parser.add_option("-w", "--watch", dest="watch", action="store_true", default=False, help = "compare each step as soon as its tested file is complete (optional)")
+    parser.add_option("--interval", dest="interval", type="float", default=30, help = "polling interval in seconds for the watch mode (default 30)")
+    parser.add_option("--timeout", dest="timeout", type="float", default=86400, help = "give up watching after this many seconds, 0 for no limit (default 86400)")
+    parser.add_option("-T", "--tabular", dest="tabular", action="store_true", default=False, help = "compare tables cell by cell with numeric tolerances (optional)")
+    parser.add_option("-k", "--keys", dest="keys", default="", help = "comma-separated key column names or 1-based indices used to align table rows")
+    parser.add_option("--absTol", dest="absTol", type="float", default=1e-9, help = "absolute tolerance for numeric table cells (default 1e-9)")
+    parser.add_option("--relTol", dest="relTol", type="float", default=1e-6, help = "relative tolerance for numeric table cells (default 1e-6)")
+    parser.add_option("--tableExt", dest="tableExt", default=".tsv,.csv", help = "comma-separated extensions compared as tables (default .tsv,.csv)")
     (options, args) = parser.parse_args()
     chkFile = options.chkFile
     if not chkFile:
@@ -51,9 +67,9 @@ def GetArgs():
         print(usage)
         sys.exit(1)
     endPoint=int(temp2)
-    return (chkFile,outDir,gldPath,refPath,staPoint,endPoint)
+    return (chkFile,outDir,gldPath,refPath,staPoint,endPoint,options)
 
-def comp_file(refFile,testFile,outFolder):
+def comp_file(refFile,testFile,outFolder,detail=None,table=None):
     outcome="\t"
     if os.path.isfile(testFile):
         outcome=outcome+"Tested file exists."
@@ -70,14 +86,41 @@ def comp_file(refFile,testFile,outFolder):
             outcome=outcome+"\n\t!!!File size increases by {:.2%}.".format(x)
         else:
             outcome=outcome+"\n\t!!!File size decreases by {:.2%}.".format(-x)
+    if table and os.path.splitext(refFile)[1] in table["exts"]:
+        # numeric noise may change the file size, so only the table verdict counts
+        try:
+            res=tabular_diff.tabular_diff(refFile,testFile,table["keys"],table["absTol"],table["relTol"])
+        except ValueError as e:
+            res=None
+            outcome=outcome+"\n\t!!!Cannot compare as a table: "+str(e)
+        if res is not None:
+            if tabular_diff.is_identical(res):
+                outcome=outcome+"\n\tTable contents match the reference within tolerance."
+            else:
+                outcome=outcome+"\n\t!!!Table contents differ from the reference."
+            outcome=outcome+tabular_diff.format_summary(res)
+            return outcome
     if os.path.splitext(refFile)[1] not in ['.tar','.zip','.gz','.bam','.bai']:
-        tmpf1=os.path.join(outFolder,"temp1")
-        tmpf2=os.path.join(outFolder,"temp2")
+        if detail:
+            res=detailed_diff(refFile,testFile,outFolder,detail["maxMem"],detail["nExamples"])
+            write_report(res,detail["reportFile"],refFile,testFile)
+            if is_identical(res):
+                outcome=outcome+"\n\tContents are the same as the reference."
+            else:
+                outcome=outcome+"\n\t!!!Contents differ from the reference."
+            outcome=outcome+format_summary(res)+"\n\tDetailed report: "+detail["reportFile"]
+            return outcome
+        # a private scratch folder, so that concurrent comparisons sharing
+        # the output directory do not overwrite each other's sorted files
+        scratchDir=tempfile.mkdtemp(prefix="cmp",dir=outFolder)
+        tmpf1=os.path.join(scratchDir,"temp1")
+        tmpf2=os.path.join(scratchDir,"temp2")
         os.system("sort "+refFile+" >"+tmpf1)
         os.system("sort "+testFile+" >"+tmpf2)
         cmd="diff "+tmpf1+" "+tmpf2
         P=subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
         out,err=P.communicate()
+        shutil.rmtree(scratchDir,ignore_errors=True)
         #print(out)
         if len(out)>0:
             outcome=outcome+"\n\t!!!Contents differ from the reference."
@@ -85,12 +128,90 @@ def comp_file(refFile,testFile,outFolder):
             outcome=outcome+"\n\tContents are the same as the reference."
     return outcome
 
+def report_step_file(of,eachStep,gldPath,refPath,outDir,options,table):
+    stepid,stage,step,relative_path=eachStep
+    saved_path=refPath+"/"+relative_path
+    test_path=gldPath+"/"+relative_path
+    print(test_path)
+    print(saved_path)
+    if os.path.isfile(saved_path)==False:
+        print("Saved output was corrupt. Please notify the golden data author")
+    else:
+        print("Step {}: - STAGE: {}; FUNC: {}\n\tTESTED FILE: {}".format(stepid,stage,step,relative_path))
+        of.write("Step {}: - STAGE: {}; FUNC: {}\n\tTESTED FILE: {}\n".format(stepid,stage,step,relative_path))
+        detail=None
+        if options.detailed:
+            detail={"maxMem":options.maxMem,"nExamples":options.nExamples,
+                    "reportFile":os.path.join(outDir,"step{}.diff".format(stepid))}
+        outcome=comp_file(saved_path,test_path,outDir,detail,table)
+        print(outcome)
+        of.write(outcome+"\n")
+        of.flush()
+
+# Watch mode: compare each tested file as soon as it exists and its size and
+# mtime stay unchanged between two polls, until all steps are resolved or the
+# timeout (in seconds, 0 for none) expires. Once the last step of the range is
+# resolved, the run has gone past the steps whose file never appeared (a
+# crashed or skipped step): they are reported as missing instead of waited for.
+def watch_steps(steps,gldPath,refPath,of,report_step,interval,timeout):
+    pending=list(steps)
+    lastSeen={}
+    lastStep=max([eachStep[0] for eachStep in steps],default=None)
+    finished=False
+    deadline=None
+    if timeout>0:
+        deadline=time.time()+timeout
+    while len(pending)>0:
+        waiting=[]
+        for eachStep in pending:
+            saved_path=refPath+"/"+eachStep[3]
+            test_path=gldPath+"/"+eachStep[3]
+            if os.path.isfile(saved_path)==False:
+                report_step(eachStep)
+                continue
+            try:
+                st=os.stat(test_path)
+            except OSError:
+                if finished:
+                    report_step(eachStep)
+                else:
+                    waiting.append(eachStep)
+                continue
+            signature=(st.st_size,st.st_mtime)
+            if lastSeen.get(test_path)==signature:
+                report_step(eachStep)
+                if eachStep[0]==lastStep:
+                    finished=True
+            else:
+                lastSeen[test_path]=signature
+                waiting.append(eachStep)
+        pending=waiting
+        if len(pending)==0:
+            break
+        if finished and all(not os.path.exists(gldPath+"/"+eachStep[3]) for eachStep in pending):
+            # the end step was resolved during this poll
+            for eachStep in pending:
+                report_step(eachStep)
+            break
+        if deadline is not None and time.time()>=deadline:
+            for stepid,stage,step,relative_path in pending:
+                print("Step {}: tested file {} was not completed before the watch timeout.".format(stepid,relative_path))
+                of.write("Step {}: - STAGE: {}; FUNC: {}\n\tTESTED FILE: {}\n".format(stepid,stage,step,relative_path))
+                of.write("\t!!!Tested file was not completed before the watch timeout.\n")
+            of.flush()
+            break
+        time.sleep(interval)
+
 if __name__=="__main__":
-    chkFile,outDir,gldPath,refPath,staPoint,endPoint=GetArgs()
+    chkFile,outDir,gldPath,refPath,staPoint,endPoint,options=GetArgs()
     checkpoint_file=chkFile
     if os.path.isfile(os.path.abspath(checkpoint_file)) == False:
         print("The checkpoint file cannot be found. Please notify the golden data author.")
         sys.exit(1)
+    table=None
+    if options.tabular:
+        table={"keys":[k for k in options.keys.split(",") if k],"absTol":options.absTol,
+               "relTol":options.relTol,"exts":options.tableExt.split(",")}
     dat=open(checkpoint_file,'r')
     stepid=[]
     stage=[]
@@ -107,22 +228,19 @@ if __name__=="__main__":
         folder.append(word[4])
         fname.append(word[5])
     n=len(step)
+    steps=[]
+    for i in range(n):
+        if stepid[i]>=staPoint and stepid[i]<=endPoint:
+            relative_path=folder[i]+"/"+fname[i]
+            if folder[i]=="./":
+                relative_path=fname[i]
+            steps.append((stepid[i],stage[i],step[i],relative_path))
     resFile=os.path.join(outDir,"regr.outcome")
     with open(resFile,'w') as of:
-        for i in range(n):
-            if stepid[i]>=staPoint and stepid[i]<=endPoint:
-                relative_path=folder[i]+"/"+fname[i]
-                if folder[i]=="./":
-                    relative_path=fname[i]
-                saved_path=refPath+"/"+relative_path
-                test_path=gldPath+"/"+relative_path
-                print(test_path)
-                print(saved_path)
-                if os.path.isfile(saved_path)==False:
-                    print("Saved output was corrupt. Please notify the golden data author")
-                else:
-                    print("Step {}: - STAGE: {}; FUNC: {}\n\tTESTED FILE: {}".format(stepid[i],stage[i],step[i],relative_path))
-                    of.write("Step {}: - STAGE: {}; FUNC: {}\n\tTESTED FILE: {}\n".format(stepid[i],stage[i],step[i],relative_path))
-                    outcome=comp_file(saved_path,test_path,outDir)
-                    print(outcome)
-                    of.write(outcome+"\n")
+        def report_step(eachStep):
+            report_step_file(of,eachStep,gldPath,refPath,outDir,options,table)
+        if options.watch:
+            watch_steps(steps,gldPath,refPath,of,report_step,options.interval,options.timeout)
+        else:
+            for eachStep in steps:
+                report_step(eachStep)
@@ -0,0 +1,208 @@
+import os,sys
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor
+from digests import GoldenManifest,file_digest,binary_digest,is_binary
+from detailed_diff import detailed_diff,write_report
+import tabular_diff
+from sketch import file_sketch,compare_sketches,format_cell
+
+def GetArgs():
+    usage = "python report_matrix.py -c checkpoint_file -g tested_run_folder [-g tested_run_folder ...] -r saved_output_folder -o out_directory -s start_point -e end_point [-j workers -M manifest -b -d -q] [-T -k keys --absTol x --relTol y]"
+    parser = OptionParser()
+    parser.add_option("-c", "--checkpointFile", dest="chkFile", help = "the checkpoint file")
+    parser.add_option("-g", "--testedRun", dest="runs", action="append", default=[], help="a tested run folder (repeat or comma-separate for several runs)")
+    parser.add_option("-r", "--reference", dest="refPath", help = "the saved_output_folder")
+    parser.add_option("-o", "--outputDir", dest="outDir", help = "the output directory")
+    parser.add_option("-s", "--startPoint", dest="staPoint", help = "the start step in the checkpoint file")
+    parser.add_option("-e", "--endPoint", dest="endPoint", help = "the end step in the checkpoint file")
+    parser.add_option("-j", "--workers", dest="workers", type="int", default=min(8,os.cpu_count() or 1), help = "number of files digested in parallel (default: up to 8)")
+    parser.add_option("-M", "--manifest", dest="manifest", help = "the golden manifest caching digests of saved outputs (default: out_directory/golden.manifest)")
+    parser.add_option("-q", "--quick", dest="quick", action="store_true", default=False, help = "estimate similarities from compact sketches instead of exact digests, read from sampled blocks for outputs over 16 MB (optional)")
+    parser.add_option("-b", "--bytes", dest="bytes", action="store_true", default=False, help = "add a byte-level (SHA-256) column per run for binary outputs, which are otherwise compared by size (optional)")
+    parser.add_option("-d", "--detailed", dest="detailed", action="store_true", default=False, help = "write a detailed report for every differing text output (optional)")
+    parser.add_option("-m", "--maxMem", dest="maxMem", type="int", default=512, help = "memory budget in MB for the detailed report (default 512)")
+    parser.add_option("-n", "--examples", dest="nExamples", type="int", default=10, help = "number of example lines per difference type in the detailed report (default 10)")
+    parser.add_option("-T", "--tabular", dest="tabular", action="store_true", default=False, help = "compare tables whose digests differ cell by cell with numeric tolerances, as cmp_single_file.py -T does (optional)")
+    parser.add_option("-k", "--keys", dest="keys", default="", help = "comma-separated key column names or 1-based indices used to align table rows")
+    parser.add_option("--absTol", dest="absTol", type="float", default=1e-9, help = "absolute tolerance for numeric table cells (default 1e-9)")
+    parser.add_option("--relTol", dest="relTol", type="float", default=1e-6, help = "relative tolerance for numeric table cells (default 1e-6)")
+    parser.add_option("--tableExt", dest="tableExt", default=".tsv,.csv", help = "comma-separated extensions compared as tables (default .tsv,.csv)")
+    (options, args) = parser.parse_args()
+    chkFile = options.chkFile
+    if not chkFile:
+        print("No checkpoint file specified.")
+        print(usage)
+        sys.exit(1)
+    outDir = options.outDir
+    if not outDir:
+        print("No output directory specified.")
+        print(usage)
+        sys.exit(1)
+    if not os.path.exists(outDir):
+        try:
+            os.makedirs(outDir)
+        except:
+            print("Cannot make the output dir!")
+            sys.exit(1)
+    runs=[]
+    for eachRun in options.runs:
+        runs.extend([r for r in eachRun.split(",") if r])
+    if len(runs)==0:
+        print("No tested run specified.")
+        print(usage)
+        sys.exit(1)
+    for eachRun in runs:
+        if not os.path.isdir(eachRun):
+            print("Tested run folder does not exist: "+eachRun)
+            sys.exit(1)
+    refPath = options.refPath
+    if not refPath:
+        print("No saved output folder specified.")
+        print(usage)
+        sys.exit(1)
+    temp1 = options.staPoint
+    if not temp1:
+        print("No start point specified.")
+        print(usage)
+        sys.exit(1)
+    staPoint=int(temp1)
+    temp2 = options.endPoint
+    if not temp2:
+        print("No end point specified.")
+        print(usage)
+        sys.exit(1)
+    endPoint=int(temp2)
+    if not options.manifest:
+        options.manifest=os.path.join(outDir,"golden.manifest")
+    return (chkFile,outDir,runs,refPath,staPoint,endPoint,options)
+
+def run_labels(runs):
+    labels=[]
+    for eachRun in runs:
+        label=os.path.basename(os.path.normpath(eachRun))
+        if label in labels:
+            label=label+"#"+str(len(labels)+1)
+        labels.append(label)
+    return labels
+
+def read_checkpoint(checkpoint_file,staPoint,endPoint):
+    steps=[]
+    with open(checkpoint_file,'r') as dat:
+        for line in dat:
+            word=line.strip("\n").split('\t')
+            stepid=int(word[0])
+            if stepid>=staPoint and stepid<=endPoint:
+                relative_path=word[4]+"/"+word[5]
+                if word[4]=="./":
+                    relative_path=word[5]
+                steps.append((stepid,word[1],word[2],relative_path))
+    return steps
+
+# Every file of the step range, saved or tested, is digested (or sketched) exactly
+# once, and all of them are spread over one pool of worker processes. Saved
+# outputs whose digest is already in the golden manifest are not read at all.
+# only, if given, selects the files to digest.
+def digest_all(steps,runs,refPath,manifest,workers,func=file_digest,key="digest",only=None):
+    golden={}
+    tested={}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for stepid,stage,step,relative_path in steps:
+            saved_path=os.path.join(refPath,relative_path)
+            if relative_path in golden or not os.path.isfile(saved_path):
+                continue
+            if only is not None and not only(saved_path):
+                continue
+            cached=manifest.get(relative_path,saved_path,key)
+            if key=="digest" and is_binary(saved_path) and cached is not None and not cached.startswith("size:"):
+                # a SHA-256 cached by an older version
+                cached=None
+            if cached is None:
+                golden[relative_path]=pool.submit(func,saved_path)
+            else:
+                golden[relative_path]=cached
+            for eachRun in runs:
+                test_path=os.path.join(eachRun,relative_path)
+                if os.path.isfile(test_path):
+                    tested[(relative_path,eachRun)]=pool.submit(func,test_path)
+        for relative_path in golden:
+            if hasattr(golden[relative_path],"result"):
+                golden[relative_path]=golden[relative_path].result()
+                manifest.put(relative_path,os.path.join(refPath,relative_path),key,golden[relative_path])
+        for key in tested:
+            tested[key]=tested[key].result()
+    return golden,tested
+
+def within_tolerance(saved_path,test_path,options):
+    keys=[k for k in options.keys.split(",") if k]
+    try:
+        res=tabular_diff.tabular_diff(saved_path,test_path,keys,options.absTol,options.relTol)
+    except ValueError:
+        return False
+    return tabular_diff.is_identical(res)
+
+if __name__=="__main__":
+    chkFile,outDir,runs,refPath,staPoint,endPoint,options=GetArgs()
+    if os.path.isfile(os.path.abspath(chkFile)) == False:
+        print("The checkpoint file cannot be found. Please notify the golden data author.")
+        sys.exit(1)
+    labels=run_labels(runs)
+    steps=read_checkpoint(chkFile,staPoint,endPoint)
+    manifest=GoldenManifest(options.manifest,refPath)
+    if options.quick:
+        golden,tested=digest_all(steps,runs,refPath,manifest,options.workers,file_sketch,"sketch64")
+    else:
+        golden,tested=digest_all(steps,runs,refPath,manifest,options.workers)
+    if options.bytes:
+        golden_bytes,tested_bytes=digest_all(steps,runs,refPath,manifest,options.workers,binary_digest,"sha256",is_binary)
+    manifest.save()
+    resFile=os.path.join(outDir,"regr.matrix")
+    nDiff=0
+    with open(resFile,'w') as of:
+        header="Step\tStage\tFunc\tFile\t"+"\t".join(labels)
+        if options.bytes:
+            header=header+"\t"+"\t".join(label+" (bytes)" for label in labels)
+        print(header)
+        of.write(header+"\n")
+        for stepid,stage,step,relative_path in steps:
+            cells=[]
+            saved_path=os.path.join(refPath,relative_path)
+            for eachRun,label in zip(runs,labels):
+                if relative_path not in golden:
+                    cells.append("NO_REFERENCE")
+                elif (relative_path,eachRun) not in tested:
+                    cells.append("MISSING")
+                    nDiff+=1
+                elif options.quick:
+                    cells.append(format_cell(compare_sketches(golden[relative_path],tested[(relative_path,eachRun)])))
+                elif tested[(relative_path,eachRun)]==golden[relative_path]:
+                    cells.append("same")
+                elif options.tabular and os.path.splitext(relative_path)[1] in options.tableExt.split(",") and \
+                     within_tolerance(saved_path,os.path.join(eachRun,relative_path),options):
+                    # digests are exact, the table verdict counts for tables
+                    cells.append("same (tol)")
+                else:
+                    cells.append("DIFFERS")
+                    nDiff+=1
+                    if options.detailed and not is_binary(saved_path):
+                        test_path=os.path.join(eachRun,relative_path)
+                        res=detailed_diff(saved_path,test_path,outDir,options.maxMem,options.nExamples)
+                        write_report(res,os.path.join(outDir,"step{}.{}.diff".format(stepid,label)),saved_path,test_path)
+            if options.bytes:
+                # byte-level verdict, informative only: it does not count as a difference
+                for eachRun in runs:
+                    if relative_path not in golden_bytes or (relative_path,eachRun) not in tested_bytes:
+                        cells.append("-")
+                    elif tested_bytes[(relative_path,eachRun)]==golden_bytes[relative_path]:
+                        cells.append("same")
+                    else:
+                        cells.append("differs")
+            row="{}\t{}\t{}\t{}\t".format(stepid,stage,step,relative_path)+"\t".join(cells)
+            print(row)
+            of.write(row+"\n")
+    if options.quick:
+        print("Quick mode: cells are ESTIMATES from sketches (J: Jaccard similarity of distinct lines, chg: fraction of reference lines changed; sampled: from the lines of sampled blocks).")
+        print("{} of {} step/run comparison(s) had no tested file.".format(nDiff,len(steps)*len(runs)))
+    else:
+        print("{} of {} step/run comparison(s) did not match the reference.".format(nDiff,len(steps)*len(runs)))
+        if not options.tabular:
+            print("Cells compare exact digests; with -T, tables are compared within the numeric tolerances instead.")
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# sketch.py
+#
+# Compact sketches of large text outputs for a quick-look comparison. The
+# numbers derived from them are ESTIMATES and must be reported as such.
+#
+# A sketch holds
+#   - a bottom-k MinHash of the distinct lines: the k smallest 64-bit blake2b
+#     hashes of the lines. Outputs up to SAMPLE_BYTES are read in full; larger
+#     ones only through N_SAMPLES blocks at fixed relative offsets (the whole
+#     lines inside them), so that a sketch reads a bounded amount of data
+#     whatever the file size. Sampled sketches assume the lines of both files
+#     are in a similar order and are flagged as such;
+#   - the digests of a few blocks sampled at fixed relative offsets, which
+#     tell quickly whether two files of equal size are byte-identical there.
+# Sketches are small JSON-friendly dicts, so they can be cached in the golden
+# manifest next to the exact digests.
+import hashlib
+import heapq
+import os
+from digests import read_lines,is_binary
+
+SKETCH_SIZE=256
+N_BLOCKS=64
+BLOCK_SIZE=1<<16
+SAMPLE_BYTES=16<<20
+N_SAMPLES=256
+
+def is_sampled(path):
+    return os.path.getsize(path)>SAMPLE_BYTES
+
+def sampled_lines(path,n=N_SAMPLES):
+    fsize=os.path.getsize(path)
+    budget=SAMPLE_BYTES
+    if fsize<=budget:
+        for lines in read_lines(path):
+            yield lines
+        return
+    size=budget//n
+    span=fsize-size
+    with open(path,'rb') as fl:
+        for i in range(n):
+            fl.seek(span*i//(n-1))
+            # the lines cut at both ends of the block are left out
+            yield fl.read(size).split(b'\n')[1:-1]
+
+def line_mins(path,k=SKETCH_SIZE):
+    blake2b=hashlib.blake2b
+    from_bytes=int.from_bytes
+    mins=[]
+    nlines=0
+    for lines in sampled_lines(path):
+        nlines+=len(lines)
+        hashes=set(from_bytes(blake2b(l,digest_size=8).digest(),'little') for l in lines)
+        mins=sorted(hashes.union(mins))[:k] if len(hashes)<=k else sorted(set(heapq.nsmallest(k,hashes)).union(mins))[:k]
+    return nlines,mins
+
+def block_digests(path,n=N_BLOCKS,size=BLOCK_SIZE):
+    fsize=os.path.getsize(path)
+    span=max(0,fsize-size)
+    offsets=sorted(set(span*i//max(1,n-1) for i in range(n)))
+    digests=[]
+    with open(path,'rb') as fl:
+        for offset in offsets:
+            fl.seek(offset)
+            digests.append(hashlib.blake2b(fl.read(size),digest_size=8).hexdigest())
+    return digests
+
+def file_sketch(path,k=SKETCH_SIZE):
+    if is_binary(path):
+        # lines mean nothing in compressed or binary outputs, sample blocks only
+        return {"k":0,"lines":0,"size":os.path.getsize(path),"mins":[],"blocks":block_digests(path),"sampled":False}
+    nlines,mins=line_mins(path,k)
+    return {"k":k,"lines":nlines,"size":os.path.getsize(path),"mins":mins,"blocks":block_digests(path),
+            "sampled":is_sampled(path)}
+
+def distinct_estimate(mins,k):
+    if len(mins)<k:
+        # fewer distinct lines than the sketch size: the count is exact
+        return float(len(mins))
+    return (k-1)*float(1<<64)/(mins[k-1]+1)
+
+def compare_sketches(ref,tst):
+    k=min(ref["k"],tst["k"])
+    sameBlocks=0
+    if ref["size"]==tst["size"]:
+        sameBlocks=sum(1 for x,y in zip(ref["blocks"],tst["blocks"]) if x==y)
+    res={"jaccard":None,"changed":None,"same_blocks":sameBlocks,"blocks":len(ref["blocks"]),
+         "sampled":ref.get("sampled",False) or tst.get("sampled",False)}
+    if k==0:
+        return res
+    a=set(ref["mins"][:k])
+    b=set(tst["mins"][:k])
+    union=sorted(a|b)[:k]
+    if len(union)==0:
+        jaccard=1.0
+    else:
+        jaccard=sum(1 for h in union if h in a and h in b)/float(len(union))
+    nRef=distinct_estimate(ref["mins"],k)
+    nUnion=distinct_estimate(union,k)
+    changed=0.0
+    if nRef>0:
+        changed=min(1.0,max(0.0,1.0-jaccard*nUnion/nRef))
+    res["jaccard"]=jaccard
+    res["changed"]=changed
+    return res
+
+def format_estimate(res):
+    outcome="\n\tQuick look (ESTIMATES from sketches, not an exact comparison):"
+    if res["jaccard"] is not None:
+        outcome=outcome+"\n\t  Estimated Jaccard similarity of distinct lines: {:.4f}".format(res["jaccard"])
+        outcome=outcome+"\n\t  Estimated fraction of reference lines changed: {:.2%}".format(res["changed"])
+        if res["sampled"]:
+            outcome=outcome+"\n\t  (lines of sampled blocks only, which assumes a similar line order in both files)"
+    outcome=outcome+"\n\t  Sampled blocks identical: {}/{}".format(res["same_blocks"],res["blocks"])
+    return outcome
+
+def format_cell(res):
+    if res["jaccard"] is None:
+        return "~blocks={}/{}".format(res["same_blocks"],res["blocks"])
+    cell="~J={:.4f},chg={:.2%}".format(res["jaccard"],res["changed"])
+    if res["sampled"]:
+        cell=cell+",sampled"
+    return cell
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+#
+# tabular_diff.py
+#
+# Compares two delimited tables (TSV/CSV metrics files) cell by cell instead of
+# line by line, so that floating-point noise within a tolerance is not reported
+# as a difference.
+#
+# Both tables are loaded in chunks of lines. Every chunk is transposed and each
+# column is converted in one call, so numeric columns end up in typed double
+# arrays and only non-numeric columns are kept as strings. Rows are aligned on
+# the key columns (or on their position when no key is given), and every
+# numeric column is then checked column-wise with
+#     |tested - reference| <= absTol + relTol * |reference|
+# reporting the maximum deviation for each column.
+import csv
+import gc
+import math
+from array import array
+from operator import itemgetter
+
+MISSING_VALUES=('','NA','NaN','nan','.')
+
+def to_float(x):
+    if x in MISSING_VALUES:
+        return math.nan
+    return float(x)
+
+class Table:
+    def __init__(self,path,sep,chunkRows=100000):
+        self.path=path
+        self.header=[]
+        self.columns=[]
+        self.numeric=[]
+        self.nrows=0
+        with open(path,'r',newline='') as fl:
+            for line in fl:
+                if line.strip() and not line.startswith('#'):
+                    self.header=next(csv.reader([line],delimiter=sep))
+                    break
+            ncol=len(self.header)
+            self.columns=[array('d') for _ in range(ncol)]
+            self.numeric=[True]*ncol
+            while True:
+                lines=fl.readlines(chunkRows*64)
+                if not lines:
+                    break
+                if sep=='\t':
+                    # plain TSV needs no quoting rules, splitting is much faster than csv
+                    chunk=[l.rstrip('\r\n').split(sep) for l in lines if l.strip()]
+                else:
+                    chunk=[row for row in csv.reader(lines,delimiter=sep) if row]
+                if chunk:
+                    self.add_chunk(chunk)
+
+    def add_chunk(self,chunk):
+        ncol=len(self.header)
+        if min(map(len,chunk))<ncol:
+            chunk=[r+['']*(ncol-len(r)) for r in chunk]
+        for j in range(ncol):
+            values=list(map(itemgetter(j),chunk))
+            if self.numeric[j]:
+                try:
+                    try:
+                        self.columns[j].extend(array('d',map(float,values)))
+                    except ValueError:
+                        self.columns[j].extend(array('d',map(to_float,values)))
+                    continue
+                except ValueError:
+                    # demote the column to strings once a non-numeric cell shows up
+                    self.columns[j]=[repr(v) for v in self.columns[j]]
+                    self.numeric[j]=False
+            self.columns[j].extend(values)
+        self.nrows+=len(chunk)
+
+    def column_index(self,key):
+        if key in self.header:
+            return self.header.index(key)
+        if key.isdigit() and 0<int(key)<=len(self.header):
+            return int(key)-1
+        return None
+
+def guess_separator(path):
+    if path.endswith('.csv'):
+        return ','
+    return '\t'
+
+def key_value(v):
+    # the value of a key cell in a column typed as text in one table and as
+    # numbers in the other: numbers as floats, missing values as None
+    if isinstance(v,str):
+        try:
+            v=to_float(v)
+        except ValueError:
+            return v
+    return None if v!=v else v
+
+def key_columns(ref,tst,keys):
+    refKey=[ref.column_index(k) for k in keys]
+    tstKey=[tst.column_index(k) for k in keys]
+    if None in refKey or None in tstKey:
+        raise ValueError("Key column(s) {} not found in both tables".format(",".join(keys)))
+    return refKey,tstKey
+
+def keyed_rows(table,keyIdx,normalize):
+    cols=[]
+    for j,norm in zip(keyIdx,normalize):
+        if norm:
+            cols.append(list(map(key_value,table.columns[j])))
+        elif table.numeric[j]:
+            # every NaN read from an array is a new object, unequal to the
+            # others as a dict key: missing keys become None
+            cols.append([None if v!=v else v for v in table.columns[j]])
+        else:
+            cols.append(table.columns[j])
+    return zip(*cols)
+
+def align_rows(ref,tst,keys):
+    if not keys:
+        n=min(ref.nrows,tst.nrows)
+        return array('l',range(n)),array('l',range(n)),ref.nrows-n,tst.nrows-n,0
+    refKey,tstKey=key_columns(ref,tst,keys)
+    # the same key may be read as numbers in one table and as text in the other
+    normalize=[ref.numeric[i]!=tst.numeric[j] for i,j in zip(refKey,tstKey)]
+    tstPos={}
+    dup=0
+    for i,k in enumerate(keyed_rows(tst,tstKey,normalize)):
+        # a repeated key is an extra row of the tested file, the first one is aligned
+        if k in tstPos:
+            dup+=1
+        else:
+            tstPos[k]=i
+    refIdx=array('l')
+    tstIdx=array('l')
+    for i,k in enumerate(keyed_rows(ref,refKey,normalize)):
+        j=tstPos.pop(k,None)
+        if j is not None:
+            refIdx.append(i)
+            tstIdx.append(j)
+    return refIdx,tstIdx,ref.nrows-len(refIdx),len(tstPos)+dup,dup
+
+def same_cell(u,v):
+    if u==v:
+        return True
+    # a column may be typed differently in the two tables, compare the values
+    try:
+        u=to_float(u)
+        v=to_float(v)
+    except ValueError:
+        return False
+    return u==v or (u!=u and v!=v)
+
+def compare_column(a,b,refIdx,tstIdx,absTol,relTol):
+    x=[a[i] for i in refIdx]
+    y=[b[i] for i in tstIdx]
+    dev=[abs(v-u) for u,v in zip(x,y)]
+    # NaN in both tables counts as equal, NaN in one of them as a difference
+    bad=[i for i,(d,u,v) in enumerate(zip(dev,x,y))
+         if not d<=absTol+relTol*abs(u) and not (u!=u and v!=v)]
+    maxAbs=max((d for d in dev if d==d),default=0.0)
+    maxRel=max((d/abs(u) for d,u in zip(dev,x) if d==d and u!=0),default=0.0)
+    return maxAbs,maxRel,bad
+
+def tabular_diff(refFile,testFile,keys=None,absTol=1e-9,relTol=1e-6,chunkRows=100000):
+    sep=guess_separator(refFile)
+    # millions of short-lived row lists only make the cyclic collector rescan the heap
+    gcWasOn=gc.isenabled()
+    gc.disable()
+    try:
+        ref=Table(refFile,sep,chunkRows)
+        tst=Table(testFile,sep,chunkRows)
+    finally:
+        if gcWasOn:
+            gc.enable()
+    res={"ref_rows":ref.nrows,"tst_rows":tst.nrows,"columns":[],
+         "ref_only_columns":[c for c in ref.header if c not in tst.header],
+         "tst_only_columns":[c for c in tst.header if c not in ref.header]}
+    refIdx,tstIdx,res["ref_only_rows"],res["tst_only_rows"],res["dup_keys"]=align_rows(ref,tst,keys)
+    # keys may be given as names or as 1-based indices
+    refKey=key_columns(ref,tst,keys)[0] if keys else []
+    for j,name in enumerate(ref.header):
+        if name in res["ref_only_columns"] or j in refKey:
+            continue
+        k=tst.header.index(name)
+        if ref.numeric[j] and tst.numeric[k]:
+            maxAbs,maxRel,bad=compare_column(ref.columns[j],tst.columns[k],refIdx,tstIdx,absTol,relTol)
+            res["columns"].append((name,"numeric",len(bad),maxAbs,maxRel))
+        else:
+            a=ref.columns[j]
+            b=tst.columns[k]
+            bad=sum(1 for i,l in zip(refIdx,tstIdx) if not same_cell(a[i],b[l]))
+            res["columns"].append((name,"text",bad,None,None))
+    return res
+
+def is_identical(res):
+    return (res["ref_only_rows"]==0 and res["tst_only_rows"]==0 and
+            res["dup_keys"]==0 and res["ref_rows"]==res["tst_rows"] and
+            not res["ref_only_columns"] and not res["tst_only_columns"] and
+            all(c[2]==0 for c in res["columns"]))
+
+def format_summary(res):
+    outcome="\n\tRows: {} in the reference, {} in the tested file".format(res["ref_rows"],res["tst_rows"])
+    outcome=outcome+"\n\tRows only in the reference: {}".format(res["ref_only_rows"])
+    outcome=outcome+"\n\tRows only in the tested file: {}".format(res["tst_only_rows"])
+    if res["dup_keys"]>0:
+        outcome=outcome+"\n\t!!!Duplicated keys in the tested file: {} (counted as rows only in the tested file)".format(res["dup_keys"])
+    if res["ref_only_columns"]:
+        outcome=outcome+"\n\t!!!Columns only in the reference: "+", ".join(res["ref_only_columns"])
+    if res["tst_only_columns"]:
+        outcome=outcome+"\n\t!!!Columns only in the tested file: "+", ".join(res["tst_only_columns"])
+    for name,kind,bad,maxAbs,maxRel in res["columns"]:
+        flag="!!!" if bad>0 else ""
+        if kind=="numeric":
+            outcome=outcome+"\n\t{}Column {}: {} cell(s) out of tolerance; max abs deviation {:.6g}, max rel deviation {:.6g}".format(flag,name,bad,maxAbs,maxRel)
+        elif bad>0:
+            outcome=outcome+"\n\t{}Column {}: {} cell(s) differ".format(flag,name,bad)
+    return outcome
@@ -0,0 +1,95 @@
+import sys
+import bgzf
+
+# Read names of the records of a BAM file or of a SAM stream, so that the
+# reads selected by "samtools view -L" can be restored without converting
+# them back to FASTQ first. Secondary and supplementary alignments are left
+# out, as samtools bam2fq and bedtools bamtofastq do. Names are yielded in
+# lists, one list per block of input, as fastq_io.read_names gives them.
+
+SKIPPED_FLAGS=0x900
+BAM_MAGIC=b'BAM\x01'
+
+
+def is_alignment(path):
+    return path=="-" or path.endswith(".sam") or path.endswith(".bam")
+
+
+def header_size(buf):
+    # size of the BAM header (magic, SAM text, reference names and lengths)
+    # at the start of buf, None while it is incomplete
+    if len(buf)<8:
+        return None
+    if buf[:4]!=BAM_MAGIC:
+        raise ValueError("Not a BAM file")
+    end=8+int.from_bytes(buf[4:8],'little')
+    if len(buf)<end+4:
+        return None
+    n_ref=int.from_bytes(buf[end:end+4],'little')
+    end=end+4
+    for i in range(n_ref):
+        if len(buf)<end+4:
+            return None
+        end=end+int.from_bytes(buf[end:end+4],'little')+8
+    if len(buf)<end:
+        return None
+    return end
+
+
+def bam_names(path):
+    with bgzf.BgzfReader(path) as reader:
+        buf=b''
+        pos=0
+        header=True
+        for coffset,data in reader.blocks():
+            buf=buf[pos:]+data
+            pos=0
+            if header:
+                pos=header_size(buf)
+                if pos is None:
+                    pos=0
+                    continue
+                header=False
+            names=[]
+            # block_size, refID, pos, l_read_name, mapq, bin, n_cigar_op, flag, ..., read_name
+            while pos+36<=len(buf):
+                end=pos+4+int.from_bytes(buf[pos:pos+4],'little')
+                if end>len(buf):
+                    break
+                if not int.from_bytes(buf[pos+18:pos+20],'little')&SKIPPED_FLAGS:
+                    names.append(buf[pos+36:pos+35+buf[pos+12]])
+                pos=end
+            yield names
+        if header or pos<len(buf):
+            raise ValueError("Truncated BAM file: "+path)
+
+
+def sam_names(fh):
+    # fh is a binary SAM stream, header lines included or not
+    tail=b''
+    while True:
+        block=fh.read(1<<22)
+        if not block:
+            break
+        lines=(tail+block).split(b'\n')
+        tail=lines.pop()
+        yield [fields[0] for fields in (line.split(b'\t',2) for line in lines if line and line[0]!=64)
+               if not int(fields[1])&SKIPPED_FLAGS]
+    if tail:
+        fields=tail.split(b'\t',2)
+        if tail[0]!=64 and not int(fields[1])&SKIPPED_FLAGS:
+            yield [fields[0]]
+
+
+def alignment_names(path):
+    # "-" reads SAM from the standard input
+    if path=="-":
+        return sam_names(sys.stdin.buffer)
+    if path.endswith(".sam"):
+        return file_sam_names(path)
+    return bam_names(path)
+
+
+def file_sam_names(path):
+    with open(path,'rb') as fh:
+        yield from sam_names(fh)
@@ -0,0 +1,104 @@
+import bisect
+import struct
+import zlib
+from array import array
+
+# BGZF, the blocked gzip format of BAM files (and of bgzip-compressed FASTQs).
+#
+# A BGZF file is a series of gzip members of at most 64 KB each, whose size is
+# stored in a "BC" extra field of the gzip header. Blocks are read whole and
+# inflated with one zlib call each; the offset of a block in the compressed
+# file and an offset in its uncompressed data make a virtual offset,
+# coffset<<16|uoffset, which is how BAM indexes point into a file.
+
+MAGIC=b'\x1f\x8b\x08\x04'
+HEADER=struct.Struct('<4sI2sHHH')
+TRAILER=struct.Struct('<II')
+
+
+def is_bgzf(path):
+    with open(path,'rb') as fl:
+        header=fl.read(HEADER.size)
+    if len(header)<HEADER.size:
+        return False
+    magic,mtime,xfl_os,xlen,subfield,slen=HEADER.unpack(header)
+    return magic==MAGIC and subfield==0x4342 and slen==2
+
+
+def block_table(path):
+    # compressed offset and uncompressed start of every block, from the block
+    # headers and trailers only
+    coffsets=array('Q')
+    ustarts=array('Q')
+    total=0
+    with open(path,'rb') as fl:
+        coffset=0
+        while True:
+            fl.seek(coffset)
+            header=fl.read(HEADER.size+2)
+            if not header:
+                break
+            magic,mtime,xfl_os,xlen,subfield,slen=HEADER.unpack(header[:HEADER.size])
+            if magic!=MAGIC or subfield!=0x4342 or slen!=2:
+                raise ValueError("Not a BGZF block at offset "+str(coffset)+" of "+path)
+            bsize=struct.unpack('<H',header[HEADER.size:])[0]
+            fl.seek(coffset+bsize+1-4)
+            isize=struct.unpack('<I',fl.read(4))[0]
+            coffsets.append(coffset)
+            ustarts.append(total)
+            total=total+isize
+            coffset=coffset+bsize+1
+    return coffsets,ustarts
+
+
+def virtual_offset(table,uoffset):
+    coffsets,ustarts=table
+    i=bisect.bisect_right(ustarts,uoffset)-1
+    return coffsets[i]<<16|(uoffset-ustarts[i])
+
+
+class BgzfReader:
+    def __init__(self,path):
+        self.path=path
+        self.fh=open(path,'rb')
+
+    def read_block(self):
+        # (offset of the block, uncompressed data), None at the end of the file
+        coffset=self.fh.tell()
+        header=self.fh.read(HEADER.size+2)
+        if not header:
+            return None
+        if len(header)<HEADER.size+2:
+            raise ValueError("Truncated BGZF block in "+self.path)
+        magic,mtime,xfl_os,xlen,subfield,slen=HEADER.unpack(header[:HEADER.size])
+        if magic!=MAGIC or subfield!=0x4342 or slen!=2:
+            raise ValueError("Not a BGZF block at offset "+str(coffset)+" of "+self.path)
+        bsize=struct.unpack('<H',header[HEADER.size:])[0]
+        # the extra field may hold other subfields after BC
+        rest=self.fh.read(bsize+1-len(header))
+        if len(rest)<bsize+1-len(header):
+            raise ValueError("Truncated BGZF block in "+self.path)
+        data=zlib.decompress(rest[xlen-6:-TRAILER.size],-15)
+        crc,isize=TRAILER.unpack(rest[-TRAILER.size:])
+        if isize!=len(data) or crc!=zlib.crc32(data):
+            raise ValueError("Corrupted BGZF block at offset "+str(coffset)+" of "+self.path)
+        return coffset,data
+
+    def blocks(self):
+        while True:
+            block=self.read_block()
+            if block is None:
+                return
+            yield block
+
+    def seek(self,coffset):
+        self.fh.seek(coffset)
+
+    def close(self):
+        self.fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
@@ -0,0 +1,202 @@
+import heapq
+import itertools
+import mmap
+import os
+import struct
+from array import array
+import bgzf
+import fastq_io
+import readname_set
+
+# Persistent offset index of an original FASTQ, so that restoring a small
+# panel seeks to the matching records instead of scanning the whole file.
+#
+# The index (<fastq>.ridx) holds the readname_set hash of every read name,
+# sorted, the offset of its record in the same order (a byte offset, or a
+# BGZF virtual offset for bgzip-compressed FASTQs) and the bucket directory
+# of the hashes. It is memory mapped: a lookup touches a few pages, however
+# large the index. The size and modification time of the FASTQ are stored
+# in the header; an index whose FASTQ has changed since is rebuilt, and so is
+# a truncated, corrupt or foreign one.
+#
+# FASTQs compressed with plain gzip cannot be read from an offset and are
+# not indexed.
+
+# version 2: blake2b name hashes (version 1 used crc32 and adler32)
+MAGIC=b'RIDX\x02\x00\x00\x00'
+HEADER=struct.Struct('<8sQqQQI4x')
+PLAIN=0
+BGZF=1
+
+
+def index_path(fq_file,index_dir=None):
+    if index_dir is None:
+        return fq_file+".ridx"
+    return os.path.join(index_dir,os.path.basename(fq_file)+".ridx")
+
+
+def source_kind(fq_file):
+    # PLAIN or BGZF, None when the FASTQ cannot be indexed
+    if bgzf.is_bgzf(fq_file):
+        return BGZF
+    if fastq_io.is_gzip(fq_file):
+        return None
+    return PLAIN
+
+
+def record_offsets(fq_file,kind):
+    # (hash, offset) runs of the records of fq_file, each run sorted
+    table=bgzf.block_table(fq_file) if kind==BGZF else None
+    start=0
+    run=[]
+    with fastq_io.FastqReader(fq_file) as reader:
+        for lines in reader.chunks():
+            ends=list(itertools.accumulate([len(line)+1 for line in lines],initial=start))
+            starts=ends[0:-1:4]
+            start=ends[-1]
+            if table is not None:
+                starts=[bgzf.virtual_offset(table,offset) for offset in starts]
+            run.extend(zip(map(readname_set.name_key,fastq_io.read_names(lines[0::4])),starts))
+            if len(run)>=readname_set.RUN_SIZE:
+                run.sort()
+                yield run
+                run=[]
+    if run:
+        run.sort()
+        yield run
+
+
+def build(fq_file,path,kind):
+    stat=os.stat(fq_file)
+    runs=[]
+    for run in record_offsets(fq_file,kind):
+        runs.append((array('Q',[item[0] for item in run]),array('Q',[item[1] for item in run])))
+    keys=array('Q')
+    offsets=array('Q')
+    for key,offset in heapq.merge(*[zip(run_keys,run_offsets) for run_keys,run_offsets in runs]):
+        keys.append(key)
+        offsets.append(offset)
+    shift,directory=readname_set.bucket_offsets(keys)
+    # written next to the final name and renamed, so that a reader never
+    # sees a partial index; the process id keeps concurrent builders apart
+    tmp_path=path+".tmp{}".format(os.getpid())
+    try:
+        with open(tmp_path,'wb') as fl:
+            fl.write(HEADER.pack(MAGIC,stat.st_size,stat.st_mtime_ns,len(keys),len(directory),shift|kind<<8))
+            keys.tofile(fl)
+            offsets.tofile(fl)
+            directory.tofile(fl)
+        os.replace(tmp_path,path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FastqIndex:
+    def __init__(self,fq_file,path):
+        self.fq_file=fq_file
+        self.path=path
+        # ValueError for an empty, truncated or foreign file
+        with open(path,'rb') as fl:
+            self.mm=mmap.mmap(fl.fileno(),0,access=mmap.ACCESS_READ)
+        try:
+            magic,self.size,self.mtime_ns,self.count,ndirectory,flags=HEADER.unpack_from(self.mm)
+        except struct.error:
+            self.mm.close()
+            raise ValueError(path+" is truncated")
+        if magic!=MAGIC:
+            self.mm.close()
+            raise ValueError(path+" is not a read name index of this version")
+        self.shift=flags&0xff
+        self.kind=flags>>8
+        if self.kind not in (PLAIN,BGZF) or len(self.mm)!=HEADER.size+16*self.count+4*ndirectory:
+            self.mm.close()
+            raise ValueError(path+" is truncated or corrupt")
+        view=memoryview(self.mm)
+        start=HEADER.size
+        self.keys=view[start:start+8*self.count].cast('Q')
+        start=start+8*self.count
+        self.offsets=view[start:start+8*self.count].cast('Q')
+        start=start+8*self.count
+        self.directory=view[start:start+4*ndirectory].cast('I')
+
+    def is_current(self):
+        stat=os.stat(self.fq_file)
+        return stat.st_size==self.size and stat.st_mtime_ns==self.mtime_ns
+
+    def lookup(self,key):
+        # offsets of the records whose read name hashes to key
+        bucket=key>>self.shift
+        found=[]
+        for i in range(self.directory[bucket],self.directory[bucket+1]):
+            if self.keys[i]==key:
+                found.append(self.offsets[i])
+        return found
+
+    def records(self,offsets):
+        # the 4 lines of the record at each offset, offsets in increasing order
+        if self.kind==BGZF:
+            return bgzf_records(self.fq_file,offsets)
+        return plain_records(self.fq_file,offsets)
+
+    def close(self):
+        for view in (self.keys,self.offsets,self.directory):
+            view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+def open_index(fq_file,index_dir=None):
+    # the current index of fq_file, built first if it is missing or out of
+    # date; None when fq_file cannot be indexed
+    kind=source_kind(fq_file)
+    if kind is None:
+        return None
+    path=index_path(fq_file,index_dir)
+    if os.path.exists(path):
+        try:
+            index=FastqIndex(fq_file,path)
+        except ValueError:
+            # rebuilt below
+            index=None
+        if index is not None:
+            if index.is_current():
+                return index
+            index.close()
+    build(fq_file,path,kind)
+    return FastqIndex(fq_file,path)
+
+
+def plain_records(fq_file,offsets):
+    with open(fq_file,'rb') as fl:
+        for offset in offsets:
+            fl.seek(offset)
+            yield [fl.readline().rstrip(b'\n') for i in range(4)]
+
+
+def bgzf_records(fq_file,offsets):
+    with bgzf.BgzfReader(fq_file) as reader:
+        coffset=None
+        for voffset in offsets:
+            if voffset>>16!=coffset:
+                coffset=voffset>>16
+                reader.seek(coffset)
+                data=reader.read_block()[1]
+                next_block=reader.fh.tell()
+            buf=data[voffset&0xffff:]
+            # a record may continue into the following blocks
+            following=next_block
+            while buf.count(b'\n')<4:
+                reader.seek(following)
+                block=reader.read_block()
+                if block is None:
+                    break
+                buf=buf+block[1]
+                following=reader.fh.tell()
+            yield buf.split(b'\n',4)[:4]
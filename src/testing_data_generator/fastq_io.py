@@ -0,0 +1,196 @@
+import gzip
+import os
+import shutil
+import subprocess
+
+# FASTQ records are read in large blocks and split into lines in one call per
+# block, so that the cost per record is a few list operations instead of one
+# readline() and string concatenation per line. Records are handed out as
+# chunks: lists of lines without their newline, 4 lines per record.
+
+BLOCK_SIZE=1<<22
+GZIP_MAGIC=b'\x1f\x8b'
+
+
+def is_gzip(path):
+    with open(path,'rb') as fl:
+        return fl.read(2)==GZIP_MAGIC
+
+
+def find_pigz(threads):
+    # pigz decompresses and compresses in a separate process, overlapping with
+    # the parsing, and compresses with several threads
+    if threads>0:
+        return shutil.which("pigz")
+    return None
+
+
+class FastqReader:
+    def __init__(self,path,threads=0,block_size=BLOCK_SIZE):
+        self.path=path
+        self.block_size=block_size
+        self.proc=None
+        if is_gzip(path):
+            pigz=find_pigz(threads)
+            if pigz:
+                self.proc=subprocess.Popen([pigz,"-dc","-p",str(threads),path],stdout=subprocess.PIPE,bufsize=block_size)
+                self.fh=self.proc.stdout
+            else:
+                self.fh=gzip.open(path,'rb')
+        else:
+            self.fh=open(path,'rb',buffering=block_size)
+
+    def chunks(self):
+        tail=b''
+        while True:
+            block=self.fh.read(self.block_size)
+            if not block:
+                break
+            lines=(tail+block).split(b'\n')
+            tail=lines.pop()
+            complete=len(lines)//4*4
+            if complete<len(lines):
+                # incomplete record at the end of the block, kept for the next one
+                tail=b'\n'.join(lines[complete:]+[tail])
+                del lines[complete:]
+            if lines:
+                if not lines[0].startswith(b'@') or not lines[2].startswith(b'+'):
+                    raise ValueError("Malformed FASTQ record in "+self.path+": "+lines[0][:80].decode('utf-8','replace'))
+                yield lines
+        if tail:
+            lines=tail.split(b'\n')
+            if len(lines)%4!=0:
+                raise ValueError("Truncated FASTQ record at the end of "+self.path)
+            yield lines
+
+    def __iter__(self):
+        for lines in self.chunks():
+            for i in range(0,len(lines),4):
+                yield lines[i:i+4]
+
+    def close(self):
+        self.fh.close()
+        if self.proc is not None:
+            self.proc.wait()
+            if self.proc.returncode!=0:
+                raise IOError("Decompression of "+self.path+" failed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+class FastqWriter:
+    # writes gzip when the path ends with .gz, with pigz when threads>0
+    def __init__(self,path,threads=0,level=6):
+        self.path=path
+        self.proc=None
+        self.raw=None
+        if path.endswith(".gz"):
+            pigz=find_pigz(threads)
+            if pigz:
+                self.raw=open(path,'wb')
+                self.proc=subprocess.Popen([pigz,"-c","-p",str(threads),"-"+str(level)],stdin=subprocess.PIPE,stdout=self.raw,bufsize=BLOCK_SIZE)
+                self.fh=self.proc.stdin
+            else:
+                self.fh=gzip.open(path,'wb',compresslevel=level)
+        else:
+            self.fh=open(path,'wb',buffering=BLOCK_SIZE)
+
+    def write(self,lines):
+        # lines of whole records, without their newline
+        if lines:
+            self.fh.write(b'\n'.join(lines)+b'\n')
+
+    def close(self):
+        self.fh.close()
+        if self.proc is not None:
+            self.proc.wait()
+            self.raw.close()
+            if self.proc.returncode!=0:
+                raise IOError("Compression of "+self.path+" failed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        self.close()
+
+
+def read_name(header):
+    # the read name of a header line, as BAM records store it: "@name/1 comment" -> "name"
+    name=header.split(None,1)[0].split(b'/',1)[0]
+    return name[1:] if name.startswith(b'@') else name
+
+
+def read_names(headers):
+    # read_name of every header line of a chunk, the '@' is checked by FastqReader
+    return [header.split(None,1)[0].split(b'/',1)[0][1:] for header in headers]
+
+
+def select(lines,keep):
+    # the lines of the records of a chunk whose keep flag is set
+    selected=[]
+    for i in range(len(keep)):
+        if keep[i]:
+            selected.extend(lines[4*i:4*i+4])
+    return selected
+
+
+def paired_chunks(reader1,reader2):
+    # chunks of the same records of two mate files, with the read names of the
+    # records; the mates must have the same read names in the same order
+    chunks1=reader1.chunks()
+    chunks2=reader2.chunks()
+    lines1=[]
+    lines2=[]
+    record=0
+    while True:
+        if not lines1:
+            lines1=next(chunks1,None)
+        if not lines2:
+            lines2=next(chunks2,None)
+        if lines1 is None or lines2 is None:
+            if lines1 or lines2:
+                raise ValueError(reader1.path+" and "+reader2.path+" have different numbers of records")
+            return
+        n=min(len(lines1),len(lines2))
+        mates1=lines1[:n]
+        mates2=lines2[:n]
+        del lines1[:n]
+        del lines2[:n]
+        names=read_names(mates1[0::4])
+        names2=read_names(mates2[0::4])
+        if names!=names2:
+            i=0
+            while names[i]==names2[i]:
+                i=i+1
+            raise ValueError(reader1.path+" and "+reader2.path+" are out of sync at record "+str(record+i+1)+": "+names[i].decode('utf-8','replace')+" / "+names2[i].decode('utf-8','replace'))
+        record=record+len(names)
+        yield mates1,mates2,names
+
+
+def group_mates(fq_files):
+    # [file] for every file without _R2_ in its name, in order, with its _R2_
+    # mate (the same name with _R2_ for _R1_) added when listed, then [R2]
+    # for every _R2_ file whose _R1_ file is not listed; the aln<N> numbering
+    # of generate_commands_tracks_1_2.py follows this order
+    groups=[]
+    # path -> indices of its groups still without a mate, a path may be listed twice
+    waiting={}
+    for fq_file in fq_files:
+        if "_R2_" not in os.path.basename(fq_file):
+            waiting.setdefault(fq_file,[]).append(len(groups))
+            groups.append([fq_file])
+    sole_R2=[]
+    for fq_file in fq_files:
+        folder,name=os.path.split(fq_file)
+        if "_R2_" in name:
+            indices=waiting.get(os.path.join(folder,name.replace("_R2_","_R1_")))
+            if indices:
+                groups[indices.pop(0)].append(fq_file)
+            else:
+                sole_R2.append([fq_file])
+    return groups+sole_R2
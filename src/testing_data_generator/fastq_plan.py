@@ -0,0 +1,82 @@
+import heapq
+import os
+import re
+import fastq_io
+
+# Planning of the alignment jobs from the FASTQ file names.
+#
+# The files are paired by fastq_io.group_mates, the rule of the restoration
+# as well: an _R2_ file is the mate of the listed file of the same name with
+# _R1_, other files make a unit of their own. Units keep the order of their
+# R1 (or single) file, _R2_ files without their R1 last, as the aln<N> files
+# already aligned in a sample folder are numbered so.
+#
+# Illumina names, SAMPLE_S1_L001_R1_001.fastq.gz, are parsed into their sample,
+# sample number, lane, read and chunk, for the read group and the grouping of
+# the lanes of a sample only.
+#
+# balance() spreads the units over a number of jobs by input size, largest
+# first onto the least loaded job (LPT), so that no job is left running long
+# after the others.
+
+ILLUMINA=re.compile(r"^(?P<sample>.+?)(?:_S(?P<number>\d+))?(?:_L(?P<lane>\d+))?_R(?P<read>[12])(?:_(?P<chunk>\d+))?\.f(?:ast)?q(?:\.gz)?$")
+
+
+def parse_name(name):
+    # dict of the Illumina fields of a file name, None for other names
+    hit=ILLUMINA.match(name)
+    if hit is None:
+        return None
+    return hit.groupdict()
+
+
+class Unit:
+    def __init__(self,sample,lane=None,chunk=None):
+        self.sample=sample
+        self.lane=lane
+        self.chunk=chunk
+        # R1 (or single) file first
+        self.files=[]
+        self.size=0
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def plan_units(paths):
+    units=[]
+    for files in fastq_io.group_mates(paths):
+        name=os.path.basename(files[0])
+        fields=parse_name(name)
+        if fields is None:
+            unit=Unit(re.split(r"\.f(?:ast)?q",name)[0])
+        else:
+            unit=Unit(fields["sample"],fields["lane"],fields["chunk"])
+        unit.files=files
+        unit.size=sum(file_size(path) for path in files)
+        units.append(unit)
+    return units
+
+
+def balance(units,jobs):
+    # lists of unit indices, one list per job, each in the order of the units
+    jobs=max(1,min(jobs,len(units)))
+    loads=[(0,i) for i in range(jobs)]
+    plan=[[] for i in range(jobs)]
+    for index in sorted(range(len(units)),key=lambda index: -units[index].size):
+        load,job=heapq.heappop(loads)
+        plan[job].append(index)
+        heapq.heappush(loads,(load+units[index].size,job))
+    return [sorted(indices) for indices in plan if indices]
+
+
+def group_samples(units):
+    # sample -> indices of its units (lanes and chunks), in order
+    samples={}
+    for index,unit in enumerate(units):
+        samples.setdefault(unit.sample,[]).append(index)
+    return samples
@@ -1,5 +1,6 @@
 import sys
 import os
+import job_script
 rundir=sys.argv[1]
 bedpath=sys.argv[2]
 outdir=sys.argv[3]
@@ -17,8 +18,20 @@ for eachbam in bams:
         fname,ext=os.path.splitext(bname)
         cmd="#!/bin/bash"
         fl.write(cmd+'\n')
+        # stage markers for run_jobs.py, comments for bash and qsub
+        fl.write(job_script.resources_marker(1)+'\n')
+        sel_bam=outdir+"/"+fname+".sel.bam"
+        fastq=outdir+"/"+fname+".fastq"
+        if fqtools=="direct":
+            fl.write(job_script.stage_marker("fastq",[eachbam,bedpath],[fastq])+'\n')
+            # no original fastqs to restore from: the selection is shuffled and converted in one pipe, without intermediate files
+            cmd=samtools+" view -u -L "+bedpath+" "+eachbam+" |"+samtools+" bamshuf -Ou - "+outdir+"/"+fname+".shuf |"+samtools+" bam2fq - >"+outdir+"/"+fname+".fastq"
+            fl.write(cmd+'\n')
+            continue
+        fl.write(job_script.stage_marker("select",[eachbam,bedpath],[sel_bam])+'\n')
         cmd=samtools+" view -b -L "+bedpath+" "+eachbam+" >"+outdir+"/"+fname+".sel.bam"
         fl.write(cmd+'\n')
+        fl.write(job_script.stage_marker("fastq",[sel_bam],[fastq])+'\n')
         if fqtools=="bedtools":
             cmd=bedtools+" bamtofastq -i "+outdir+"/"+fname+".sel.bam -fq "+outdir+"/"+fname+".fastq"
             fl.write(cmd+'\n')
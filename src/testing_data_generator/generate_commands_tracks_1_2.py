@@ -1,101 +1,135 @@
 import sys
 import os
-import re
-aligner=sys.argv[1]
-aligner_path=sys.argv[2]
-index=sys.argv[3]
-rundir=sys.argv[4]
-bedpath=sys.argv[5]
-outdir=sys.argv[6]
-mode=sys.argv[7]
-samtools=sys.argv[8]
-bedtools=sys.argv[9]
-fqtool=sys.argv[10]
-python=sys.argv[11]
-python_lib=sys.argv[12]
-res_script=sys.argv[13]
-cfg_file=sys.argv[14]
-threads=sys.argv[15]
-sentieon=sys.argv[16]
-pythonhome=sys.argv[17]
-fastqs_full=sys.argv[18:]
+import getopt
+import fastq_plan
+import job_script
+# -s/--stream: pipe the aligner into the sort and the region selection into
+# the restoration, so that only the sorted bam and the restored fastqs are written
+# -j/--jobs N: pack the fastq pairs into N job scripts of about the same input
+# size instead of writing one script per pair
+opts,args=getopt.getopt(sys.argv[1:],"sj:",["stream","jobs="])
+stream=False
+njobs=0
+for opt,value in opts:
+    if opt in ("-s","--stream"):
+        stream=True
+    elif opt in ("-j","--jobs"):
+        njobs=int(value)
+aligner=args[0]
+aligner_path=args[1]
+index=args[2]
+rundir=args[3]
+bedpath=args[4]
+outdir=args[5]
+mode=args[6]
+samtools=args[7]
+bedtools=args[8]
+fqtool=args[9]
+python=args[10]
+python_lib=args[11]
+res_script=args[12]
+cfg_file=args[13]
+threads=args[14]
+sentieon=args[15]
+pythonhome=args[16]
+fastqs_full=args[17:]
 
-def get_pairs(x):
-    p1=[]
-    p2=[]
-    for f in x:
-        if re.search("_R2_",f)!=None:
-            p2.append(f)
-        else:
-            p1.append(f)
-    y=p1
-    if len(p2)>0:
-        sole_R2=[]
-        for f2 in p2:
-            temp=f2.replace("_R2_","_R1_")
-            paired=0
-            i=0
-            for f1 in p1:
-                if f1==temp:
-                    y[i]=y[i]+","+f2
-                    paired=1
-                    break
-                i+=1
-            if paired==0:
-                sole_R2.append(f2)
-    return y+sole_R2
-
-fastqs_base=[]
-for path in fastqs_full:
-    fastqs_base.append(os.path.basename(path))
+# one unit per fastq pair (or single fastq), numbered aln1, aln2... in order
+units=fastq_plan.plan_units(fastqs_full)
+if njobs>0:
+    plan=fastq_plan.balance(units,njobs)
+else:
+    plan=[[i] for i in range(len(units))]
+for sample,indices in fastq_plan.group_samples(units).items():
+    print(sample+": "+", ".join("aln"+str(i+1)+" ("+",".join(os.path.basename(f) for f in units[i].files)+")" for i in indices))
+if njobs>0:
+    for j in range(0,len(plan)):
+        print("sub"+str(j+1)+".sh: "+", ".join("aln"+str(i+1) for i in plan[j])+" ("+str(sum(units[i].size for i in plan[j])>>20)+" MB)")
 
-paired_fastqs=get_pairs(fastqs_base)
-print(paired_fastqs)
-scripts_dir=os.path.join(outdir,"scripts")
-for i in range(0,len(paired_fastqs)):
-    filepath=os.path.join(scripts_dir,"sub"+str(i+1)+".sh")
-    splitfile=paired_fastqs[i].split(",")
+def write_unit(fl,i,splitfile,sample,tag):
+    # the stages of aln<i+1>; tag tells them apart when a script has several units
     nfile=len(splitfile)
-    with open(filepath,"w") as fl:
-        cmd="#!/bin/bash"
-        fl.write(cmd+'\n')
-        if mode=='1':
-            if aligner=="bwa":
-                fl.write("source "+cfg_file+'\n')
-                if nfile==2:
-                    sample=splitfile[0].split("_R1")[0]
-                    cmd=aligner_path+" mem -t "+threads+" -R \"@RG\\tID:aln"+str(i+1)+"\\tSM:"+sample+"\\tPL:Illumina\" "+index+" "+rundir+"/"+splitfile[0]+" "+rundir+"/"+splitfile[1]+" >"+rundir+"/aln"+str(i+1)+".sam"
-                else:
-                    sample=splitfile[0].split(".fastq")[0]
-                    cmd=aligner_path+" mem -t "+threads+" -R \"@RG\\tID:aln"+str(i+1)+"\\tSM:"+sample+"\\tPL:Illumina\" "+index+" "+rundir+"/"+splitfile[0]+" >"+rundir+"/aln"+str(i+1)+".sam"
+    fastqs=[rundir+"/"+f for f in splitfile]
+    sam=rundir+"/aln"+str(i+1)+".sam"
+    bam=rundir+"/aln"+str(i+1)+".bam"
+    sel_bam=outdir+"/aln"+str(i+1)+".sel.bam"
+    if mode=='1':
+        if aligner=="bwa":
+            if nfile==2:
+                cmd=aligner_path+" mem -t "+threads+" -R \"@RG\\tID:aln"+str(i+1)+"\\tSM:"+sample+"\\tPL:Illumina\" "+index+" "+rundir+"/"+splitfile[0]+" "+rundir+"/"+splitfile[1]
             else:
-                if nfile==2:
-                    cmd=aligner_path+" -S "+index+" -1 "+rundir+"/"+splitfile[0]+" -2 "+rundir+"/"+splitfile[1]+" >"+rundir+"/aln"+str(i+1)+".sam"
-                else:
-                    cmd=aligner_path+" -S "+index+" "+rundir+"/"+splitfile[0]+" >"+rundir+"/aln"+str(i+1)+".sam"
-            fl.write(cmd+'\n')
-            #cmd=samtools+" view -bS "+rundir+"/aln"+str(i+1)+".sam |"+samtools+" sort - "+rundir+"/aln"+str(i+1)
-            cmd=sentieon+"/bin/sentieon util sort -t "+threads+" --sam2bam -i "+rundir+"/aln"+str(i+1)+".sam -o "+rundir+"/aln"+str(i+1)+".bam"
-            fl.write(cmd+'\n')
-            #cmd=samtools+" index "+rundir+"/aln"+str(i+1)+".bam"
-            #fl.write(cmd+'\n')
-        cmd=samtools+" view -b -L "+bedpath+" "+rundir+"/aln"+str(i+1)+".bam >"+outdir+"/aln"+str(i+1)+".sel.bam"
-        fl.write(cmd+'\n')
-        if fqtool=="bedtools":
-            cmd=bedtools+" bamtofastq -i "+outdir+"/aln"+str(i+1)+".sel.bam -fq "+outdir+"/aln"+str(i+1)+".raw.fastq"
+                cmd=aligner_path+" mem -t "+threads+" -R \"@RG\\tID:aln"+str(i+1)+"\\tSM:"+sample+"\\tPL:Illumina\" "+index+" "+rundir+"/"+splitfile[0]
+        else:
+            if nfile==2:
+                cmd=aligner_path+" -S "+index+" -1 "+rundir+"/"+splitfile[0]+" -2 "+rundir+"/"+splitfile[1]
+            else:
+                cmd=aligner_path+" -S "+index+" "+rundir+"/"+splitfile[0]
+        if stream:
+            # sentieon sorts the sam from its standard input
+            fl.write(job_script.stage_marker("align"+tag,fastqs,[bam])+'\n')
+            cmd=cmd+" |"+sentieon+"/bin/sentieon util sort -t "+threads+" --sam2bam -i - -o "+rundir+"/aln"+str(i+1)+".bam"
             fl.write(cmd+'\n')
         else:
-            cmd=samtools+" bamshuf "+outdir+"/aln"+str(i+1)+".sel.bam "+outdir+"/aln"+str(i+1)+".sel.shuf"
+            fl.write(job_script.stage_marker("align"+tag,fastqs,[sam])+'\n')
+            cmd=cmd+" >"+rundir+"/aln"+str(i+1)+".sam"
             fl.write(cmd+'\n')
-            cmd=samtools+" bam2fq "+outdir+"/aln"+str(i+1)+".sel.shuf.bam >"+outdir+"/aln"+str(i+1)+".raw.fastq"
+            #cmd=samtools+" view -bS "+rundir+"/aln"+str(i+1)+".sam |"+samtools+" sort - "+rundir+"/aln"+str(i+1)
+            fl.write(job_script.stage_marker("sort"+tag,[sam],[bam])+'\n')
+            cmd=sentieon+"/bin/sentieon util sort -t "+threads+" --sam2bam -i "+rundir+"/aln"+str(i+1)+".sam -o "+rundir+"/aln"+str(i+1)+".bam"
             fl.write(cmd+'\n')
+        #cmd=samtools+" index "+rundir+"/aln"+str(i+1)+".bam"
+        #fl.write(cmd+'\n')
+    if stream:
+        # the selected alignments go to the restoration as sam, which
+        # reads their names from its standard input
+        fl.write(job_script.stage_marker("restore"+tag,[bam,bedpath]+fastqs,[outdir+"/"+f for f in splitfile])+'\n')
         cmd="export LD_LIBRARY_PATH="+python_lib
         fl.write(cmd+'\n')
         cmd="export PYTHONHOME="+pythonhome
         fl.write(cmd+'\n')
-        if nfile==2:
-            cmd=python+" "+res_script+" "+outdir+"/aln"+str(i+1)+".raw.fastq "+rundir+"/"+splitfile[0]+","+rundir+"/"+splitfile[1]+" "+outdir
-        else:
-            cmd=python+" "+res_script+" "+outdir+"/aln"+str(i+1)+".raw.fastq "+rundir+"/"+splitfile[0]+" "+outdir
+        paired=" -p" if nfile==2 else ""
+        cmd=samtools+" view -L "+bedpath+" "+rundir+"/aln"+str(i+1)+".bam |"+python+" "+res_script+paired+" - "+",".join(fastqs)+" "+outdir+" "+threads
+        fl.write(cmd+'\n')
+        return
+    fl.write(job_script.stage_marker("select"+tag,[bam,bedpath],[sel_bam])+'\n')
+    cmd=samtools+" view -b -L "+bedpath+" "+rundir+"/aln"+str(i+1)+".bam >"+outdir+"/aln"+str(i+1)+".sel.bam"
+    fl.write(cmd+'\n')
+    # "direct": the restoration reads the names of the selected alignments from the BAM itself
+    reads=outdir+"/aln"+str(i+1)+".raw.fastq"
+    if fqtool=="direct":
+        reads=outdir+"/aln"+str(i+1)+".sel.bam"
+    elif fqtool=="bedtools":
+        fl.write(job_script.stage_marker("fastq"+tag,[sel_bam],[reads])+'\n')
+        cmd=bedtools+" bamtofastq -i "+outdir+"/aln"+str(i+1)+".sel.bam -fq "+outdir+"/aln"+str(i+1)+".raw.fastq"
+        fl.write(cmd+'\n')
+    else:
+        fl.write(job_script.stage_marker("fastq"+tag,[sel_bam],[reads])+'\n')
+        cmd=samtools+" bamshuf "+outdir+"/aln"+str(i+1)+".sel.bam "+outdir+"/aln"+str(i+1)+".sel.shuf"
         fl.write(cmd+'\n')
+        cmd=samtools+" bam2fq "+outdir+"/aln"+str(i+1)+".sel.shuf.bam >"+outdir+"/aln"+str(i+1)+".raw.fastq"
+        fl.write(cmd+'\n')
+    fl.write(job_script.stage_marker("restore"+tag,[reads]+fastqs,[outdir+"/"+f for f in splitfile])+'\n')
+    cmd="export LD_LIBRARY_PATH="+python_lib
+    fl.write(cmd+'\n')
+    cmd="export PYTHONHOME="+pythonhome
+    fl.write(cmd+'\n')
+    if nfile==2:
+        cmd=python+" "+res_script+" -p "+reads+" "+rundir+"/"+splitfile[0]+","+rundir+"/"+splitfile[1]+" "+outdir+" "+threads
+    else:
+        cmd=python+" "+res_script+" "+reads+" "+rundir+"/"+splitfile[0]+" "+outdir+" "+threads
+    fl.write(cmd+'\n')
+
 
+scripts_dir=os.path.join(outdir,"scripts")
+for j in range(0,len(plan)):
+    filepath=os.path.join(scripts_dir,"sub"+str(j+1)+".sh")
+    with open(filepath,"w") as fl:
+        cmd="#!/bin/bash"
+        fl.write(cmd+'\n')
+        # stage markers for run_jobs.py, comments for bash and qsub
+        fl.write(job_script.resources_marker(threads)+'\n')
+        if mode=='1' and aligner=="bwa":
+            fl.write("source "+cfg_file+'\n')
+        for i in plan[j]:
+            tag=str(i+1) if len(plan[j])>1 else ""
+            write_unit(fl,i,[os.path.basename(f) for f in units[i].files],units[i].sample,tag)
@@ -0,0 +1,92 @@
+import shlex
+
+# Stage markers of the generated sub*.sh scripts.
+#
+# A generated script stays a plain bash script; comments starting with "#@"
+# describe it to run_jobs.py:
+#
+#   #@resources threads=8 mem=16G    what the job needs while it runs
+#   #@stage align in=a.fastq out=aln1.sam
+#
+# Commands before the first stage are the preamble (sourcing a profile,
+# exports) and are repeated at the start of every stage, since each stage
+# runs as its own bash process. A stage lists the files it reads and writes,
+# separated with commas.
+
+SIZE_UNITS={"K":1<<10,"M":1<<20,"G":1<<30,"T":1<<40}
+
+
+def resources_marker(threads,mem=None):
+    marker="#@resources threads="+str(threads)
+    if mem:
+        marker=marker+" mem="+str(mem)
+    return marker
+
+
+def stage_marker(name,inputs=(),outputs=()):
+    return "#@stage "+name+" in="+",".join(inputs)+" out="+",".join(outputs)
+
+
+def parse_size(text):
+    # bytes of "16G", "500m", "1024"
+    text=text.strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1])*SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+class Stage:
+    def __init__(self,name,inputs=(),outputs=()):
+        self.name=name
+        self.inputs=list(inputs)
+        self.outputs=list(outputs)
+        self.lines=[]
+
+
+class JobScript:
+    def __init__(self,path):
+        self.path=path
+        self.threads=1
+        self.mem=0
+        self.preamble=[]
+        self.stages=[]
+        with open(path) as fl:
+            for line in fl.read().splitlines():
+                self.parse_line(line)
+        if not self.stages:
+            self.stages.append(Stage("main"))
+            self.stages[0].lines=self.preamble
+            self.preamble=[]
+
+    def parse_line(self,line):
+        if line.startswith("#!"):
+            return
+        if line.startswith("#@resources"):
+            for field in line.split()[1:]:
+                key,value=field.split("=",1)
+                if key=="threads":
+                    self.threads=int(value)
+                elif key=="mem":
+                    self.mem=parse_size(value)
+            return
+        if line.startswith("#@stage"):
+            fields=shlex.split(line)
+            stage=Stage(fields[1])
+            for field in fields[2:]:
+                key,value=field.split("=",1)
+                files=[path for path in value.split(",") if path]
+                if key=="in":
+                    stage.inputs=files
+                elif key=="out":
+                    stage.outputs=files
+            self.stages.append(stage)
+            return
+        if self.stages:
+            self.stages[-1].lines.append(line)
+        else:
+            self.preamble.append(line)
+
+    def stage_script(self,stage):
+        # the bash script of one stage: stop at the first failing command,
+        # including commands inside pipes
+        return "\n".join(["set -eo pipefail"]+self.preamble+stage.lines)+"\n"
@@ -0,0 +1,258 @@
+import bisect
+import hashlib
+import heapq
+import zlib
+from array import array
+from multiprocessing import shared_memory
+
+# Compact set of read names.
+#
+# Each name is hashed to 64 bits with blake2b (stable across runs and
+# processes). The hashes are kept in a sorted array('Q'), 8 bytes per name,
+# and a directory of bucket offsets indexed by the top bits of the hash
+# narrows every lookup to a few entries, which are searched with bisect in C.
+# The directory has about one entry for every 2 to 4 names (1 to 2 bytes per
+# name); an empty bucket answers a miss without touching the hashes, which is
+# where most misses end.
+#
+# Before any of that, a bitmap of the crc32 of the names (16 to 32 bits per
+# name) turns most misses away at the cost of a crc32, computed in C: only
+# the names whose bit is set are hashed with blake2b.
+#
+# Without verify, a lookup is answered from the hash alone: a name that is not
+# in a set of n names is found with a probability of about n/2^64.
+#
+# With verify=True, the set is exact: the names themselves are kept, sorted
+# with their hashes, in one bytes block with an array('Q') of their end
+# offsets (8 bytes plus the name per name), and a name is found only when it
+# equals a stored name of the same hash.
+#
+# Names are added in runs that are sorted separately and merged at freeze(),
+# so building never holds more than one run as Python objects.
+#
+# A frozen set can be copied once into shared memory with share(), and worker
+# processes attach() to it by name: they look names up in the same pages
+# instead of each holding a copy.
+
+RUN_SIZE=1<<20
+
+
+def name_key(name):
+    return int.from_bytes(hashlib.blake2b(name,digest_size=8).digest(),'little')
+
+
+def name_keys(names):
+    # name_key of every name, with the lookups hoisted out of the loop
+    blake2b=hashlib.blake2b
+    from_bytes=int.from_bytes
+    return [from_bytes(blake2b(name,digest_size=8).digest(),'little') for name in names]
+
+
+def crc_filter(names_crcs,count):
+    # bitmap of the crc32 of the names, and its mask
+    bits=max(64,1<<(16*max(1,count)-1).bit_length())
+    mask=bits-1
+    bitmap=bytearray(bits>>3)
+    for crc in names_crcs:
+        crc=crc&mask
+        bitmap[crc>>3]|=1<<(crc&7)
+    return mask,bitmap
+
+
+def run_items(keys,blob,ends):
+    # (hash, name) of a run, in order
+    start=0
+    for key,end in zip(keys,ends):
+        yield key,bytes(blob[start:end])
+        start=end
+
+
+def bucket_offsets(keys):
+    # directory of a sorted array of hashes: offsets[b] is the index of the
+    # first hash whose top bits are >= b, with 2 to 4 hashes per bucket
+    bits=max(1,(len(keys)//4).bit_length())
+    shift=64-bits
+    counts=[0]*((1<<bits)+1)
+    for key in keys:
+        counts[(key>>shift)+1]+=1
+    total=0
+    for i in range(len(counts)):
+        total=total+counts[i]
+        counts[i]=total
+    return shift,array('I',counts)
+
+
+class ReadNameSet:
+    def __init__(self,verify=False):
+        self.verify=verify
+        self.keys=array('Q')
+        # with verify: the names, concatenated in the order of the hashes,
+        # and the end offset of each one
+        self.names=bytearray()
+        self.ends=array('Q')
+        self.offsets=array('I')
+        self.shift=64
+        self.crcs=array('I')
+        self.mask=63
+        self.filter=bytearray(8)
+        self.runs=[]
+        self.pending=[]
+        self.frozen=False
+        self.shm=None
+
+    def add(self,names):
+        # names are bytes, already normalized (see fastq_io.read_name)
+        if self.frozen:
+            raise ValueError("Cannot add names to a frozen ReadNameSet")
+        names=list(names)
+        self.crcs.extend(map(zlib.crc32,names))
+        if self.verify:
+            self.pending.extend(zip(name_keys(names),names))
+        else:
+            self.pending.extend(name_keys(names))
+        if len(self.pending)>=RUN_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.pending.sort()
+            if self.verify:
+                ends=array('Q')
+                total=0
+                for key,name in self.pending:
+                    total=total+len(name)
+                    ends.append(total)
+                self.runs.append((array('Q',[item[0] for item in self.pending]),b''.join([item[1] for item in self.pending]),ends))
+            else:
+                self.runs.append((array('Q',self.pending),None,None))
+            self.pending=[]
+
+    def freeze(self):
+        self.flush()
+        if self.verify:
+            merged=heapq.merge(*[run_items(keys,blob,ends) for keys,blob,ends in self.runs])
+        else:
+            merged=heapq.merge(*[keys for keys,blob,ends in self.runs])
+        last=None
+        for item in merged:
+            if item!=last:
+                if self.verify:
+                    self.keys.append(item[0])
+                    self.names+=item[1]
+                    self.ends.append(len(self.names))
+                else:
+                    self.keys.append(item)
+                last=item
+        self.runs=[]
+        self.build_offsets()
+        self.frozen=True
+        return self
+
+    def build_offsets(self):
+        self.shift,self.offsets=bucket_offsets(self.keys)
+        self.mask,self.filter=crc_filter(self.crcs,len(self.keys))
+        self.crcs=array('I')
+
+    def share(self):
+        # copies the frozen set into a new shared memory block, returns the
+        # block, to be unlinked by the caller, and the handle for attach()
+        if not self.frozen:
+            raise ValueError("ReadNameSet must be frozen before it is shared")
+        # 8-byte items first, so that they are aligned
+        parts=[memoryview(self.keys).cast('B'),memoryview(self.ends).cast('B'),memoryview(self.offsets).cast('B'),
+               memoryview(self.filter),memoryview(self.names)]
+        sizes=[len(part) for part in parts]
+        shm=shared_memory.SharedMemory(create=True,size=max(1,sum(sizes)))
+        pos=0
+        for part,size in zip(parts,sizes):
+            shm.buf[pos:pos+size]=part
+            pos=pos+size
+        handle=(shm.name,self.verify,self.shift,self.mask,len(self.keys),len(self.ends),len(self.offsets),len(self.filter),len(self.names))
+        return shm,handle
+
+    @classmethod
+    def attach(cls,handle):
+        name,verify,shift,mask,nkeys,nends,noffsets,nfilter,nnames=handle
+        rns=cls(verify)
+        rns.shm=shared_memory.SharedMemory(name=name)
+        buf=rns.shm.buf
+        end=8*nkeys
+        rns.keys=buf[0:end].cast('Q')
+        rns.ends=buf[end:end+8*nends].cast('Q')
+        end=end+8*nends
+        rns.offsets=buf[end:end+4*noffsets].cast('I')
+        end=end+4*noffsets
+        rns.filter=buf[end:end+nfilter]
+        end=end+nfilter
+        rns.names=buf[end:end+nnames]
+        rns.shift=shift
+        rns.mask=mask
+        rns.frozen=True
+        return rns
+
+    def close(self):
+        # detaches from the shared memory block, if attached
+        if self.shm is not None:
+            for view in (self.keys,self.ends,self.offsets,self.filter,self.names):
+                view.release()
+            self.keys=array('Q')
+            self.ends=array('Q')
+            self.offsets=array('I')
+            self.filter=bytearray(8)
+            self.names=bytearray()
+            self.shm.close()
+            self.shm=None
+            self.frozen=False
+
+    def hashes(self):
+        # the distinct 64-bit hashes, in order
+        last=None
+        for key in self.keys:
+            if key!=last:
+                yield key
+                last=key
+
+    def __len__(self):
+        return len(self.keys)
+
+    def nbytes(self):
+        return (self.keys.itemsize*len(self.keys)+self.ends.itemsize*len(self.ends)+self.offsets.itemsize*len(self.offsets)+
+                len(self.filter)+len(self.names))
+
+    def contains_many(self,names):
+        # one answer per name, in order
+        if not self.frozen:
+            raise ValueError("ReadNameSet must be frozen before lookups")
+        keys=self.keys
+        offsets=self.offsets
+        shift=self.shift
+        bisect_left=bisect.bisect_left
+        mask=self.mask
+        bitmap=self.filter
+        hits=[False]*len(names)
+        # the names that pass the crc32 bitmap
+        passed=[i for i,crc in enumerate(map(zlib.crc32,names)) if bitmap[(crc&mask)>>3]>>(crc&7)&1]
+        for i,key in zip(passed,name_keys([names[i] for i in passed])):
+            bucket=key>>shift
+            lo=offsets[bucket]
+            hi=offsets[bucket+1]
+            if lo==hi:
+                continue
+            j=bisect_left(keys,key,lo,hi)
+            if j==hi or keys[j]!=key:
+                continue
+            hits[i]=not self.verify or self.has_name(names[i],key,j,hi)
+        return hits
+
+    def has_name(self,name,key,i,hi):
+        # the names stored from index i on with the same hash
+        ends=self.ends
+        while i<hi and self.keys[i]==key:
+            start=ends[i-1] if i>0 else 0
+            if self.names[start:ends[i]]==name:
+                return True
+            i=i+1
+        return False
+
+    def __contains__(self,name):
+        return self.contains_many([name])[0]
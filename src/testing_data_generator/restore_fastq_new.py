@@ -1,45 +1,220 @@
-import sys
+import argparse
 import os
 import collections
+import itertools
+import multiprocessing
+import fastq_io
+import alignment_names
+import fastq_index
+import readname_set
+import subsample
 
-if len(sys.argv)<4:
-    print("aligned_fastq(s) original_fastq(s) outdir")
-    quit()
-
-short_fqs=sys.argv[1].split(",")
-origin_fqs=sys.argv[2].split(",")
-print(short_fqs)
-print(origin_fqs)
-
-query_header=set()
-for fq_file in short_fqs:
-    lines=open(fq_file,"r")
-    n=0
-    for line in lines:
-        if n%4==0:
-            key=line.strip('\n').split("/")[0]
-            query_header.add(key)
-        n=n+1
-
-for fq_file in origin_fqs:
-    out_file=os.path.basename(fq_file)
-    out_path=os.path.join(sys.argv[3],out_file)
-    with open(fq_file,"r") as fl:
-        with open(out_path,"w") as of:
-            ct=0
-            eachLine=fl.readline()
-            while eachLine:
-                if ct%4==0:
-                    if ct>0:
-                        if header in query_header:
-                            of.write(content)
-                    header = eachLine.strip('\n').split(" ")[0]
-                    content=eachLine
-                else:
-                    content=content+eachLine
-                eachLine=fl.readline()
-                ct=ct+1
-            if header in query_header:
-                of.write(content)
-    fl.close()
+parser=argparse.ArgumentParser(usage="%(prog)s [-p] [-w workers] aligned_fastq(s)/bam(s)/sam(s) original_fastq(s) outdir [threads]")
+parser.add_argument("short_fqs",help="aligned FASTQ(s), BAM(s) or SAM(s), comma separated, - for SAM on the standard input")
+parser.add_argument("origin_fqs",help="original FASTQ(s), comma separated")
+parser.add_argument("outdir")
+parser.add_argument("threads",nargs="?",type=int,default=0,help="pigz threads for gzipped FASTQs")
+parser.add_argument("-p","--paired",action="store_true",help="walk _R1_/_R2_ mate files in lockstep, testing each name once")
+parser.add_argument("-w","--workers",type=int,default=1,help="original FASTQs (or mate pairs) restored in parallel")
+parser.add_argument("-i","--index",action="store_true",help="seek to the records through a .ridx offset index of each original FASTQ, built on first use")
+subsampling=parser.add_mutually_exclusive_group()
+subsampling.add_argument("-f","--fraction",type=float,help="keep this fraction of the restored reads (pairs), by a seeded hash of their name")
+subsampling.add_argument("-n","--count",type=int,help="keep this number of the restored reads (pairs), by a seeded hash of their name")
+parser.add_argument("-s","--seed",type=int,default=0,help="seed of the subsampling hash")
+parser.add_argument("-I","--index-dir",help="folder of the .ridx files (implies -i), next to the original FASTQs by default")
 
+# the read names to restore; worker processes attach to a shared copy
+query_header=None
+
+
+def read_query(short_fqs,threads,bottom=None):
+    # hashed read names with the names themselves, an exact set in a few
+    # flat arrays instead of a set of strings;
+    # the names are also added to bottom, for a subsampling to a read count
+    names=readname_set.ReadNameSet(verify=True)
+    for fq_file in short_fqs:
+        if alignment_names.is_alignment(fq_file):
+            # the region-filtered alignments themselves, without a FASTQ conversion
+            blocks=alignment_names.alignment_names(fq_file)
+        else:
+            blocks=read_fastq_names(fq_file,threads)
+        for block_names in blocks:
+            names.add(block_names)
+            if bottom is not None:
+                bottom.add(block_names)
+    return names.freeze()
+
+
+def read_fastq_names(fq_file,threads):
+    with fastq_io.FastqReader(fq_file,threads) as reader:
+        for lines in reader.chunks():
+            yield fastq_io.read_names(lines[0::4])
+
+
+def attach_query(handle):
+    global query_header
+    query_header=readname_set.ReadNameSet.attach(handle)
+
+
+def subsample_hits(hits,names,subsampler):
+    # the hits that the subsampling keeps; only the names found are hashed again
+    if subsampler is None:
+        return hits
+    found=[i for i in range(len(hits)) if hits[i]]
+    kept=subsampler.keep_many([names[i] for i in found])
+    hits=[False]*len(hits)
+    for i,keep in zip(found,kept):
+        hits[i]=keep
+    return hits
+
+
+def restore_file(fq_file,outdir,threads,subsampler=None):
+    records=0
+    restored=0
+    with fastq_io.FastqReader(fq_file,threads) as reader:
+        with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq_file)),threads) as writer:
+            for lines in reader.chunks():
+                names=fastq_io.read_names(lines[0::4])
+                hits=subsample_hits(query_header.contains_many(names),names,subsampler)
+                records=records+len(hits)
+                restored=restored+sum(hits)
+                writer.write(fastq_io.select(lines,hits))
+    return [(fq_file,records,restored)]
+
+
+def restore_indexed(fq_file,index,outdir,threads,subsampler=None):
+    # the records whose name hash is in the set are read at their offsets,
+    # in file order, and checked against the set by name
+    records=indexed_candidates(index)
+    restored=0
+    with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq_file)),threads) as writer:
+        while True:
+            lines=[line for record in itertools.islice(records,100000) for line in record]
+            if not lines:
+                break
+            names=fastq_io.read_names(lines[0::4])
+            hits=subsample_hits(query_header.contains_many(names),names,subsampler)
+            restored=restored+sum(hits)
+            writer.write(fastq_io.select(lines,hits))
+    return [(fq_file,index.count,restored)]
+
+
+def indexed_candidates(index):
+    # the records whose name hash is in the set, in file order
+    offsets=set()
+    for key in query_header.hashes():
+        offsets.update(index.lookup(key))
+    return index.records(sorted(offsets))
+
+
+def restore_indexed_pair(fq1,fq2,index1,index2,outdir,threads,subsampler=None):
+    # the candidate records of both mates are walked in lockstep, with the
+    # same checks as fastq_io.paired_chunks: mates out of sync are an error
+    if index1.count!=index2.count:
+        raise ValueError(fq1+" and "+fq2+" have different numbers of records")
+    records1=indexed_candidates(index1)
+    records2=indexed_candidates(index2)
+    restored=0
+    candidate=0
+    with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq1)),threads) as writer1, \
+         fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq2)),threads) as writer2:
+        while True:
+            mates1=[line for record in itertools.islice(records1,100000) for line in record]
+            mates2=[line for record in itertools.islice(records2,100000) for line in record]
+            if not mates1 and not mates2:
+                break
+            names=fastq_io.read_names(mates1[0::4])
+            names2=fastq_io.read_names(mates2[0::4])
+            if names!=names2:
+                i=0
+                while i<len(names) and i<len(names2) and names[i]==names2[i]:
+                    i=i+1
+                name1=names[i] if i<len(names) else b"(none)"
+                name2=names2[i] if i<len(names2) else b"(none)"
+                raise ValueError(fq1+" and "+fq2+" are out of sync at indexed candidate record "+str(candidate+i+1)+": "+
+                                 name1.decode('utf-8','replace')+" / "+name2.decode('utf-8','replace'))
+            candidate=candidate+len(names)
+            hits=subsample_hits(query_header.contains_many(names),names,subsampler)
+            restored=restored+sum(hits)
+            writer1.write(fastq_io.select(mates1,hits))
+            writer2.write(fastq_io.select(mates2,hits))
+    return [(fq1,index1.count,restored),(fq2,index2.count,restored)]
+
+
+def restore_pair(fq1,fq2,outdir,threads,subsampler=None):
+    # both mates are written when their common read name matches
+    records=0
+    restored=0
+    with fastq_io.FastqReader(fq1,threads) as reader1, fastq_io.FastqReader(fq2,threads) as reader2:
+        with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq1)),threads) as writer1, \
+             fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq2)),threads) as writer2:
+            for mates1,mates2,names in fastq_io.paired_chunks(reader1,reader2):
+                hits=subsample_hits(query_header.contains_many(names),names,subsampler)
+                records=records+len(hits)
+                restored=restored+sum(hits)
+                writer1.write(fastq_io.select(mates1,hits))
+                writer2.write(fastq_io.select(mates2,hits))
+    return [(fq1,records,restored),(fq2,records,restored)]
+
+
+def restore(task):
+    files,outdir,threads,use_index,index_dir,subsampler=task
+    if use_index:
+        indexes=[fastq_index.open_index(fq_file,index_dir) for fq_file in files]
+        if None not in indexes and len(files)==2:
+            with indexes[0], indexes[1]:
+                return restore_indexed_pair(files[0],files[1],indexes[0],indexes[1],outdir,threads,subsampler)
+        if None not in indexes:
+            with indexes[0]:
+                return restore_indexed(files[0],indexes[0],outdir,threads,subsampler)
+        for index in indexes:
+            if index is not None:
+                index.close()
+    if len(files)==2:
+        return restore_pair(files[0],files[1],outdir,threads,subsampler)
+    return restore_file(files[0],outdir,threads,subsampler)
+
+
+if __name__=="__main__":
+    args=parser.parse_args()
+    subsample.check_arguments(parser,args)
+    short_fqs=args.short_fqs.split(",")
+    origin_fqs=args.origin_fqs.split(",")
+    print(short_fqs)
+    print(origin_fqs)
+
+    # the subsampling of the restored reads is decided by their names, so
+    # that a target count is known before the original FASTQs are read
+    bottom=None
+    subsampler=None
+    if args.count is not None:
+        bottom=subsample.BottomK(args.count,args.seed)
+    elif args.fraction is not None:
+        subsampler=subsample.Subsampler.from_fraction(args.fraction,args.seed)
+    query_header=read_query(short_fqs,args.threads,bottom)
+    if bottom is not None:
+        subsampler=bottom.subsampler()
+    # original FASTQs may be gzipped, a gzipped input gives a gzipped output of the same name
+    if args.paired:
+        groups=fastq_io.group_mates(origin_fqs)
+    else:
+        groups=[[fq_file] for fq_file in origin_fqs]
+    use_index=args.index or args.index_dir is not None
+    tasks=[(files,args.outdir,args.threads,use_index,args.index_dir,subsampler) for files in groups]
+
+    if args.workers>1 and len(tasks)>1:
+        # lanes are restored in separate processes, which look names up in
+        # one copy of the set in shared memory
+        shm,handle=query_header.share()
+        try:
+            with multiprocessing.Pool(min(args.workers,len(tasks)),attach_query,(handle,)) as pool:
+                results=pool.map(restore,tasks,chunksize=1)
+        finally:
+            shm.close()
+            shm.unlink()
+    else:
+        results=[restore(task) for task in tasks]
+
+    for result in results:
+        for fq_file,records,restored in result:
+            print("{}: {} of {} records restored".format(fq_file,restored,records))
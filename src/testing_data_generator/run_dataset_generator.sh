@@ -17,9 +17,12 @@ OPTIONS:
     -h                [optional]  help, Show this message
     -i <path>         [required]  input directory which should contain fastq files and/or bam files      
     -a                [optional]  should be "bwa" (default) or "bowtie"
-    -s                [optional]  should be "bedtools" (default) or "samtools"
+    -s                [optional]  should be "bedtools" (default), "samtools" or "direct" (read names straight from the selected bam)
     -b                [required]  path to the bed file
     -o                [required]  output (except the entire alignment) 
+    -l                [optional]  run the jobs on this node with run_jobs.py instead of submitting them with qsub
+    -S                [optional]  streaming: pipe the alignment into the sort and the selected reads into the fastq restoration (-s is then not used)
+    -j <n>            [optional]  pack the fastq pairs into n jobs of about the same input size, one job per pair by default
 
 DOCS
 
@@ -52,7 +55,7 @@ then
     exit 1
 fi
 
-while getopts "hi:a:s:b:o:" OPTION
+while getopts "hi:a:s:b:o:lSj:" OPTION
 do
     case $OPTION in
         h) echo ""; echo "${DOCS}" ; echo ""; exit 0 ;;
@@ -61,6 +64,9 @@ do
         s) FQ_TOOL="${OPTARG}" ;;
         b) BED_FILE="${OPTARG}" ;; 
         o) OUT_DIR="${OPTARG}" ;;
+        l) LOCAL_RUN=1 ;;
+        S) STREAM="--stream" ;;
+        j) JOBS="--jobs ${OPTARG}" ;;
         ?) echo "${DOCS}" ; exit ;;
     esac
 done
@@ -118,16 +124,17 @@ else
 fi
 
 if [[ ! -z ${FQ_TOOL} ]]; then
-    if [[ "${FQ_TOOL}" != "bedtools" ]] && [[ "${FQ_TOOL}" != "samtools" ]]; then
-        echo "Fastq file restoration tool must be 'bedtools' or 'samtools'";
+    if [[ "${FQ_TOOL}" != "bedtools" ]] && [[ "${FQ_TOOL}" != "samtools" ]] && [[ "${FQ_TOOL}" != "direct" ]]; then
+        echo "Fastq file restoration tool must be 'bedtools', 'samtools' or 'direct'";
         exit
     fi
 else
     FQ_TOOL="bedtools"
 fi
 
+# bwa and the fastq restoration read gzipped fastq files directly
 gzfastqs=`find "$SAMPLE_DIR" -maxdepth 1 -iname "*.fastq.gz"`
-if [[ -n ${gzfastqs} ]]; then
+if [[ -n ${gzfastqs} ]] && [[ "${ALIGNER}" != "bwa" ]]; then
     echo "Decompressing fastq.gz files..."
     for f in ${gzfastqs}; do
         gunzip ${f}
@@ -136,7 +143,7 @@ if [[ -n ${gzfastqs} ]]; then
 fi
 
 MODE=1
-fastqs=`find "$SAMPLE_DIR" -maxdepth 1 -iname "*.fastq"`
+fastqs=`find "$SAMPLE_DIR" -maxdepth 1 \( -iname "*.fastq" -o -iname "*.fastq.gz" \)`
 if [[ ! -n ${fastqs} ]]; then
     echo "Fastq files do not exists! Checking bam files..."
     bams=`find "$SAMPLE_DIR" -maxdepth 1 -iname "*.bam"`
@@ -169,7 +176,11 @@ echo "Aligner's path: ${ALIGNER_PATH}"
 eval GENOME_INDEX=\${${ALIGNER}_index}
 echo "Genome index: ${GENOME_INDEX}"
 echo "Fastq restoration tool: ${FQ_TOOL}"
-FQ_TOOL_PATH=${!FQ_TOOL}
+if [[ "${FQ_TOOL}" == "direct" ]]; then
+    FQ_TOOL_PATH=${samtools}
+else
+    FQ_TOOL_PATH=${!FQ_TOOL}
+fi
 echo "Fastq restoration tool's path: ${FQ_TOOL_PATH}"
 echo "Selected chromosomal regions: ${BED_FILE}"
 echo "Config file: ${CFG_FILE}"
@@ -181,13 +192,18 @@ restore_script=${SCRIPT_DIR}/restore_fastq_new.py
 if [[ ${MODE} -ne 3 ]]; then
     echo "Fastq files:"
     echo "${fastqs}"
-    ${python} ${cmd_generator} ${ALIGNER} ${ALIGNER_PATH} ${GENOME_INDEX} ${SAMPLE_DIR} ${BED_FILE} ${OUT_DIR} ${MODE} ${samtools} ${bedtools} ${FQ_TOOL} ${python} ${LD_LIBRARY_PATH} ${restore_script} ${CFG_FILE} ${THREADS} ${sentieon} ${PYTHONHOME} ${fastqs}
+    ${python} ${cmd_generator} ${STREAM} ${JOBS} ${ALIGNER} ${ALIGNER_PATH} ${GENOME_INDEX} ${SAMPLE_DIR} ${BED_FILE} ${OUT_DIR} ${MODE} ${samtools} ${bedtools} ${FQ_TOOL} ${python} ${LD_LIBRARY_PATH} ${restore_script} ${CFG_FILE} ${THREADS} ${sentieon} ${PYTHONHOME} ${fastqs}
 else
     echo "Bam files:"
     echo "${bams}"
     ${python} ${cmd_generator2} ${SAMPLE_DIR} ${BED_FILE} ${OUT_DIR} ${samtools} ${bedtools} ${FQ_TOOL} ${bams}
 fi
 echo "Qsub scripts generated under ${CMD_DIR}"
+if [[ -n ${LOCAL_RUN} ]]; then
+    # h_vmem of the qsub jobs is the memory budget of each local job
+    ${python} ${SCRIPT_DIR}/run_jobs.py -M ${HVMEM:-0} ${CMD_DIR}
+    exit $?
+fi
 DISPATCH="${QSUB} -q ${QUEUE} -l h_vmem=${HVMEM},h_stack=${HSTACK}"
 #echo $DISPATCH
 for f in `find "$CMD_DIR" -iname "*.sh" | uniq` ; do
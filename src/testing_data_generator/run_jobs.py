@@ -0,0 +1,292 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import job_script
+
+# Runs the generated sub*.sh jobs on the local node.
+#
+# A job starts when the cores and memory it declares (#@resources, see
+# job_script.py) are free, so that several jobs run at once without
+# oversubscribing the node; smaller jobs further down the list fill the gaps
+# left by larger ones. The stages of a job run one after the other, each as
+# its own bash process with "set -eo pipefail", with their output appended
+# to <logdir>/<job>.log. The exit code and duration of every stage are
+# printed at the end and written to <logdir>/run_jobs.tsv.
+#
+# When a stage fails, no new job or stage is started (unless -k is given)
+# and the running stages finish; on Ctrl-C or SIGTERM they are killed.
+#
+# Reruns are incremental: a stage is skipped when the outputs it declares all
+# exist, are newer than its inputs, and the digest of its commands and of
+# the size and modification time of its inputs is the one recorded in
+# <logdir>/run_jobs.state when it last succeeded. After a partial failure,
+# only the failed samples and the stages downstream of a change run again.
+
+parser=argparse.ArgumentParser(description="Runs generated sub*.sh scripts with a local worker pool")
+parser.add_argument("scripts",nargs="+",help="job scripts, or folders of sub*.sh scripts")
+parser.add_argument("-c","--cores",type=int,default=os.cpu_count(),help="cores of the node to use, all of them by default")
+parser.add_argument("-m","--mem",help="memory of the node to use, e.g. 64G, the available memory by default")
+parser.add_argument("-M","--job-mem",default="0",help="memory of a job that does not declare any, e.g. 10G")
+parser.add_argument("-l","--logdir",help="folder of the job logs, next to the first script by default")
+parser.add_argument("-k","--keep-going",action="store_true",help="keep starting other jobs after a failure")
+parser.add_argument("-f","--force",action="store_true",help="run every stage, even the up to date ones")
+
+
+def available_memory():
+    # MemAvailable of /proc/meminfo, 0 (no limit) where it cannot be read
+    try:
+        with open("/proc/meminfo") as fl:
+            for line in fl:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return 0
+
+
+def find_scripts(paths):
+    scripts=[]
+    for path in paths:
+        if os.path.isdir(path):
+            found=glob.glob(os.path.join(path,"sub*.sh"))
+            # sub2.sh before sub10.sh
+            found.sort(key=lambda name: (len(name),name))
+            scripts.extend(found)
+        else:
+            scripts.append(path)
+    return scripts
+
+
+def file_stamp(path):
+    try:
+        stat=os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size,stat.st_mtime_ns]
+
+
+def stage_digest(script,stage):
+    # commands and parameters of the stage, and the files it reads
+    digest=hashlib.sha256(script.stage_script(stage).encode())
+    for path in stage.inputs:
+        digest.update(json.dumps([path,file_stamp(path)]).encode())
+    return digest.hexdigest()
+
+
+def outputs_current(stage):
+    # all outputs exist and none is older than an input
+    if not stage.outputs:
+        return False
+    outputs=[file_stamp(path) for path in stage.outputs]
+    inputs=[file_stamp(path) for path in stage.inputs]
+    if None in outputs or None in inputs:
+        return False
+    return min(stamp[1] for stamp in outputs)>=max([stamp[1] for stamp in inputs],default=0)
+
+
+class StageState:
+    # digests of the stages that succeeded, saved after each one
+    def __init__(self,path):
+        self.path=path
+        self.digests={}
+        if os.path.exists(path):
+            with open(path) as fl:
+                self.digests=json.load(fl)
+        self.lock=threading.Lock()
+
+    def up_to_date(self,job,stage,digest):
+        return self.digests.get(job.name+"/"+stage.name)==digest and outputs_current(stage)
+
+    def record(self,job,stage,digest):
+        with self.lock:
+            self.digests[job.name+"/"+stage.name]=digest
+            self.save()
+
+    def forget(self,job,stage):
+        # before a stage runs: outputs it leaves behind if it is killed are
+        # not taken for up to date ones
+        with self.lock:
+            if self.digests.pop(job.name+"/"+stage.name,None) is not None:
+                self.save()
+
+    def save(self):
+        tmp_path=self.path+".tmp"
+        with open(tmp_path,"w") as fl:
+            json.dump(self.digests,fl,indent=1,sort_keys=True)
+        os.replace(tmp_path,self.path)
+
+
+class Job:
+    def __init__(self,path,job_mem):
+        self.script=job_script.JobScript(path)
+        self.name=os.path.splitext(os.path.basename(path))[0]
+        self.mem=self.script.mem or job_mem
+        # (stage, status, exit code, seconds)
+        self.results=[]
+
+
+class Scheduler:
+    def __init__(self,jobs,cores,mem,logdir,keep_going,state=None):
+        self.jobs=jobs
+        self.state=state
+        self.cores=max(1,cores)
+        self.mem=mem
+        self.logdir=logdir
+        self.keep_going=keep_going
+        self.free_cores=self.cores
+        self.free_mem=mem
+        self.stopping=False
+        self.failed=False
+        self.procs=set()
+        self.running=0
+        self.cond=threading.Condition()
+
+    def needs(self,job):
+        # a job larger than the node gets the whole node
+        mem=min(job.mem,self.mem) if self.mem else 0
+        return min(job.script.threads,self.cores),mem
+
+    def fits(self,job):
+        cores,mem=self.needs(job)
+        return cores<=self.free_cores and (not self.mem or mem<=self.free_mem)
+
+    def run(self):
+        pending=list(self.jobs)
+        with self.cond:
+            while pending and not self.stopping:
+                job=next((job for job in pending if self.fits(job)),None)
+                if job is None:
+                    self.cond.wait()
+                    continue
+                pending.remove(job)
+                cores,mem=self.needs(job)
+                self.free_cores=self.free_cores-cores
+                self.free_mem=self.free_mem-mem
+                self.running=self.running+1
+                threading.Thread(target=self.run_job,args=(job,)).start()
+        self.wait()
+        return not self.failed
+
+    def wait(self):
+        # a condition wait, unlike Thread.join, can be interrupted and waited again
+        with self.cond:
+            while self.running:
+                self.cond.wait()
+
+    def run_job(self,job):
+        try:
+            with open(os.path.join(self.logdir,job.name+".log"),"a") as log:
+                # the stages after a failed one depend on it
+                blocked=False
+                for stage in job.script.stages:
+                    digest=stage_digest(job.script,stage)
+                    if not blocked and self.state is not None and self.state.up_to_date(job,stage,digest):
+                        job.results.append((stage.name,"up to date",None,0.0))
+                        continue
+                    returncode,seconds=None,0.0
+                    if not blocked:
+                        if self.state is not None:
+                            self.state.forget(job,stage)
+                        returncode,seconds=self.run_stage(job,stage,log)
+                    if returncode is None:
+                        job.results.append((stage.name,"not run",None,0.0))
+                    elif returncode==0:
+                        job.results.append((stage.name,"ok",returncode,seconds))
+                        if self.state is not None:
+                            self.state.record(job,stage,digest)
+                    else:
+                        job.results.append((stage.name,"failed",returncode,seconds))
+                        print("{} failed at stage {} with exit code {}, see {}".format(job.name,stage.name,returncode,log.name),file=sys.stderr)
+                        blocked=True
+                        with self.cond:
+                            self.failed=True
+                            if not self.keep_going:
+                                self.stopping=True
+        finally:
+            cores,mem=self.needs(job)
+            with self.cond:
+                self.free_cores=self.free_cores+cores
+                self.free_mem=self.free_mem+mem
+                self.running=self.running-1
+                self.cond.notify_all()
+
+    def run_stage(self,job,stage,log):
+        # (exit code, seconds), no exit code when the run is stopping
+        log.write("### {} {} {}\n".format(job.name,stage.name,time.strftime("%Y-%m-%d %H:%M:%S")))
+        log.flush()
+        start=time.time()
+        with self.cond:
+            if self.stopping:
+                return None,0.0
+            proc=subprocess.Popen(["bash","-c",job.script.stage_script(stage)],stdout=log,stderr=subprocess.STDOUT,
+                                  stdin=subprocess.DEVNULL,start_new_session=True)
+            self.procs.add(proc)
+        proc.wait()
+        with self.cond:
+            self.procs.discard(proc)
+        return proc.returncode,time.time()-start
+
+    def kill(self):
+        # the stages in progress are killed with their children
+        with self.cond:
+            self.stopping=True
+            self.failed=True
+            for proc in self.procs:
+                try:
+                    os.killpg(proc.pid,signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            self.cond.notify_all()
+
+
+def interrupt(signum,frame):
+    raise KeyboardInterrupt
+
+
+def report(jobs,path):
+    lines=["job\tstage\tstatus\texit_code\tseconds"]
+    for job in jobs:
+        # jobs that were never started have no results
+        results=job.results or [(stage.name,"not run",None,0.0) for stage in job.script.stages]
+        for stage,status,returncode,seconds in results:
+            lines.append("{}\t{}\t{}\t{}\t{:.1f}".format(job.name,stage,status,"" if returncode is None else returncode,seconds))
+    with open(path,"w") as fl:
+        fl.write("\n".join(lines)+"\n")
+    for line in lines:
+        print(line.replace("\t","  "))
+
+
+if __name__=="__main__":
+    args=parser.parse_args()
+    scripts=find_scripts(args.scripts)
+    if not scripts:
+        print("No job scripts found")
+        sys.exit(1)
+    mem=job_script.parse_size(args.mem) if args.mem else available_memory()
+    jobs=[Job(path,job_script.parse_size(args.job_mem)) for path in scripts]
+    logdir=args.logdir or os.path.dirname(os.path.abspath(scripts[0]))
+    os.makedirs(logdir,exist_ok=True)
+    # -f reruns everything, and records the new digests
+    state=StageState(os.path.join(logdir,"run_jobs.state"))
+    if args.force:
+        state.digests={}
+    scheduler=Scheduler(jobs,args.cores,mem,logdir,args.keep_going,state)
+    print("Running {} jobs on {} cores{}".format(len(jobs),scheduler.cores,", "+str(mem>>20)+" MB" if mem else ""))
+    start=time.time()
+    signal.signal(signal.SIGTERM,interrupt)
+    try:
+        ok=scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.kill()
+        scheduler.wait()
+        ok=False
+    report(jobs,os.path.join(logdir,"run_jobs.tsv"))
+    print("Total time: {:.1f}s".format(time.time()-start))
+    sys.exit(0 if ok else 1)
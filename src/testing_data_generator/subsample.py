@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import heapq
+import os
+import fastq_io
+
+# Deterministic subsampling of reads by a seeded hash of their read name.
+#
+# A read is kept when the 64-bit keyed blake2b hash of its normalized name
+# (fastq_io.read_name) is below a threshold: both mates of a pair have the
+# same name and are kept or dropped together, in any file and any order, and
+# the same seed gives the same reads on every run. A fraction sets the
+# threshold directly, so one streaming pass is enough. A target count sets it
+# to the count-th smallest hash of the candidate names (bottom-k), which are
+# read first: the read names from the aligned reads when restoring, an extra
+# pass over the names of the FASTQs when subsampling on its own.
+
+parser=argparse.ArgumentParser(usage="%(prog)s (-f fraction | -n count) [-s seed] [-p] fastq(s) outdir [threads]",
+                               description="Keeps the same random subset of reads, and both mates of a pair, on every run")
+parser.add_argument("fastqs",help="FASTQ(s), comma separated, may be gzipped")
+parser.add_argument("outdir")
+parser.add_argument("threads",nargs="?",type=int,default=0,help="pigz threads for gzipped FASTQs")
+group=parser.add_mutually_exclusive_group(required=True)
+group.add_argument("-f","--fraction",type=float,help="fraction of the reads to keep")
+group.add_argument("-n","--count",type=int,help="number of reads (read pairs) to keep")
+parser.add_argument("-s","--seed",type=int,default=0,help="seed of the hash, another seed keeps another subset")
+parser.add_argument("-p","--paired",action="store_true",help="walk _R1_/_R2_ mate files in lockstep")
+
+MAX_HASH=(1<<64)-1
+
+
+def check_arguments(parser,args):
+    # usage errors rather than tracebacks, for this script and restore_fastq_new.py
+    if args.count is not None and args.count<1:
+        parser.error("-n/--count must be at least 1")
+    if args.fraction is not None and not 0<args.fraction<=1:
+        parser.error("-f/--fraction must be above 0 and at most 1")
+
+
+def seeded_hash(name,seed):
+    key=seed.to_bytes(8,'little',signed=True)
+    return int.from_bytes(hashlib.blake2b(name,digest_size=8,key=key).digest(),'little')
+
+
+class Subsampler:
+    def __init__(self,threshold=MAX_HASH,seed=0):
+        # reads whose hash is <= threshold are kept
+        self.threshold=threshold
+        self.seed=seed
+
+    @classmethod
+    def from_fraction(cls,fraction,seed=0):
+        if not 0<=fraction<=1:
+            raise ValueError("The fraction of reads to keep must be between 0 and 1: "+str(fraction))
+        return cls(min(MAX_HASH,int(fraction*(1<<64))-1),seed)
+
+    def keep_many(self,names):
+        # one answer per name, in order
+        key=self.seed.to_bytes(8,'little',signed=True)
+        blake2b=hashlib.blake2b
+        threshold=self.threshold
+        return [int.from_bytes(blake2b(name,digest_size=8,key=key).digest(),'little')<=threshold for name in names]
+
+
+class BottomK:
+    # the count smallest distinct hashes of the names added
+    def __init__(self,count,seed=0):
+        self.count=count
+        self.seed=seed
+        self.heap=[]
+        self.members=set()
+
+    def add(self,names):
+        if self.count<=0:
+            return
+        heap=self.heap
+        members=self.members
+        for name in names:
+            value=seeded_hash(name,self.seed)
+            if value in members:
+                continue
+            if len(heap)<self.count:
+                heapq.heappush(heap,-value)
+                members.add(value)
+            elif value<-heap[0]:
+                members.discard(-heapq.heapreplace(heap,-value))
+                members.add(value)
+
+    def subsampler(self):
+        if self.count<=0:
+            return Subsampler(-1,self.seed)
+        if len(self.heap)<self.count:
+            return Subsampler(MAX_HASH,self.seed)
+        return Subsampler(-self.heap[0],self.seed)
+
+
+def subsample_file(fq_file,outdir,threads,subsampler):
+    kept=0
+    records=0
+    with fastq_io.FastqReader(fq_file,threads) as reader:
+        with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq_file)),threads) as writer:
+            for lines in reader.chunks():
+                keep=subsampler.keep_many(fastq_io.read_names(lines[0::4]))
+                records=records+len(keep)
+                kept=kept+sum(keep)
+                writer.write(fastq_io.select(lines,keep))
+    return [(fq_file,records,kept)]
+
+
+def subsample_pair(fq1,fq2,outdir,threads,subsampler):
+    kept=0
+    records=0
+    with fastq_io.FastqReader(fq1,threads) as reader1, fastq_io.FastqReader(fq2,threads) as reader2:
+        with fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq1)),threads) as writer1, \
+             fastq_io.FastqWriter(os.path.join(outdir,os.path.basename(fq2)),threads) as writer2:
+            for mates1,mates2,names in fastq_io.paired_chunks(reader1,reader2):
+                keep=subsampler.keep_many(names)
+                records=records+len(keep)
+                kept=kept+sum(keep)
+                writer1.write(fastq_io.select(mates1,keep))
+                writer2.write(fastq_io.select(mates2,keep))
+    return [(fq1,records,kept),(fq2,records,kept)]
+
+
+if __name__=="__main__":
+    args=parser.parse_args()
+    check_arguments(parser,args)
+    fastqs=args.fastqs.split(",")
+    if args.count is not None:
+        # first pass: the names only, for the threshold of the count smallest hashes
+        bottom=BottomK(args.count,args.seed)
+        for fq_file in fastqs:
+            with fastq_io.FastqReader(fq_file,args.threads) as reader:
+                for lines in reader.chunks():
+                    bottom.add(fastq_io.read_names(lines[0::4]))
+        subsampler=bottom.subsampler()
+    else:
+        subsampler=Subsampler.from_fraction(args.fraction,args.seed)
+    groups=fastq_io.group_mates(fastqs) if args.paired else [[fq_file] for fq_file in fastqs]
+    for files in groups:
+        if len(files)==2:
+            results=subsample_pair(files[0],files[1],args.outdir,args.threads,subsampler)
+        else:
+            results=subsample_file(files[0],args.outdir,args.threads,subsampler)
+        for fq_file,records,kept in results:
+            print("{}: {} of {} records kept".format(fq_file,kept,records))